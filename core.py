@@ -7,18 +7,24 @@ Authors: L.Rinaldi, G.Guidicini, N.Golinucci, M.A.Tahavori, M.V.Rocco
 """
 
 
-def analysis_application(nL, analysis, ML_iot_coeff_0, indices_agg, multi_indices):
+def analysis_application(nL, analysis, ML_iot_coeff_0, indices_agg, multi_indices, layers=None, solver='lu', solver_tol=1e-10, workers=1, shock_spec=None):
     """
     This function represents the actual core of the model, performing the desired type of analysis.
     Inputs:
         nL             - Number of layers (economic + physical layers)
-        analysis       - Desired type of analysis
+        analysis       - Desired type of analysis: 'SA' (shock analysis)
         ML_iot_coeff_0 - Dictionary containing technical coefficients for the IOT-like tables
         indices_agg    - Dictionary containing aggregated indices
         multi_indices  - Dictionary containing multi-indices for the selected database
+        layers         - List of the ids of the selected layers. If None, the first nL layers are considered
+        solver         - Method solving the Leontief models: 'lu', 'gmres', 'bicgstab' or 'series' (see 'LeontiefSolver')
+        solver_tol     - Relative tolerance of the iterative solvers and of the power series
+        workers        - Number of threads solving the layers of the Leontief models. If 1 the layers are solved serially
+        shock_spec     - Path of a declarative shock specification ('SA', see 'SA_delta_spec'), or list of its records.
+                         If None, the perturbations are input through the Excel files (see 'SA_delta_dict')
     Output:
         ML_iot_1       - Dictionary containing perturbed IOT-like tables
-        x_1            - Perturbed output vectors       
+        x_1            - Perturbed output vectors
     """
     
     if analysis == 'SA':
@@ -27,16 +33,21 @@ def analysis_application(nL, analysis, ML_iot_coeff_0, indices_agg, multi_indice
         
         """
         SHOCK ANALYSIS 
-        The user will be required to input perturbed technical coefficients/final demand matrices. 
-        The Leontief Production, Impact and Price Models are then applied.
+        The perturbations are compiled from the shock specification or, if missing, the user will be required to input 
+        perturbed technical coefficients/final demand matrices. 
+        The Leontief Production and Impact Models are then applied (see 'price_application' for the Price Model).
         """
         
-        from pySUT.applications.shock_analysis.perturbations import SA_delta_dict
+        from pySUT.applications.shock_analysis.perturbations import SA_delta_dict, SA_delta_spec
         from pySUT.applications.shock_analysis.shocked_matrices import calc_A_s, calc_w_s, calc_m_s, calc_B_s, calc_Y_s
-        from pySUT.applications.shock_analysis.leontief_models import calc_L_1, calc_Y_tot_1, calc_x_1, calc_R_1, calc_E_1
+        from pySUT.applications.shock_analysis.leontief_models import calc_L_1, calc_L_1_update, calc_Y_tot_1, calc_x_1, calc_R_1, calc_E_1
         from pySUT.applications.tables_recalc import calc_Z_1, calc_W_1, calc_M_1, ML_iot_1
         
-        ML_delta_coeff = SA_delta_dict(nL, indices_agg)
+        if shock_spec is None:
+            ML_delta_coeff = SA_delta_dict(nL, indices_agg, layers)
+        else:
+            ML_delta_coeff = SA_delta_spec(nL, indices_agg, shock_spec, ML_iot_coeff_0, layers)      # Sparse perturbations
+        overlay = shock_spec is not None         # Sparse perturbations: shocked matrices as baseline + copy-on-write overlay
         
         A_0 = ML_iot_coeff_0['A']                # Extracting initial endogenous coefficients matrices
         w_0 = ML_iot_coeff_0['w']                # Extracting initial value added coefficients matrices
@@ -50,17 +61,18 @@ def analysis_application(nL, analysis, ML_iot_coeff_0, indices_agg, multi_indice
         delta_B = ML_delta_coeff['delta_B']      # Extracting perturbations on exogenous coefficients matrix
         delta_Y = ML_delta_coeff['delta_Y']      # Extracting perturbations on final demand matrices
         
-        A_1 = calc_A_s(A_0, delta_A)           # Calculating perturbed endogenous coefficients matrices
-        w_1 = calc_w_s(w_0, delta_w)           # Calculating perturbed value added coefficients matrices
-        m_1 = calc_m_s(m_0, delta_m)           # Calculating perturbed imports coefficients matrices
-        B_1 = calc_B_s(B_0, delta_B)           # Calculating perturbed exogenous coefficients matrix
-        Y_1 = calc_Y_s(Y_0, delta_Y)           # Calculating perturbed final demand matrices    
+        A_1 = calc_A_s(A_0, delta_A, overlay)  # Calculating perturbed endogenous coefficients matrices
+        w_1 = calc_w_s(w_0, delta_w, overlay)  # Calculating perturbed value added coefficients matrices
+        m_1 = calc_m_s(m_0, delta_m, overlay)  # Calculating perturbed imports coefficients matrices
+        B_1 = calc_B_s(B_0, delta_B, overlay)  # Calculating perturbed exogenous coefficients matrix
+        Y_1 = calc_Y_s(Y_0, delta_Y, overlay)  # Calculating perturbed final demand matrices    
         
         
         # Application of Leontief Models
         
         # Leontief Production Model
-        L = calc_L_1(A_1)                          # Leontief Inverse Matrix
+        L_0 = calc_L_1(A_0, method=solver, tol=solver_tol, workers=workers)    # Baseline Leontief Inverse Matrix (factorized, or solved iteratively)
+        L = calc_L_1_update(L_0, delta_A)        # Shocked Leontief Inverse Matrix: low-rank update of L_0, or refactorization
         Y_tot_1 = calc_Y_tot_1(Y_1)              # Calculating the total final demand vector
         x_1 = calc_x_1(L,Y_tot_1)                # Calculating the new level of production required
         
@@ -68,9 +80,6 @@ def analysis_application(nL, analysis, ML_iot_coeff_0, indices_agg, multi_indice
         R_1 = calc_R_1(B_1,L,Y_tot_1)            # Calculating the direct exogenous transactions matrix
         E_1 = calc_E_1(B_1,L,Y_tot_1)            # Calculating the embodied exogenous transactions matrix
         
-        # Leontief Price Model
-        
-        
     # Calculation of new absolute values matrices
     Z_1 = calc_Z_1(A_1,x_1)                    # Calculating new endogenous transaction matrices
     W_1 = calc_W_1(w_1,x_1)                    # Calculating new value added matrices
@@ -78,4 +87,204 @@ def analysis_application(nL, analysis, ML_iot_coeff_0, indices_agg, multi_indice
     
     ML_iot_1 = ML_iot_1(Z_1,W_1,M_1,Y_1,R_1,E_1)
     
-    return(ML_iot_1,x_1)
\ No newline at end of file
+    return(ML_iot_1,x_1)
+
+
+def price_application(nL, ML_iot_coeff, delta_v=None, solver='lu', solver_tol=1e-10, workers=1):
+    """
+    This function applies the Leontief Price Model, p = v @ L, to the economic layer of a set of technical coefficients:
+    the baseline ones, or those of the perturbed tables returned by 'analysis_application' (see 'technical_coefficients').
+    Inputs:
+        nL             - Number of layers (economic + physical layers)
+        ML_iot_coeff   - Dictionary containing technical coefficients for the IOT-like tables
+        delta_v        - Optional batch of value added shocks: (n,) vector or (nS, n) matrix, one shock per row
+        solver         - Method solving the Leontief model: 'lu', 'gmres', 'bicgstab' or 'series' (see 'LeontiefSolver')
+        solver_tol     - Relative tolerance of the iterative solvers and of the power series
+        workers        - Number of threads solving the layers of the Leontief model. If 1 the layers are solved serially
+    Output:
+        p_1            - Price indices (1, n), or (nS, n) price indices of the value added shocks
+    """
+    
+    print('\n\nPRICE MODEL\n')
+    
+    from pySUT.applications.shock_analysis.leontief_models import calc_L_1, calc_v_1, calc_p_1
+    
+    L = calc_L_1(ML_iot_coeff['A'][0], method=solver, tol=solver_tol, workers=workers)     # Leontief Inverse Matrix of the economic layer
+    v_1 = calc_v_1(ML_iot_coeff['w'], ML_iot_coeff['m'], delta_v)     # Calculating the primary inputs coefficients vector
+    p_1 = calc_p_1(L, v_1)                                             # Calculating the price indices (cost-push)
+    
+    return(p_1)
+
+
+def scenario_application(nL, ML_iot_coeff_0, delta_Y, solver='lu', solver_tol=1e-10, workers=1):
+    """
+    This function applies the Leontief Production and Impact Models to a batch of final demand scenarios,
+    all sharing the baseline technical coefficients: (I - A) is factorized once and every scenario is a right-hand side.
+    Inputs:
+        nL             - Number of layers (economic + physical layers)
+        ML_iot_coeff_0 - Dictionary containing technical coefficients for the IOT-like tables
+        delta_Y        - Final demand perturbations: dense (nS, nL, n, nY) array or list of nS perturbations (see 'calc_Y_tot_S')
+        solver         - Method solving the Leontief models: 'lu', 'gmres', 'bicgstab' or 'series' (see 'LeontiefSolver')
+        solver_tol     - Relative tolerance of the iterative solvers and of the power series
+        workers        - Number of threads solving the layers of the Leontief models. If 1 the layers are solved serially
+    Output:
+        ML_scenarios_1 - Dictionary containing the scenario-indexed total final demand vectors 'Y_tot' (nS, nL, n, 1),
+                         output vectors 'x' (nS, nL, n, 1), direct 'R' (nS, nR, n) and embodied 'E' (nS, nR, n) exogenous transactions
+    """
+    
+    print('\n\nSCENARIO ANALYSIS\n')
+    
+    from pySUT.applications.shock_analysis.leontief_models import calc_L_1
+    from pySUT.applications.shock_analysis.scenarios import calc_Y_tot_S, calc_x_S, calc_R_S, calc_E_S, ML_scenarios_1
+    
+    A_0 = ML_iot_coeff_0['A']                # Extracting initial endogenous coefficients matrices
+    B_0 = ML_iot_coeff_0['B']                # Extracting initial exogenous coefficients matrix
+    Y_0 = ML_iot_coeff_0['Y']                # Extracting initial final demand matrices
+    
+    L = calc_L_1(A_0, method=solver, tol=solver_tol, workers=workers)      # Leontief Inverse Matrix, factorized once for all the scenarios
+    Y_tot_S = calc_Y_tot_S(Y_0, delta_Y)     # Calculating the total final demand vectors of every scenario
+    x_S = calc_x_S(L, Y_tot_S)               # Calculating the production of every scenario (multi-right-hand-side solve)
+    
+    R_S = calc_R_S(B_0, x_S)                 # Calculating the direct exogenous transactions matrices of every scenario
+    E_S = calc_E_S(B_0, L, Y_tot_S)          # Calculating the embodied exogenous transactions matrices of every scenario
+    
+    ML_scenarios_1 = ML_scenarios_1(Y_tot_S, x_S, R_S, E_S)
+    
+    return(ML_scenarios_1)
+
+
+def uncertainty_application(nL, ML_iot_coeff_0, distributions, draws, batch=100, quantiles=(0.05,0.5,0.95), seed=None, workers=1):
+    """
+    This function propagates the uncertainty of the technical coefficients to the output vectors and to the embodied
+    exogenous transactions through Monte Carlo simulation, streaming the statistics of the draws (see 'monte_carlo').
+    Inputs:
+        nL             - Number of layers (economic + physical layers)
+        ML_iot_coeff_0 - Dictionary containing technical coefficients for the IOT-like tables
+        distributions  - Dictionary of the distributions of the coefficients, e.g. {'A': {'dist': 'lognormal', 'scale': 0.1}}
+        draws          - Number of draws
+        batch          - Number of draws generated and solved together
+        quantiles      - Probabilities of the estimated quantiles
+        seed           - Seed of the simulation
+        workers        - Number of processes sharing the draws. If 1 the draws are run in this process
+    Output:
+        ML_mc          - Dictionary of the statistics (count, mean, var, std, min, max, quantiles) of 'x' and 'E'
+    """
+    
+    print('\n\nMONTE CARLO ANALYSIS\n')
+    
+    from pySUT.applications.monte_carlo import monte_carlo
+    
+    ML_mc = monte_carlo(ML_iot_coeff_0, distributions, draws, batch, quantiles, seed=seed, workers=workers)
+    
+    return(ML_mc)
+
+
+def sensitivity_application(nL, ML_iot_coeff_0, indices_agg, target='x', weights=None, k=10, layer=0, solver='lu', solver_tol=1e-10):
+    """
+    This function computes the analytic derivatives and elasticities of a target of the Leontief models ('x', 'R' or 'E')
+    with respect to every coefficient of A, B and Y, ranking the most influential ones (see 'sensitivity').
+    Inputs:
+        nL             - Number of layers (economic + physical layers)
+        ML_iot_coeff_0 - Dictionary containing technical coefficients for the IOT-like tables
+        indices_agg    - Dictionary containing aggregated indices
+        target         - 'x' (output), 'R' (direct exogenous transactions) or 'E' (embodied exogenous transactions)
+        weights        - Weights of the target elements ((n,) for 'x', (nR, n) for 'R' and 'E'). If None, the total is considered
+        k              - Number of coefficients ranked for each matrix
+        layer          - Layer of the target 'x'
+        solver         - Method solving the Leontief models: 'lu', 'gmres', 'bicgstab' or 'series' (see 'LeontiefSolver')
+        solver_tol     - Relative tolerance of the iterative solvers and of the power series
+    Output:
+        ML_sens        - Dictionary of the target value 'f' and of the derivative maps 'A', 'B' and 'Y'
+        ML_elas        - Dictionary of the elasticity maps 'A', 'B' and 'Y'
+        top            - Dictionary of the k coefficients of 'A', 'B' and 'Y' with the largest elasticities (DataFrames)
+    """
+    
+    print('\n\nSENSITIVITY ANALYSIS\n')
+    
+    from pySUT.applications.shock_analysis.leontief_models import calc_L_1
+    from pySUT.applications.sensitivity import calc_sensitivity, calc_elasticity, top_coefficients
+    
+    A_0 = ML_iot_coeff_0['A']                # Extracting initial endogenous coefficients matrices
+    B_0 = ML_iot_coeff_0['B']                # Extracting initial exogenous coefficients matrix
+    Y_0 = ML_iot_coeff_0['Y']                # Extracting initial final demand matrices
+    
+    L = calc_L_1(A_0, method=solver, tol=solver_tol)      # Leontief Inverse Matrix, shared by the direct and transposed solves
+    
+    ML_sens = calc_sensitivity(L, B_0, Y_0, target, weights, layer)        # Derivatives of the target
+    ML_elas = calc_elasticity(ML_sens, A_0, B_0, Y_0, layer if target == 'x' else 0)   # Elasticities of the target
+    
+    zInd = indices_agg['prod'].append(indices_agg['ind'])                  # Products and industries labels
+    labels = {'A': (zInd, zInd), 'B': (indices_agg['exog'], zInd), 'Y': (zInd, indices_agg['fd'])}
+    top = {key: top_coefficients(ML_elas[key], k, *labels[key]) for key in ['A','B','Y']}
+    
+    return(ML_sens, ML_elas, top)
+
+
+def spa_application(nL, ML_iot_coeff_0, indices_agg, exog=None, sectors=None, top=10, threshold=1e-4, max_depth=None, max_time=10,
+                    max_nodes=10**6, max_memory=512, solver='lu', solver_tol=1e-10):
+    """
+    This function performs the structural path analysis of the embodied exogenous transactions, returning the top supply-chain
+    paths of each satellite item and sector within explicit limits on time, nodes and memory (see 'structural_paths').
+    Inputs:
+        nL             - Number of layers (economic + physical layers)
+        ML_iot_coeff_0 - Dictionary containing technical coefficients for the IOT-like tables
+        indices_agg    - Dictionary containing aggregated indices
+        exog           - List of the positions of the analysed satellite items. If None, all the items
+        sectors        - List of the positions of the analysed sectors. If None, all the sectors with final demand
+        top            - Number of paths returned for each satellite item and sector
+        threshold      - Contribution below which supply-chain branches are pruned, relative to the embodied transaction
+        max_depth      - Maximum path length. If None, unlimited
+        max_time       - Maximum time of each search, in seconds
+        max_nodes      - Maximum number of nodes expanded by each search
+        max_memory     - Maximum memory of each search tree, in MB
+        solver         - Method solving the Leontief model: 'lu', 'gmres', 'bicgstab' or 'series' (see 'LeontiefSolver')
+        solver_tol     - Relative tolerance of the iterative solvers and of the power series
+    Output:
+        paths_0        - DataFrame of the top paths of each satellite item and sector
+        info_0         - DataFrame of the statistics of each search (coverage of the embodied transaction, nodes, time, truncation)
+    """
+    
+    print('\n\nSTRUCTURAL PATH ANALYSIS\n')
+    
+    from pySUT.applications.structural_paths import calc_SPA
+    
+    zInd = indices_agg['prod'].append(indices_agg['ind'])                  # Products and industries labels
+    labels = {'sectors': list(zInd), 'exog': list(indices_agg['exog'])}
+    
+    paths_0, info_0 = calc_SPA(ML_iot_coeff_0, exog, sectors, top, threshold, max_depth, max_time, max_nodes, max_memory, labels, solver, solver_tol)
+    
+    return(paths_0, info_0)
+
+
+def hem_application(nL, ML_iot_coeff_0, indices_agg, hem_level=None, solver='lu', solver_tol=1e-10, workers=1):
+    """
+    This function performs the hypothetical extraction of every sector (or group of sectors sharing a label at 'hem_level')
+    from the economic layer. The extracted outputs are obtained from the baseline Leontief inverse through rank-update
+    identities, without new inversions (see 'extraction').
+    Inputs:
+        nL             - Number of layers (economic + physical layers)
+        ML_iot_coeff_0 - Dictionary containing technical coefficients for the IOT-like tables
+        indices_agg    - Dictionary containing aggregated indices
+        hem_level      - Level of the products/industries indices grouping the sectors extracted together. If None, every sector is extracted alone
+        solver         - Method solving the Leontief model: 'lu', 'gmres', 'bicgstab' or 'series' (see 'LeontiefSolver')
+        solver_tol     - Relative tolerance of the iterative solvers and of the power series
+        workers        - Number of threads solving the layers of the Leontief model. If 1 the layers are solved serially
+    Output:
+        x_loss         - DataFrame of the output losses of every extracted sector (or group)
+        E_loss         - DataFrame of the embodied exogenous transactions losses of every extracted sector (or group)
+    """
+    
+    print('\n\nHYPOTHETICAL EXTRACTION\n')
+    
+    from pySUT.applications.shock_analysis.leontief_models import calc_L_1
+    from pySUT.applications.extraction import extraction_groups, calc_x_hem, calc_hem_losses
+    
+    L_0 = calc_L_1(ML_iot_coeff_0['A'], method=solver, tol=solver_tol, workers=workers)    # Baseline Leontief Inverse Matrix
+    
+    zInd = indices_agg['prod'].append(indices_agg['ind'])                  # Products and industries labels
+    groups = extraction_groups(zInd, hem_level)                             # Sectors extracted together
+    
+    x_0, x_hem = calc_x_hem(L_0, ML_iot_coeff_0['Y'], groups)               # Outputs after each extraction
+    x_loss, E_loss = calc_hem_losses(x_0, x_hem, ML_iot_coeff_0['B'], groups, list(indices_agg['exog']))
+    
+    return(x_loss, E_loss)
\ No newline at end of file
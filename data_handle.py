@@ -1,9 +1,6 @@
-import numpy as np
-
-
 #%% Importing tables
 
-def tables_import(nL, database, year, country):
+def tables_import(nL, database, year, country, cache=False, workers=1, storage='ram', layers=None, sparse=False):
     """
     Calling functions dedicated to import indices and downloaded/prepared supply-use tables 
     Inputs:
@@ -11,6 +8,13 @@ def tables_import(nL, database, year, country):
         database - Database selected for the analysis
         year     - Year selected for the analysis
         country  - Country selected for the analysis
+        cache    - If True, tables are loaded from the binary cache when the source workbooks did not change,
+                   otherwise they are imported from the workbooks and the cache is rebuilt
+        workers  - Number of worker processes used to read the workbooks (1 == serial import)
+        storage  - 'ram' to hold the tables as in-memory arrays, 'mmap' to open them from the memory-mapped store
+                   (the store is converted from the workbooks when missing or outdated)
+        layers   - List of layer ids to be imported (0 == economic layer, l == 'Physical_layer_l'). If None, the first nL layers are imported
+        sparse   - If True, tables are returned as scipy.sparse matrices (multi-layer stacks as lists of sparse layers)
     Outputs:
         indices       - Dictionary containing indices for the selected database
         multi_indices - Dictionary containing multi-indices for the selected database
@@ -18,16 +22,74 @@ def tables_import(nL, database, year, country):
     """
     
     from pySUT.tables.tables_import import indicesImport, sutImport
+    
+    if storage == 'mmap':
+        from pySUT.tables.tables_store import storeImport
+        from pySUT.tables.sparse_tables import ML_sparse
+        indices, multi_indices, ML_sut = storeImport(nL, database, year, country, layers)
+        if sparse:
+            ML_sut = ML_sparse(ML_sut)       # Memory-mapped layers are converted one at a time
+        return(indices, multi_indices, ML_sut)
+    
+    if cache:
+        from pySUT.tables.tables_cache import cacheLoad, cacheSave
+        cached = cacheLoad(nL, database, year, country, layers, sparse)
+        if cached is not None:
+            return(cached)
+    
     indices, multi_indices = indicesImport(database,  year, country)
-    ML_sut = sutImport(nL, database, year, country, indices)
+    ML_sut = sutImport(nL, database, year, country, indices, workers, layers, sparse)
+    
+    if cache:
+        cacheSave(nL, database, year, country, indices, multi_indices, ML_sut, layers)
     
     return(indices, multi_indices, ML_sut)
 
 
 
+#%% Aggregation pyramid
+
+def aggregation_pyramid(nL, database, year, country, indices, multi_indices, ML_sut, layers=None, cache=False):
+    """
+    This function returns the aggregation of the supply-use tables at every (agg_level, rect_level) combination of header levels.
+    The pyramid is computed once and, if cache is True, stored next to the cached tables, so that later runs just look it up.
+    Inputs:
+        nL            - Number of layers (economic + physical layers)
+        database      - Database selected for the analysis
+        year          - Year selected for the analysis
+        country       - Country selected for the analysis
+        indices       - Dictionary containing indices for the selected database
+        multi_indices - Dictionary containing multi-indices for the selected database
+        ML_sut        - Dictionary containing imported multi-layer supply-use tables
+        layers        - List of the ids of the imported layers
+        cache         - If True, the pyramid is loaded from/saved into the binary cache
+    Output:
+        pyramid       - Dictionary of (ML_sut_agg, indices_agg) keyed by (agg_level, rect_level)
+    """
+    
+    from pySUT.parsing.parser import sut_pyramid
+    from pySUT.tables.sparse_tables import isSparse
+    
+    sparse = isSparse(ML_sut['U'])
+    
+    if cache:
+        from pySUT.tables.tables_cache import pyramidLoad, pyramidSave
+        pyramid = pyramidLoad(nL, database, year, country, layers, sparse)
+        if pyramid is not None:
+            return(pyramid)
+    
+    pyramid = sut_pyramid(nL, indices, multi_indices, ML_sut)
+    
+    if cache:
+        pyramidSave(nL, database, year, country, pyramid, layers, sparse)
+    
+    return(pyramid)
+
+
+
 #%% Reshaping supply-use multilayer tables into IOT-like multilayer framework + check balance
 
-def sut_to_iot(nL, database, year, country, tol, indices_agg, ML_sut_agg):    
+def sut_to_iot(nL, database, year, country, tol, indices_agg, ML_sut_agg, blocks=False, layers=None):    
     """
     This function converts the prepared supply-use multi-layer tables into an IOT-like framework and checks balance for each layer. 
     Inputs:
@@ -38,21 +100,25 @@ def sut_to_iot(nL, database, year, country, tol, indices_agg, ML_sut_agg):
         tol         - Percentage tollerance to be respected to consider a row/column as balanced
         indices_agg - Dictionary containing aggregated indices
         ML_sut_agg  - Dictionary containing aggregated multi-layer supply-use tables
+        blocks      - If True, dense IOT-like matrices are returned as block matrices defined over the supply-use blocks (see 'block_matrix'),
+                      which are materialised only on demand
+        layers      - List of layer ids (see 'layersSelect'), used to label the balance report
     Outputs:
         ML_iot_0      - Dictionary containing aggregated IOT-like tables
         x_0           - Multi-layer output vectors
         xT_0          - Multi-layer outlays vectors
         check_0       - nL-d array containing the difference between output and outlays vectors for each layer
         unbalances_0  - List of tuples containing information about (layer, row) positions of potential unbalances 
+        report_0      - DataFrame reporting output, outlays, absolute and relative gaps of every row of every layer, sorted by severity
     """
     
-    from pySUT.parsing.sut_to_iot import Z_reshape, W_reshape, M_reshape, R_reshape, Y_reshape, ML_iot_0, calc_x_0, calc_xT_0, balance_check_0
+    from pySUT.parsing.sut_to_iot import Z_reshape, W_reshape, M_reshape, R_reshape, Y_reshape, ML_iot_0, calc_x_0, calc_xT_0, balance_check_0, balance_report
     
-    Z_0 = Z_reshape(nL,ML_sut_agg)
-    W_0 = W_reshape(nL,ML_sut_agg)
-    M_0 = M_reshape(nL,ML_sut_agg)
-    R_0 = R_reshape(nL,ML_sut_agg)
-    Y_0 = Y_reshape(nL,ML_sut_agg,indices_agg)
+    Z_0 = Z_reshape(nL,ML_sut_agg,blocks)
+    W_0 = W_reshape(nL,ML_sut_agg,blocks)
+    M_0 = M_reshape(nL,ML_sut_agg,blocks)
+    R_0 = R_reshape(nL,ML_sut_agg,blocks)
+    Y_0 = Y_reshape(nL,ML_sut_agg,indices_agg,blocks)
     
     ML_iot_0 = ML_iot_0(Z_0, W_0, M_0, Y_0, R_0)
     
@@ -60,8 +126,49 @@ def sut_to_iot(nL, database, year, country, tol, indices_agg, ML_sut_agg):
     xT_0 = calc_xT_0(nL,ML_iot_0,indices_agg,database)
     
     check_0, unbalances_0 = balance_check_0(nL,x_0,xT_0,tol)
+    report_0 = balance_report(x_0,xT_0,indices_agg,tol,layers)
+
+    return(ML_iot_0, x_0, xT_0, check_0, unbalances_0, report_0)
+
+
+#%% Balancing of unbalanced layers
+
+def iot_balancing(nL, database, tol, indices_agg, ML_iot_0, unbalances_0, method='GRAS', tol_bal=1e-9, max_iter=1000, start=None, layers=None):
+    """
+    This function rebalances, through RAS or GRAS iterations, the IOT-like tables of the layers in which 'balance_check_0' found unbalances,
+    and checks balance again. Balanced layers are left unchanged.
+    Inputs:
+        nL           - Number of layers (economic + physical layers)
+        database     - Database selected for the analysis
+        tol          - Percentage tollerance to be respected to consider a row/column as balanced
+        indices_agg  - Dictionary containing aggregated indices
+        ML_iot_0     - Dictionary containing aggregated IOT-like tables
+        unbalances_0 - List of tuples containing information about (layer, row) positions of unbalances, as returned by 'sut_to_iot'
+        method       - Balancing method: 'RAS' (non-negative tables) or 'GRAS' (tables with negative entries)
+        tol_bal      - Relative gap between output and outlays at which the iterations stop
+        max_iter     - Maximum number of iterations
+        start        - Multipliers returned by a previous balancing, used as a warm start
+        layers       - List of layer ids (see 'layersSelect'), used to label the balance report
+    Outputs:
+        ML_iot_0, x_0, xT_0, check_0, unbalances_0, report_0 as returned by 'sut_to_iot', for the balanced tables
+        multipliers_0 - (r, s) row and column multipliers, to be passed as 'start' to later balancings
+        info_0        - Dictionary containing method, iterations, time, residual gaps and convergence of each layer
+    """
+    
+    from pySUT.parsing.balancing import iot_balance
+    from pySUT.parsing.sut_to_iot import calc_x_0, calc_xT_0, balance_check_0, balance_report
+    
+    active = sorted(set(l for l, i in unbalances_0))        # Positions of the unbalanced layers
+    
+    ML_iot_0, multipliers_0, info_0 = iot_balance(ML_iot_0, method, 'mean', tol_bal, max_iter, start, active)
+    
+    x_0 = calc_x_0(nL,ML_iot_0,indices_agg,database)
+    xT_0 = calc_xT_0(nL,ML_iot_0,indices_agg,database)
+    
+    check_0, unbalances_0 = balance_check_0(nL,x_0,xT_0,tol)
+    report_0 = balance_report(x_0,xT_0,indices_agg,tol,layers)
 
-    return(ML_iot_0, x_0, xT_0, check_0, unbalances_0)
+    return(ML_iot_0, x_0, xT_0, check_0, unbalances_0, report_0, multipliers_0, info_0)
 
 
 #%% Technical coefficients calculation
@@ -97,12 +204,15 @@ def technical_coefficients(ML_iot_0, x_0):
     
 #%% Initial embodied exogenous transactions matrix calculation
     
-def calc_E_0(ML_iot_coeff_0,x_0):
+def calc_E_0(ML_iot_coeff_0,x_0,solver='lu',solver_tol=1e-10):
     """
     This function calculates the initial embodied exogenous transaction matrix.
+    B_0 @ L_0 is obtained through a transposed solve on the LU factorization of (I - A_0) (see 'LeontiefSolver'), without forming L_0.
     Inputs:
         ML_iot_coeff_0 - Dictionary containing technical coefficients for the IOT-like tables
         x_0            - Multi-layer output vectors
+        solver         - Method solving the Leontief model: 'lu', 'gmres', 'bicgstab' or 'series' (see 'LeontiefSolver')
+        solver_tol     - Relative tolerance of the iterative solvers and of the power series
     Outputs:
         E_0            - Initial embodied exogenous transaction matrix
     """
@@ -110,13 +220,40 @@ def calc_E_0(ML_iot_coeff_0,x_0):
     B_0 = ML_iot_coeff_0['B']
     A_0 = ML_iot_coeff_0['A'][0]
     Y_0 = ML_iot_coeff_0['Y'][0]
-    Y_tot_0 = np.sum(Y_0,1,keepdims=True)
     
-    L_0 = np.linalg.inv(np.eye(A_0.shape[0]) - A_0)
+    from pySUT.tables.sparse_tables import rowSum
+    from pySUT.applications.rescaling import colScale
+    from pySUT.applications.leontief_solver import LeontiefSolver
+    Y_tot_0 = rowSum(Y_0)
     
-    E_0 = (B_0 @ L_0) @ np.diagflat(Y_tot_0)
+    BL_0 = LeontiefSolver(A_0, method=solver, tol=solver_tol).solve_transpose(B_0)           # B_0 @ L_0, through a transposed solve with (I - A_0)
+    
+    E_0 = colScale(BL_0, Y_tot_0)
 
     return(E_0)
 
 
+def calc_p_0(ML_iot_coeff_0,delta_v=None,solver='lu',solver_tol=1e-10):
+    """
+    This function calculates the initial price indices through the Leontief Price Model, p_0 = v_0 @ L_0.
+    The transposed solve reuses the factorization of (I - A_0) cached by 'calc_E_0' (see 'LeontiefSolver').
+    Inputs:
+        ML_iot_coeff_0 - Dictionary containing technical coefficients for the IOT-like tables
+        delta_v        - Optional batch of value added shocks: (n,) vector or (nS, n) matrix, one shock per row
+        solver         - Method solving the Leontief model: 'lu', 'gmres', 'bicgstab' or 'series' (see 'LeontiefSolver')
+        solver_tol     - Relative tolerance of the iterative solvers and of the power series
+    Outputs:
+        p_0            - Initial price indices (1, n), or (nS, n) price indices of the value added shocks
+    """
+    
+    from pySUT.applications.shock_analysis.leontief_models import calc_L_1, calc_v_1, calc_p_1
+    
+    L_0 = calc_L_1(ML_iot_coeff_0['A'][0], method=solver, tol=solver_tol)
+    v_0 = calc_v_1(ML_iot_coeff_0['w'], ML_iot_coeff_0['m'], delta_v)
+    
+    p_0 = calc_p_1(L_0, v_0)
+    
+    return(p_0)
+
+
     
\ No newline at end of file
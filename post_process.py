@@ -25,7 +25,12 @@ def dict_delta_1_0(ML_iot_0,ML_iot_1,x_0,x_1,E_0):
         E_0       - Initial embodied exogenous transaction matrix
     Outputs:
         delta_1_0 - Dictionary containing variations from the initial to the after-perturbation situation
+    Sparse matrices are densified, since variations are exported into xlsx files.
     """
+    
+    from pySUT.tables.sparse_tables import denseStack
+    ML_iot_0 = {key: denseStack(matrix) for key, matrix in ML_iot_0.items()}
+    ML_iot_1 = {key: denseStack(matrix) for key, matrix in ML_iot_1.items()}
 
     Z_0 = ML_iot_0['Z']
     Z_1 = ML_iot_1['Z']
@@ -75,10 +80,14 @@ def dict_delta_1_0(ML_iot_0,ML_iot_1,x_0,x_1,E_0):
 
 #%% Export in excel file
     
-def xlsx_export(nL, ML_iot_0, ML_iot_1, x_0, x_1, E_0, indices_agg, database, country, year):
+def xlsx_export(nL, ML_iot_0, ML_iot_1, x_0, x_1, E_0, indices_agg, database, country, year, layers=None):
     """
     This function exports the new variations calculated in the 'dict_delta_1_0' functions into xlsx files.
+    Physical layers files are named after the ids in 'layers' (the first nL layers if None).
     """
+    
+    if layers is None:
+        layers = list(range(nL))
         
     delta_1_0 = dict_delta_1_0(ML_iot_0,ML_iot_1,x_0,x_1,E_0)
 
@@ -92,7 +101,7 @@ def xlsx_export(nL, ML_iot_0, ML_iot_1, x_0, x_1, E_0, indices_agg, database, co
             pd.DataFrame(delta_1_0['delta_x'][l], index=indices_agg['prod']+indices_agg['ind']).to_excel(output_economic,'delta_x')
             output_economic.save()
         else:
-            output_physical = pd.ExcelWriter('pySUT/output/'+str(database)+'/'+str(country)+'/'+str(year)+'/output_physical_'+str(l)+'.xlsx', engine='xlsxwriter') 
+            output_physical = pd.ExcelWriter('pySUT/output/'+str(database)+'/'+str(country)+'/'+str(year)+'/output_physical_'+str(layers[l])+'.xlsx', engine='xlsxwriter') 
             pd.DataFrame(delta_1_0['delta_Z'][l], index=indices_agg['prod']+indices_agg['ind'], columns=indices_agg['prod']+indices_agg['ind']).to_excel(output_physical,'delta_A')
             pd.DataFrame(delta_1_0['delta_W'][l], index=indices_agg['vadd'], columns=indices_agg['prod']+indices_agg['ind']).to_excel(output_physical,'delta_W')
             pd.DataFrame(delta_1_0['delta_M'][l], index=indices_agg['imp'], columns=indices_agg['prod']+indices_agg['ind']).to_excel(output_physical,'delta_M')
@@ -0,0 +1,114 @@
+import numpy as np
+import pandas as pd
+from pySUT.tables.sparse_tables import rowSum
+from pySUT.applications.shock_analysis.leontief_models import isFactorized
+
+
+#%% Hypothetical extraction method
+
+"""
+The importance of a sector (or group of sectors) S is measured by the output and embodied exogenous transactions lost
+when it is hypothetically extracted from the economy: its rows and columns of A and its final demand are removed.
+The extracted outputs x* = (I - A_NN)^-1 y_N are obtained from the baseline Leontief inverse through the identity
+(I - A_NN)^-1 = L_NN - L_NS L_SS^-1 L_SN, without any new inversion:
+    x^S = L @ y_N = x - L[:,S] @ y_S                 (final demand of S removed)
+    x*  = x^S - L[:,S] @ L_SS^-1 @ x^S_S             (k x k solve for a group of k sectors; x*_S = 0)
+Single-sector extractions are computed for all the sectors at once by broadcasting over the columns of L, O(n^2) overall.
+The E losses are the losses of total embodied (or, equivalently, direct) exogenous transactions, B @ (x - x*).
+All the quantities refer to the economic layer.
+"""
+
+def extraction_groups(index, level=None):
+    """
+    This function returns the groups of sectors extracted together.
+    Inputs:
+        index  - Products and industries labels (pandas Index or MultiIndex)
+        level  - Level of the index defining the groups (name or position). If None, every sector is extracted alone
+    Output:
+        groups - List of (label, positions) pairs
+    """
+
+    if level is None:
+        return([(label, np.array([i])) for i, label in enumerate(index)])
+
+    keys = index.get_level_values(level) if isinstance(index, pd.MultiIndex) else index
+    codes, labels = pd.factorize(keys)
+
+    return([(label, np.flatnonzero(codes == g)) for g, label in enumerate(labels)])
+
+
+def leontiefColumns(L_1, cols, layer=0):
+    """
+    This function returns the columns 'cols' of the Leontief inverse, solving against the unit vectors for a 'LeontiefSolver'.
+    """
+
+    if isFactorized(L_1):
+        E = np.zeros((L_1.n, len(cols)))
+        E[cols, np.arange(len(cols))] = 1
+        return(L_1.solve(E, layer))
+
+    return(np.asarray(L_1)[layer][:, cols])
+
+
+def calc_x_hem(L_1, Y, groups, layer=0):
+    """
+    This function returns the output vectors following the hypothetical extraction of each group of sectors.
+    Inputs:
+        L_1    - Baseline Leontief Inverse Matrix ('LeontiefSolver' or explicit (nL, n, n) inverse)
+        Y      - Final demand matrices: dense (nL, n, nY) stack or list of sparse layers
+        groups - List of (label, positions) pairs (see 'extraction_groups')
+        layer  - Layer of the extraction
+    Outputs:
+        x_0    - (n,) baseline output vector
+        x_hem  - (n, nG) output vectors after each extraction, one column per group
+    """
+
+    y = rowSum(Y[layer]).ravel()
+    x_0 = L_1.solve(y, layer) if isFactorized(L_1) else np.asarray(L_1)[layer] @ y
+    positions = [g for label, g in groups]
+
+    if all(len(g) == 1 for g in positions):                  # Single sectors: all the extractions at once
+        s = np.concatenate(positions)
+        ns = np.arange(len(s))
+        L_s = leontiefColumns(L_1, s, layer)                 # (n, nG) columns of L
+        x_hem = x_0[:,None] - L_s*y[s]
+        x_hem -= L_s*(x_hem[s,ns]/L_s[s,ns])
+        x_hem[s,ns] = 0
+        return(x_0, x_hem)
+
+    x_hem = np.zeros((len(y), len(positions)))
+    for j, g in enumerate(positions):
+        L_g = leontiefColumns(L_1, g, layer)                 # (n, k) columns of L
+        x_s = x_0 - L_g @ y[g]
+        x_hem[:,j] = x_s - L_g @ np.linalg.solve(L_g[g,:], x_s[g])
+        x_hem[g,j] = 0
+
+    return(x_0, x_hem)
+
+
+def calc_hem_losses(x_0, x_hem, B, groups, labels=None):
+    """
+    This function returns the output and E losses of every extraction.
+    Inputs:
+        x_0      - (n,) baseline output vector
+        x_hem    - (n, nG) output vectors after each extraction
+        B        - Exogenous technical coefficients matrix (dense or sparse)
+        groups   - List of (label, positions) pairs (see 'extraction_groups')
+        labels   - Optional labels of the satellite items
+    Outputs:
+        x_loss   - DataFrame of the extracted sectors, total output loss, and its share of the baseline total output
+        E_loss   - DataFrame of the losses of total embodied exogenous transactions of each satellite item
+    """
+
+    delta = x_0[:,None] - x_hem
+    index = pd.Index([label for label, g in groups], tupleize_cols=False)
+
+    x_loss = pd.DataFrame({
+                          'sectors'      : [len(g) for label, g in groups],
+                          'output_loss'  : delta.sum(0),
+                          'output_share' : delta.sum(0)/x_0.sum() if x_0.sum() != 0 else np.nan,
+                          }, index=index)
+
+    E_loss = pd.DataFrame(np.asarray((B @ delta).T), index=index, columns=labels)
+
+    return(x_loss, E_loss)
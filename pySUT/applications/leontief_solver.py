@@ -0,0 +1,537 @@
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import scipy.sparse as sp
+from scipy.linalg import lu_factor, lu_solve
+from scipy.sparse.linalg import splu, spilu, gmres, bicgstab, LinearOperator
+from pySUT.tables.sparse_tables import isSparse
+from pySUT.applications.shock_analysis.overlay_matrix import OverlayMatrix
+
+
+#%% Factorization-based Leontief solver
+
+"""
+The Leontief inverse L = (I - A)^-1 is only needed through products such as x = L @ y (production model) or B @ L (impact model).
+The 'LeontiefSolver' class LU-factorizes (I - A) once per layer and solves those systems with the factors,
+forming L explicitly only on request. Factorizations are kept in a cache shared by all the solvers and keyed by
+the hash of the coefficients matrix, so that solvers built on the same A (e.g. baseline and shocked models sharing
+a layer) reuse them. Dense layers are factorized with LAPACK, sparse layers (see 'sparse_tables') with SuperLU.
+The cache is bounded by the memory of the factors it holds ('cache_bytes', least recently used first out) and is
+emptied by 'LeontiefSolver.clear_cache()'.
+
+Where (I - A) is too large to be factorized, the systems can be solved iteratively, never forming L nor its factors:
+    gmres, bicgstab - Preconditioned Krylov solvers ('ilu' incomplete LU or 'jacobi' diagonal preconditioner)
+    series          - Truncated Leontief power series L @ y = y + A @ y + A^2 @ y + ..., stopped by an a posteriori error bound (an estimate if ||A|| >= 1).
+                      Layers whose series diverges (spectral radius of A >= 1, e.g. physical layers) fall back to 'lu'
+Every solve appends its statistics (iterations, relative residual, error bound, convergence, time) to 'stats'.
+Layers are independent systems: 'solve_layers' solves a whole (nL, n, k) stack of right-hand sides, optionally
+dispatching the layers to a pool of threads (LAPACK and SuperLU release the GIL while factorizing and solving).
+
+Perturbations touching a few columns (or rows) of A, such as technology switches, are low-rank: delta_A = U @ Vt with
+U (n, k) and Vt (k, n). The 'WoodburySolver' class solves the shocked systems through the Sherman-Morrison-Woodbury
+identity (I - A - U Vt)^-1 = L_0 + L_0 U (I_k - Vt L_0 U)^-1 Vt L_0, reusing the baseline solver: 2k baseline solves and
+a k x k factorization per layer, O(k*n^2) instead of O(n^3). Layers whose perturbation has rank above 'max_rank' are refactorized.
+Shocked layers are kept as baseline + sparse overlay (see 'OverlayMatrix') and materialised only if refactorized.
+"""
+
+def layerKey(A):
+    """
+    This function returns the key identifying a dense or sparse coefficients matrix in the factorization cache.
+    """
+
+    h = hashlib.blake2b(digest_size=20)
+
+    if sp.issparse(A):
+        A = A.tocsr()
+        A.sum_duplicates()
+        h.update(b'sparse')
+        for array in [A.indptr, A.indices, A.data]:
+            h.update(np.ascontiguousarray(array).view(np.uint8))
+    else:
+        A = np.ascontiguousarray(A, dtype=float)
+        h.update(b'dense')
+        h.update(A.view(np.uint8))
+
+    h.update(str(A.shape).encode())
+
+    return(h.hexdigest())
+
+
+def factorBytes(lu):
+    """
+    This function returns the memory, in bytes, of a factorization (or preconditioner) stored in the cache.
+    """
+
+    if isinstance(lu, dict):
+        return(sum(factorBytes(item) for item in lu.values()))
+    if isinstance(lu, tuple):
+        return(sum(factorBytes(item) for item in lu))
+    if isinstance(lu, np.ndarray):
+        return(lu.nbytes)
+    if sp.issparse(lu):
+        lu = lu.tocsr()
+        return(lu.data.nbytes + lu.indices.nbytes + lu.indptr.nbytes)
+    if hasattr(lu, 'L') and hasattr(lu, 'U'):                       # SuperLU: values and row indices of L and U, permutations
+        return(12*(lu.L.nnz + lu.U.nnz) + lu.perm_r.nbytes + lu.perm_c.nbytes)
+
+    return(0)
+
+
+def lowRank(delta_A, max_rank=None):
+    """
+    This function detects the low-rank structure of a perturbation, writing it as delta_A = U @ Vt
+    over its non-null columns (or rows, if fewer).
+    Inputs:
+        delta_A  - Dense or sparse (n, n) perturbation
+        max_rank - Maximum accepted rank k. If None, n/4
+    Outputs:
+        U, Vt    - Dense (n, k) and (k, n) factors, or None if k exceeds max_rank
+    """
+
+    n = delta_A.shape[0]
+    max_rank = max(1, n//4) if max_rank is None else max_rank
+
+    if sp.issparse(delta_A):
+        delta_A = sp.csc_matrix(delta_A)
+        delta_A.eliminate_zeros()
+        cols = np.flatnonzero(delta_A.getnnz(0))
+        rows = np.flatnonzero(delta_A.getnnz(1))
+    else:
+        delta_A = np.asarray(delta_A, dtype=float)
+        cols = np.flatnonzero(np.any(delta_A != 0, 0))
+        rows = np.flatnonzero(np.any(delta_A != 0, 1))
+
+    if min(len(cols), len(rows)) > max_rank:
+        return(None)
+
+    if len(cols) <= len(rows):                  # delta_A = delta_A[:, cols] @ I[cols, :]
+        U = delta_A[:,cols]
+        Vt = np.eye(n)[cols,:]
+    else:                                       # delta_A = I[:, rows] @ delta_A[rows, :]
+        U = np.eye(n)[:,rows]
+        Vt = delta_A[rows,:]
+
+    U = U.toarray() if sp.issparse(U) else U
+    Vt = Vt.toarray() if sp.issparse(Vt) else Vt
+
+    return(U, Vt)
+
+
+def krylovSolve(M, y, method, tol, maxiter, precond=None, restart=None, transpose=False):
+    """
+    This function solves M @ x = y (or M^T @ x = y) column by column with a preconditioned Krylov method.
+    Inputs:
+        M         - Dense or sparse (n, n) matrix (I - A)
+        y         - (n,) vector or (n, k) matrix of right-hand sides
+        method    - 'gmres' or 'bicgstab'
+        tol       - Relative residual tolerance
+        maxiter   - Maximum number of iterations for each right-hand side
+        precond   - Preconditioner: incomplete LU factorization (spilu), (n,) diagonal for Jacobi or None
+        restart   - Restart parameter of GMRES
+        transpose - If True, the transposed system is solved
+    Outputs:
+        x         - Solution, with the shape of y
+        stats     - Dictionary of total iterations, maximum relative residual and convergence
+    """
+
+    n = M.shape[0]
+    Mt = M.T if transpose else M
+    trans = 'T' if transpose else 'N'
+
+    if precond is None:
+        P = None
+    elif isinstance(precond, np.ndarray):
+        P = LinearOperator((n, n), matvec=lambda v: v.ravel()/precond)
+    else:
+        P = LinearOperator((n, n), matvec=lambda v: precond.solve(np.asarray(v, dtype=float).ravel(), trans))
+
+    Y = y.reshape(n, -1)
+    X = np.zeros(Y.shape)
+    iterations, residual, converged = 0, 0.0, True
+
+    for j in range(Y.shape[1]):
+        count = [0]
+        def callback(*args):
+            count[0] += 1
+        options = {'maxiter': maxiter, 'M': P, 'callback': callback}
+        if method == 'gmres':
+            options.update({'restart': restart, 'callback_type': 'pr_norm'})
+        solver = gmres if method == 'gmres' else bicgstab
+        try:
+            X[:,j], info = solver(Mt, Y[:,j], rtol=tol, atol=0.0, **options)
+        except TypeError:                                                      # scipy < 1.12
+            X[:,j], info = solver(Mt, Y[:,j], tol=tol, atol=0.0, **options)
+
+        norm = np.linalg.norm(Y[:,j])
+        res = np.linalg.norm(Y[:,j] - Mt @ X[:,j])/norm if norm > 0 else 0.0
+        iterations += count[0]
+        residual = max(residual, res)
+        converged = converged and info == 0
+
+    return(X.reshape(y.shape), {'iterations': iterations, 'residual': residual, 'converged': converged})
+
+
+def powerSeries(A, y, tol, maxiter, norm=None, transpose=False, window=10):
+    """
+    This function computes L @ y (or y @ L if transpose is True) as the truncated power series y + A y + A^2 y + ...
+    Terms are added until the truncation error, q/(1 - q) * ||A^K y||, falls below tol relative to the partial sum.
+    If ||A|| < 1 (induced 1-norm, or inf-norm for the transposed series), q = ||A|| and the error is a rigorous a posteriori bound.
+    Otherwise q is estimated as the geometric mean ratio of the last 'window' terms, which tends to the spectral radius
+    of A: the error is then an estimate, not a bound, and is reported as such ('estimated' True in the statistics).
+    If the estimated q reaches 1 (or the terms overflow) the series diverges: it is stopped and reported as 'diverged'.
+    Inputs:
+        A         - Dense or sparse (n, n) coefficients matrix
+        y         - (n,) vector or (n, k) matrix (transpose False), (n,) vector or (m, n) matrix (transpose True)
+        tol       - Relative tolerance on the truncation error
+        maxiter   - Maximum number of terms
+        norm      - ||A|| (1-norm, or inf-norm if transpose is True). If None it is computed
+        transpose - If True, y @ L is computed
+        window    - Number of terms over which the ratio of the terms is estimated when ||A|| >= 1
+    Outputs:
+        x         - Partial sum of the series
+        stats     - Dictionary of iterations, relative truncation error ('bound', inf if not available), whether it is an
+                    estimate rather than a bound, relative size of the last term, contraction rate q, convergence and divergence
+    """
+
+    axis = 1 if transpose else 0            # Induced norm: maximum absolute column (row) sum
+    if norm is None:
+        norm = abs(A).sum(axis).max()
+    rho = float(norm)
+
+    step = (lambda t: np.asarray(A.T @ t.T).T) if transpose else (lambda t: np.asarray(A @ t))
+    vnorm = lambda t: np.abs(t).sum(1 if transpose and t.ndim > 1 else 0).max() if t.size > 0 else 0.0
+
+    term = np.array(y, dtype=float)
+    x = term.copy()
+    sizes = []                              # Sizes of the terms, for the estimate of the contraction rate
+    bound, last, q, k = np.inf, 1.0, (rho if rho < 1 else np.inf), 0
+    diverged = False
+
+    while k < maxiter:
+        size = vnorm(x)
+        if size == 0:
+            bound, last = 0.0, 0.0
+            break
+        sizes += [vnorm(term)]
+        last = sizes[-1]/size
+        if not np.isfinite(size):
+            diverged = True
+            break
+        if rho >= 1 and k >= window:
+            q = (sizes[-1]/sizes[-1-window])**(1/window) if sizes[-1-window] > 0 else 0.0
+            if q >= 1:
+                diverged = True
+                break
+        if q < 1:
+            bound = q/(1 - q)*last
+            if bound <= tol:
+                break
+        term = step(term)
+        x += term
+        k += 1
+
+    converged = not diverged and bound <= tol
+
+    return(x, {'iterations': k, 'bound': bound, 'estimated': rho >= 1, 'residual': last, 'rate': q, 'converged': bool(converged),
+               'diverged': diverged})
+
+
+class LeontiefSolver:
+
+    cache = OrderedDict()       # (factorization or preconditioner of (I - A), bytes), keyed by 'layerKey(A)' and method
+    cache_bytes = 2**30         # Maximum memory of the factorizations kept in the cache
+    cache_used = 0              # Memory of the factorizations currently cached
+    cache_lock = threading.Lock()
+    methods = ['lu','gmres','bicgstab','series']
+
+    def __init__(self, A, cache=True, method='lu', tol=1e-10, maxiter=None, preconditioner='ilu', restart=None, workers=1):
+        """
+        Inputs:
+            A              - Endogenous technical coefficients: dense (nL, n, n) stack or (n, n) matrix, sparse matrix or list of sparse layers
+            cache          - If True, factorizations are looked up in/stored into the shared cache
+            method         - 'lu' (direct), 'gmres' or 'bicgstab' (iterative) or 'series' (truncated power series)
+            tol            - Relative tolerance of the iterative methods (residual) and of the power series (truncation error)
+            maxiter        - Maximum number of iterations (terms for 'series'). If None, 10*n (1000 terms for 'series')
+            preconditioner - Preconditioner of the Krylov methods: 'ilu', 'jacobi' or None
+            restart        - Restart parameter of GMRES
+            workers        - Number of threads solving the layers in 'solve_layers' and 'inverse'. If 1 the layers are solved serially
+        """
+
+        if method not in LeontiefSolver.methods:
+            raise ValueError("Unknown Leontief solver method '"+str(method)+"': available methods are "+str(LeontiefSolver.methods))
+
+        probe = A[0] if isinstance(A, list) and len(A) > 0 else A
+        self.sparse = probe.sparse if isinstance(probe, OverlayMatrix) else isSparse(A)
+        self.single = not isinstance(A, list) and np.ndim(A) == 2      # Single-layer matrix rather than a stack
+
+        self.A = [A] if self.single else [A[l] for l in range(len(A))]
+        self.n = self.A[0].shape[0]
+        self.use_cache = cache
+        self.factors = [None]*len(self.A)
+        self.fallbacks = [None]*len(self.A)                             # LU factors of the layers whose power series diverges
+
+        self.method = method
+        self.tol = tol
+        self.maxiter = maxiter if maxiter is not None else (1000 if method == 'series' else 10*self.n)
+        self.preconditioner = preconditioner
+        self.restart = restart
+        self.workers = workers
+        self.stats = []             # Statistics of every solve
+
+
+    @property
+    def shape(self):
+        if self.single:
+            return((self.n, self.n))
+        return((len(self.A), self.n, self.n))
+
+    def __len__(self):
+        return(len(self.A))
+
+
+    @classmethod
+    def clear_cache(cls):
+        """
+        This method empties the factorization cache shared by all the solvers.
+        """
+
+        with LeontiefSolver.cache_lock:
+            LeontiefSolver.cache.clear()
+            LeontiefSolver.cache_used = 0
+
+
+    def factor(self, layer=0):
+        """
+        This method returns the LU factorization of (I - A) for a layer, computing it only if it is neither stored nor cached.
+        For the iterative methods it returns the (I - A) operator with its preconditioner, for 'series' the norms of A.
+        """
+
+        if self.factors[layer] is not None:
+            return(self.factors[layer])
+
+        A = self.A[layer]
+        A = A.materialize() if isinstance(A, OverlayMatrix) else A         # Shocked layers are materialised only to be factorized
+        key = layerKey(A)+'_'+self.method+'_'+str(self.preconditioner) if self.use_cache else None
+
+        if key is not None:
+            with LeontiefSolver.cache_lock:
+                if key in LeontiefSolver.cache:
+                    LeontiefSolver.cache.move_to_end(key)
+                    self.factors[layer] = LeontiefSolver.cache[key][0]
+                    return(self.factors[layer])
+
+        if self.method == 'series':
+            lu = {'norm_1': abs(A).sum(0).max(), 'norm_inf': abs(A).sum(1).max()}
+        elif self.method != 'lu':
+            M = sp.csr_matrix(sp.eye(self.n) - A) if self.sparse else np.eye(self.n) - np.asarray(A)
+            if self.preconditioner == 'ilu':
+                precond = spilu(sp.csc_matrix(M))
+            elif self.preconditioner == 'jacobi':
+                d = M.diagonal().copy()
+                d[d == 0] = 1
+                precond = d
+            else:
+                precond = None
+            lu = {'M': M, 'precond': precond}
+        elif self.sparse:
+            lu = splu(sp.csc_matrix(sp.eye(self.n) - A))
+        else:
+            lu = lu_factor(np.eye(self.n) - np.asarray(A))
+
+        if key is not None:
+            with LeontiefSolver.cache_lock:
+                nbytes = factorBytes(lu)
+                if key not in LeontiefSolver.cache and nbytes <= LeontiefSolver.cache_bytes:
+                    LeontiefSolver.cache[key] = (lu, nbytes)
+                    LeontiefSolver.cache_used += nbytes
+                while LeontiefSolver.cache_used > LeontiefSolver.cache_bytes:
+                    LeontiefSolver.cache_used -= LeontiefSolver.cache.popitem(last=False)[1][1]
+
+        self.factors[layer] = lu
+        return(lu)
+
+
+    def solve(self, y, layer=0):
+        """
+        This method returns L @ y, solving (I - A) x = y.
+        Inputs:
+            y     - Dense or sparse vector (n,) or matrix (n, k)
+            layer - Position of the layer
+        """
+
+        y = y.toarray() if sp.issparse(y) else np.asarray(y, dtype=float)
+
+        return(self.run(y, layer, transpose=False))
+
+
+    def solve_transpose(self, b, layer=0):
+        """
+        This method returns b @ L, solving (I - A)^T z = b^T.
+        Inputs:
+            b     - Dense or sparse vector (n,) or matrix (m, n), e.g. exogenous coefficients 'B'
+            layer - Position of the layer
+        """
+
+        b = b.toarray() if sp.issparse(b) else np.asarray(b, dtype=float)
+
+        return(self.run(b, layer, transpose=True))
+
+
+    def solve_layers(self, Y, transpose=False):
+        """
+        This method solves every layer against its own right-hand sides, in a pool of 'workers' threads if workers > 1.
+        Inputs:
+            Y         - Dense (nL, n, k) stack of right-hand sides ((nL, m, n) if transpose is True)
+            transpose - If True, Y[l] @ L is computed for every layer, otherwise L @ Y[l]
+        Output:
+            X         - Dense stack of solutions, with the shape of Y
+        """
+
+        Y = np.asarray(Y, dtype=float)
+        solve = self.solve_transpose if transpose else self.solve
+
+        if self.workers > 1 and len(self.A) > 1:
+            with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                X = list(pool.map(solve, Y, range(len(self.A))))
+        else:
+            X = [solve(Y[l], l) for l in range(len(self.A))]
+
+        return(np.array(X))
+
+
+    def run(self, y, layer, transpose):
+        """
+        This method solves (I - A) x = y, or x (I - A) = y if transpose is True, with the method of the solver, recording its statistics.
+        """
+
+        t_start = time.perf_counter()
+        lu = self.factor(layer)
+        stats = {'iterations': 0, 'residual': None, 'converged': True}
+
+        if self.method == 'series':
+            norm = lu['norm_inf'] if transpose else lu['norm_1']
+            x, stats = powerSeries(self.A[layer], y, self.tol, self.maxiter, norm, transpose)
+            if stats['diverged']:                       # Spectral radius of A >= 1: the layer is solved through its LU factorization
+                x = self.fallback(layer, y, transpose)
+                stats.update({'fallback': 'lu', 'converged': True})
+        elif self.method != 'lu':
+            x, stats = krylovSolve(lu['M'], y.T if transpose else y, self.method, self.tol, self.maxiter, lu['precond'], self.restart, transpose)
+            x = x.T if transpose else x
+        elif self.sparse:
+            x = lu.solve(y.T, trans='T').T if transpose else lu.solve(y)
+        else:
+            x = lu_solve(lu, y.T, trans=1).T if transpose else lu_solve(lu, y)
+
+        stats.update({'layer': layer, 'method': self.method, 'transpose': transpose, 'time': time.perf_counter() - t_start})
+        self.stats += [stats]
+
+        return(x)
+
+
+    def fallback(self, layer, y, transpose):
+        """
+        This method solves a layer whose power series diverges with the LU factorization of (I - A), kept by the solver.
+        """
+
+        if self.fallbacks[layer] is None:
+            A = self.A[layer]
+            A = A.materialize() if isinstance(A, OverlayMatrix) else A
+            self.fallbacks[layer] = splu(sp.csc_matrix(sp.eye(self.n) - A)) if self.sparse else lu_factor(np.eye(self.n) - np.asarray(A))
+        lu = self.fallbacks[layer]
+
+        if self.sparse:
+            return(lu.solve(y.T, trans='T').T if transpose else lu.solve(y))
+
+        return(lu_solve(lu, y.T, trans=1).T if transpose else lu_solve(lu, y))
+
+
+    def inverse(self, layer=None):
+        """
+        This method explicitly forms the Leontief inverse of a layer, or of every layer if layer is None.
+        """
+
+        if layer is None and not self.single:
+            if self.method == 'lu' and not self.sparse and self.workers == 1:
+                return(np.linalg.inv(np.eye(self.n) - np.asarray(self.A)))     # Single batched LAPACK call over the stack
+            return(self.solve_layers(np.broadcast_to(np.eye(self.n), (len(self.A), self.n, self.n))))
+
+        return(self.solve(np.eye(self.n), 0 if layer is None else layer))
+
+
+class WoodburySolver(LeontiefSolver):
+
+    def __init__(self, L_0, delta_A, max_rank=None, cache=True):
+        """
+        Inputs:
+            L_0      - Baseline 'LeontiefSolver', factorizing (or solving iteratively) I - A_0
+            delta_A  - Perturbations of the coefficients, with the layout of A_0 (dense stack or matrix, sparse matrix or list of sparse layers)
+            max_rank - Maximum rank updated through the Woodbury identity (see 'lowRank'); layers above it are refactorized
+            cache    - If True, refactorizations are looked up in/stored into the shared cache
+        """
+
+        if L_0.single:
+            delta_A = [delta_A]
+
+        A_1 = [OverlayMatrix(L_0.A[l], delta_A[l]) for l in range(len(L_0))]      # Baseline layers by reference + sparse perturbations
+
+        LeontiefSolver.__init__(self, A_1[0] if L_0.single else A_1, cache, L_0.method, L_0.tol, L_0.maxiter, L_0.preconditioner, L_0.restart, L_0.workers)
+
+        self.base = L_0
+        self.updates = [lowRank(delta_A[l], max_rank) for l in range(len(L_0))]
+
+
+    def factor(self, layer=0):
+        """
+        This method returns the Woodbury update of a layer: L_0 @ U, Vt @ L_0 and the LU factorization of the
+        k x k capacitance matrix I_k - Vt @ L_0 @ U. Layers without a low-rank update (or with a near-singular capacitance
+        matrix) are refactorized as in 'LeontiefSolver'.
+        """
+
+        if self.factors[layer] is not None or self.updates[layer] is None:
+            return(LeontiefSolver.factor(self, layer))
+
+        U, Vt = self.updates[layer]
+        k = U.shape[1]
+
+        if k == 0:
+            self.factors[layer] = {'rank': 0}
+            return(self.factors[layer])
+
+        LU = self.base.solve(U, layer)                  # L_0 @ U
+        VL = self.base.solve_transpose(Vt, layer)       # Vt @ L_0
+        C = np.eye(k) - Vt @ LU
+
+        if np.linalg.cond(C) > 1/np.finfo(float).eps:
+            self.updates[layer] = None
+            return(LeontiefSolver.factor(self, layer))
+
+        self.factors[layer] = {'rank': k, 'U': U, 'Vt': Vt, 'LU': LU, 'VL': VL, 'C': lu_factor(C)}
+        return(self.factors[layer])
+
+
+    def run(self, y, layer, transpose):
+        """
+        This method solves the shocked system of a layer through the Woodbury identity, or through its refactorization.
+        """
+
+        if self.updates[layer] is None:
+            return(LeontiefSolver.run(self, y, layer, transpose))
+
+        t_start = time.perf_counter()
+        f = self.factor(layer)
+        if f['rank'] == 0:
+            x = self.base.run(y, layer, transpose)
+        elif transpose:                                 # y L_1 = y L_0 + (y L_0 U) C^-1 (Vt L_0)
+            z = self.base.run(y, layer, transpose)
+            x = z + lu_solve(f['C'], (z @ f['U']).T, trans=1).T @ f['VL']
+        else:                                           # L_1 y = L_0 y + (L_0 U) C^-1 (Vt L_0 y)
+            z = self.base.run(y, layer, transpose)
+            x = z + f['LU'] @ lu_solve(f['C'], f['Vt'] @ z)
+
+        self.stats += [{'iterations': 0, 'residual': None, 'converged': True, 'rank': f['rank'], 'layer': layer,
+                        'method': 'woodbury', 'transpose': transpose, 'time': time.perf_counter() - t_start}]
+
+        return(x)
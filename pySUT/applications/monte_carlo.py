@@ -0,0 +1,360 @@
+import numpy as np
+import scipy.sparse as sp
+from pySUT.tables.sparse_tables import isSparse, stackRowSum
+from pySUT.applications.leontief_solver import LeontiefSolver
+
+
+#%% Monte Carlo uncertainty propagation
+
+"""
+This set of functions propagates the uncertainty of the technical coefficients (A, B and Y) to the output vectors x
+and to the embodied exogenous transactions E = B @ L @ diag(Y_tot) of the economic layer.
+Every non-null coefficient is multiplied by a random factor of unit mean drawn from a user-specified distribution,
+so that the structure of the tables is kept. Draws are generated and solved in batches: dense stacks are copied into a
+workspace allocated once, and each batch is solved through a single batched LAPACK call over (draws, layers).
+Results are never stored draw by draw: 'StreamingStats' accumulates their mean and variance (Chan's parallel update)
+and a fixed-size reservoir of draws from which the quantiles are estimated. Statistics computed by separate processes
+are merged, so that 10^4+ draws can be split among 'workers' processes.
+
+The distributions are given as a dictionary {key: {'dist': name, 'scale': value}}, with key 'A', 'B' or 'Y':
+    normal     - 1 + scale * N(0, 1)                      (scale: relative standard deviation)
+    lognormal  - exp(s * N(0, 1) - s^2/2), s^2 = log(1 + scale^2)   (scale: relative standard deviation)
+    uniform    - U(1 - scale, 1 + scale)                  (scale: relative half-width)
+    triangular - Triangular(1 - scale, 1, 1 + scale)     (scale: relative half-width)
+'scale' is a scalar or an array broadcastable to the coefficients matrix (one value per coefficient).
+Coefficients without a distribution are kept at their baseline values.
+"""
+
+dist_names = ['normal','lognormal','uniform','triangular']
+
+
+def sampleFactors(spec, size, rng):
+    """
+    This function draws multiplicative factors of unit mean.
+    Inputs:
+        spec   - Dictionary with the name of the distribution ('dist') and its relative 'scale' (scalar or array broadcastable to size)
+        size   - Shape of the draws
+        rng    - numpy random Generator
+    Output:
+        F      - Array of factors
+    """
+
+    dist = spec.get('dist','lognormal')
+    scale = np.asarray(spec.get('scale',0.0), dtype=float)
+
+    if dist == 'normal':
+        return(1 + scale*rng.standard_normal(size))
+    if dist == 'lognormal':
+        s = np.sqrt(np.log1p(scale**2))
+        return(np.exp(s*rng.standard_normal(size) - s**2/2))
+    if dist == 'uniform':
+        return(rng.uniform(1 - scale, 1 + scale, size))
+    if dist == 'triangular':
+        return(1 + scale*(rng.triangular(-1, 0, 1, size)))
+
+    raise ValueError("Unknown distribution '"+str(dist)+"': available distributions are "+str(dist_names))
+
+
+def coeffPattern(X, spec):
+    """
+    This function returns the non-null coefficients of a dense or sparse matrix (or stack) to be perturbed, with their scales.
+    Output:
+        pattern - Dictionary of the positions ('index', dense inputs) or layer offsets ('offsets', sparse inputs),
+                  the baseline values and the distribution, with 'scale' restricted to the non-null coefficients
+    """
+
+    if isSparse(X):
+        layers = X if isinstance(X, list) else [X]
+        layers = [sp.csr_matrix(layer) for layer in layers]
+        values = np.concatenate([layer.data for layer in layers])
+        offsets = np.cumsum([0]+[layer.nnz for layer in layers])
+        rows = [np.repeat(np.arange(layer.shape[0]), np.diff(layer.indptr)) for layer in layers]
+        scale = np.concatenate([np.broadcast_to(np.asarray(spec.get('scale',0.0), dtype=float), (len(layers),)+layers[0].shape)[l][rows[l], layers[l].indices] for l in range(len(layers))])
+        return({'layers': layers, 'offsets': offsets, 'values': values, 'dist': spec.get('dist','lognormal'), 'scale': scale})
+
+    X = np.asarray(X, dtype=float)
+    index = np.nonzero(X)
+    scale = np.broadcast_to(np.asarray(spec.get('scale',0.0), dtype=float), X.shape)[index]
+
+    return({'index': index, 'values': X[index], 'dist': spec.get('dist','lognormal'), 'scale': scale})
+
+
+def samplePattern(pattern, draws, rng):
+    """
+    This function returns the perturbed values of the non-null coefficients, as a (draws, nnz) array.
+    """
+
+    F = sampleFactors({'dist': pattern['dist'], 'scale': pattern['scale']}, (draws, len(pattern['values'])), rng)
+
+    return(pattern['values']*F)
+
+
+#%% Streaming statistics
+
+class StreamingStats:
+
+    def __init__(self, shape, quantiles=(0.05,0.5,0.95), reservoir=1000, seed=None):
+        """
+        Inputs:
+            shape     - Shape of a single draw
+            quantiles - Probabilities of the estimated quantiles
+            reservoir - Number of draws kept (uniformly at random, Algorithm R) to estimate the quantiles
+            seed      - Seed of the reservoir sampling
+        """
+
+        self.shape = tuple(shape)
+        self.quantiles = list(quantiles)
+        self.size = reservoir
+        self.rng = np.random.default_rng(seed)
+
+        self.count = 0
+        self.mean = np.zeros(self.shape)
+        self.M2 = np.zeros(self.shape)               # Sum of squared deviations from the mean
+        self.min = np.full(self.shape, np.inf)
+        self.max = np.full(self.shape, -np.inf)
+        self.sample = np.zeros((reservoir,)+self.shape)
+
+
+    def update(self, batch):
+        """
+        This method adds a batch of draws, with shape (draws,) + shape.
+        """
+
+        batch = np.asarray(batch, dtype=float).reshape((-1,)+self.shape)
+        nb = batch.shape[0]
+        if nb == 0:
+            return(self)
+
+        mean_b = batch.mean(0)
+        M2_b = ((batch - mean_b)**2).sum(0)
+        self.combine(nb, mean_b, M2_b)
+        np.minimum(self.min, batch.min(0), out=self.min)
+        np.maximum(self.max, batch.max(0), out=self.max)
+
+        t = self.count - nb                             # Draws seen before the batch
+        fill = min(nb, max(0, self.size - t))           # Draws filling the free slots of the reservoir
+        self.sample[t:t+fill] = batch[:fill]
+
+        if fill < nb:                                   # Algorithm R: draw t+i replaces slot j ~ U{0, ..., t+i} if j < size
+            j = self.rng.integers(0, t + np.arange(fill, nb) + 1)
+            kept = np.flatnonzero(j < self.size)[::-1]
+            slots, last = np.unique(j[kept], return_index=True)     # Later draws overwrite earlier ones in the same slot
+            self.sample[slots] = batch[fill + kept[last]]
+
+        return(self)
+
+
+    def combine(self, nb, mean_b, M2_b):
+        """
+        This method combines the running mean and sum of squared deviations with those of nb further draws (Chan et al.).
+        """
+
+        n = self.count + nb
+        delta = mean_b - self.mean
+        self.mean += delta*nb/n
+        self.M2 += M2_b + delta**2*self.count*nb/n
+        self.count = n
+
+
+    def merge(self, other):
+        """
+        This method merges the statistics accumulated by another 'StreamingStats' (e.g. computed by another process).
+        The merged reservoir draws from each reservoir in proportion to the number of draws it represents.
+        """
+
+        if other.count == 0:
+            return(self)
+
+        n1, n2 = self.count, other.count
+        k1, k2 = min(n1, self.size), min(n2, other.size)
+        k = min(self.size, k1 + k2)
+        m1 = self.rng.hypergeometric(n1, n2, k) if n1 > 0 else 0
+        m1, m2 = min(m1, k1), min(k - min(m1, k1), k2)
+
+        sample = np.concatenate([self.sample[self.rng.permutation(k1)[:m1]], other.sample[self.rng.permutation(k2)[:m2]]])
+        self.sample[:len(sample)] = sample
+
+        self.combine(n2, other.mean, other.M2)
+        np.minimum(self.min, other.min, out=self.min)
+        np.maximum(self.max, other.max, out=self.max)
+
+        return(self)
+
+
+    def result(self):
+        """
+        This method returns a dictionary of the count, mean, variance, standard deviation, minimum, maximum and quantiles.
+        """
+
+        k = min(self.count, self.size)
+        var = self.M2/(self.count - 1) if self.count > 1 else np.full(self.shape, np.nan)
+
+        return({
+                'count'     : self.count,
+                'mean'      : self.mean.copy(),
+                'var'       : var,
+                'std'       : np.sqrt(var),
+                'min'       : self.min.copy(),
+                'max'       : self.max.copy(),
+                'quantiles' : {q: np.quantile(self.sample[:k], q, axis=0) for q in self.quantiles} if k > 0 else {},
+                })
+
+
+#%% Monte Carlo engine
+
+def mcBatch(ML_iot_coeff_0, patterns, draws, rng, workspace=None):
+    """
+    This function draws a batch of perturbed coefficients and solves the Leontief Production and Impact Models for each draw.
+    Inputs:
+        ML_iot_coeff_0 - Dictionary containing technical coefficients for the IOT-like tables
+        patterns       - Dictionary of the perturbed coefficients (see 'coeffPattern'), keyed by 'A', 'B' and 'Y'
+        draws          - Number of draws of the batch
+        rng            - numpy random Generator
+        workspace      - Dictionary of preallocated dense arrays, reused among batches of the same size (dense inputs)
+    Outputs:
+        x              - (draws, nL, n, 1) output vectors
+        E              - (draws, nR, n) embodied exogenous transactions
+    """
+
+    A_0, B_0, Y_0 = ML_iot_coeff_0['A'], ML_iot_coeff_0['B'], ML_iot_coeff_0['Y']
+    workspace = {} if workspace is None else workspace
+
+    if isSparse(A_0) or isSparse(B_0) or isSparse(Y_0):
+        return(mcSparse(A_0, B_0, Y_0, patterns, draws, rng))
+
+    A_0, B_0, Y_0 = np.asarray(A_0, dtype=float), np.asarray(B_0, dtype=float), np.asarray(Y_0, dtype=float)
+    nL, n = A_0.shape[0], A_0.shape[1]
+
+    # Final demand: only the total final demand vectors are needed
+    if 'Y' in patterns:
+        Y = workspace.setdefault('Y', np.empty((draws,)+Y_0.shape))
+        Y[:] = Y_0
+        Y[(slice(None),)+patterns['Y']['index']] = samplePattern(patterns['Y'], draws, rng)
+        Y_tot = Y.sum(-1, keepdims=True)
+    else:
+        Y_tot = np.broadcast_to(Y_0.sum(-1, keepdims=True), (draws, nL, n, 1))
+
+    if 'B' in patterns:
+        B = workspace.setdefault('B', np.empty((draws,)+B_0.shape))
+        B[:] = B_0
+        B[(slice(None),)+patterns['B']['index']] = samplePattern(patterns['B'], draws, rng)
+    else:
+        B = np.broadcast_to(B_0, (draws,)+B_0.shape)
+
+    if 'A' in patterns:
+        M = workspace.setdefault('A', np.empty((draws,)+A_0.shape))
+        M[:] = A_0
+        M[(slice(None),)+patterns['A']['index']] = samplePattern(patterns['A'], draws, rng)
+        np.subtract(np.eye(n), M, out=M)                                                  # I - A, in place
+        x = np.linalg.solve(M, Y_tot)                                                     # One batched call over draws and layers
+        BL = np.linalg.solve(M[:,0].transpose(0,2,1), B.transpose(0,2,1)).transpose(0,2,1)   # B @ L of the economic layer
+    else:
+        L = LeontiefSolver(A_0)                                                           # Shared factorization of the baseline
+        x = L.solve_layers(Y_tot[...,0].transpose(1,2,0)).transpose(2,0,1)[...,None]
+        BL = L.solve_transpose(B.reshape(-1, n), 0).reshape(B.shape)
+
+    E = BL * Y_tot[:,0,:,0][:,None,:]
+
+    return(x, E)
+
+
+def mcSparse(A_0, B_0, Y_0, patterns, draws, rng):
+    """
+    This function solves a batch of draws for sparse coefficients, one sparse factorization per draw.
+    The perturbed matrices share the sparsity pattern of the baseline: only their data arrays are drawn.
+    """
+
+    def perturbed(X, key, values):
+        if key not in patterns:
+            return(X)
+        p = patterns[key]
+        layers = [sp.csr_matrix((values[p['offsets'][l]:p['offsets'][l+1]], layer.indices, layer.indptr), shape=layer.shape) for l, layer in enumerate(p['layers'])]
+        return(layers if isinstance(X, list) else layers[0])
+
+    samples = {key: samplePattern(patterns[key], draws, rng) for key in ['Y','B','A'] if key in patterns}     # Same drawing order as the dense batches
+    x, E = [], []
+
+    for d in range(draws):
+        A = perturbed(A_0, 'A', samples['A'][d] if 'A' in samples else None)
+        B = perturbed(B_0, 'B', samples['B'][d] if 'B' in samples else None)
+        Y = perturbed(Y_0, 'Y', samples['Y'][d] if 'Y' in samples else None)
+
+        Y_tot = np.asarray(stackRowSum(Y), dtype=float)
+        L = LeontiefSolver(A, cache='A' not in patterns)
+        x += [L.solve_layers(Y_tot)]
+        E += [L.solve_transpose(B, 0) * Y_tot[0].T]
+
+    return(np.array(x), np.array(E))
+
+
+def mcChunk(ML_iot_coeff_0, distributions, draws, batch, quantiles, reservoir, seed):
+    """
+    This function runs 'draws' Monte Carlo draws in batches of 'batch', returning the streaming statistics of x and E.
+    It is the unit of work of each process.
+    """
+
+    rng = np.random.default_rng(seed)
+    patterns = {key: coeffPattern(ML_iot_coeff_0[key], spec) for key, spec in distributions.items()}
+    workspace = {}
+
+    stats = None
+    done = 0
+    while done < draws:
+        b = min(batch, draws - done)
+        x, E = mcBatch(ML_iot_coeff_0, patterns, b, rng, workspace if b == batch else None)
+        if stats is None:
+            stats = {'x': StreamingStats(x.shape[1:], quantiles, reservoir, rng.integers(2**32)),
+                     'E': StreamingStats(E.shape[1:], quantiles, reservoir, rng.integers(2**32))}
+        stats['x'].update(x)
+        stats['E'].update(E)
+        done += b
+
+    return(stats)
+
+
+def monte_carlo(ML_iot_coeff_0, distributions, draws, batch=100, quantiles=(0.05,0.5,0.95), reservoir=1000, seed=None, workers=1):
+    """
+    This function propagates the uncertainty of the technical coefficients to the output vectors and to the embodied
+    exogenous transactions through Monte Carlo simulation.
+    Inputs:
+        ML_iot_coeff_0 - Dictionary containing technical coefficients for the IOT-like tables
+        distributions  - Dictionary of the distributions of the coefficients, keyed by 'A', 'B' and/or 'Y' (see above)
+        draws          - Number of draws
+        batch          - Number of draws generated and solved together (memory: batch * nL * n^2 floats if A is perturbed)
+        quantiles      - Probabilities of the estimated quantiles
+        reservoir      - Number of draws kept to estimate the quantiles
+        seed           - Seed of the simulation: results are reproducible for the same seed, batch and workers
+        workers        - Number of processes sharing the draws. If 1 the draws are run in this process
+    Outputs:
+        ML_mc          - Dictionary of the statistics of 'x' (nL, n, 1) and 'E' (nR, n) (see 'StreamingStats.result')
+    """
+
+    if draws < 1:
+        raise ValueError("The number of draws must be at least 1, "+str(draws)+" given")
+
+    for key, spec in distributions.items():
+        if key not in ['A','B','Y']:
+            raise ValueError("Unknown coefficients '"+str(key)+"': uncertainty can be assigned to 'A', 'B' and 'Y'")
+        if spec.get('dist','lognormal') not in dist_names:
+            raise ValueError("Unknown distribution '"+str(spec.get('dist'))+"': available distributions are "+str(dist_names))
+
+    workers = max(1, min(workers, draws))           # No process is started without draws
+    seeds = np.random.SeedSequence(seed).spawn(workers)
+    chunks = [draws//workers + (1 if w < draws % workers else 0) for w in range(workers)]
+
+    if workers > 1:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(mcChunk, [ML_iot_coeff_0]*workers, [distributions]*workers, chunks, [batch]*workers,
+                                    [quantiles]*workers, [reservoir]*workers, seeds))
+    else:
+        results = [mcChunk(ML_iot_coeff_0, distributions, chunks[0], batch, quantiles, reservoir, seeds[0])]
+
+    stats = results[0]
+    for result in results[1:]:
+        stats['x'].merge(result['x'])
+        stats['E'].merge(result['E'])
+
+    ML_mc = {key: stats[key].result() for key in ['x','E']}
+
+    return(ML_mc)
@@ -0,0 +1,83 @@
+import numpy as np
+import scipy.sparse as sp
+from pySUT.tables.sparse_tables import isSparse
+from pySUT.parsing.block_matrix import BlockMatrix
+
+
+#%% Column rescaling of multi-layer matrices
+
+"""
+Technical coefficients (X @ inv(diag(x))) and flows recalculated from coefficients (X @ diag(x)) are column rescalings
+of the matrices by a vector. This set of functions performs them by broadcasting the vector over the whole (nL, rows, n)
+stack, without building (or inverting) any n x n diagonal matrix: the cost is O(nL*rows*n) instead of O(nL*rows*n^2).
+Sparse matrices are rescaled through a sparse diagonal matrix, so that their sparsity pattern is kept.
+"""
+
+def scaleVector(v, inverse=False, zero='null'):
+    """
+    This function returns the 1-d vector of column multipliers.
+    Inputs:
+        v       - Vector of n elements (e.g. a (n, 1) production vector)
+        inverse - If True, the multipliers are 1/v, as for technical coefficients
+        zero    - Handling of null elements of v when inverse is True:
+                  'null'  - columns with null v get null coefficients
+                  'raise' - a ValueError listing the null positions is raised
+    Output:
+        d       - 1-d array of multipliers
+    """
+
+    v = np.asarray(v, dtype=float).ravel()
+
+    if not inverse:
+        return(v)
+
+    null = v == 0
+    if null.any():
+        if zero == 'raise':
+            raise ValueError('Null elements in positions '+str(np.flatnonzero(null).tolist())+' cannot be inverted')
+        d = np.zeros(len(v))
+        d[~null] = 1/v[~null]
+        return(d)
+
+    return(1/v)
+
+
+def colScale(X, v, inverse=False, out=None, zero='null'):
+    """
+    This function returns X @ diag(v) (or X @ inv(diag(v)) if inverse is True) for a matrix or a multi-layer stack.
+    Inputs:
+        X       - Dense (nL, rows, n) stack or (rows, n) matrix, block matrix (see 'block_matrix'),
+                  sparse matrix or list of sparse layers (see 'sparse_tables')
+        v       - Vector of n elements
+        inverse - If True, the columns are divided by v
+        out     - Optional preallocated dense array with the shape of X, into which the result is written (dense and block inputs)
+        zero    - Handling of null elements of v when inverse is True (see 'scaleVector')
+    Output:
+        X_s     - Rescaled matrix or stack, in the same representation as X (block matrices are returned dense)
+    """
+
+    d = scaleVector(v, inverse, zero)
+
+    if isinstance(X, list) and isSparse(X):
+        D = sp.diags(d)
+        return([(X[l] @ D).tocsr() for l in range(len(X))])
+
+    if sp.issparse(X):
+        return((X @ sp.diags(d)).tocsr())
+
+    if isinstance(X, BlockMatrix):
+        if out is None:
+            out = np.empty(X.shape)
+        for (r0, r1), row in zip(X.row_bounds, X.blocks):
+            for (c0, c1), block in zip(X.col_bounds, row):
+                if block is None:
+                    out[..., r0:r1, c0:c1] = 0
+                else:
+                    np.multiply(block, d[c0:c1], out=out[..., r0:r1, c0:c1])
+        return(out)
+
+    X = np.asarray(X)
+    if out is None:
+        out = np.empty(X.shape)
+
+    return(np.multiply(X, d, out=out))              # d is broadcast over the columns of every layer
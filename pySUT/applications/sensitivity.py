@@ -0,0 +1,156 @@
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from pySUT.tables.sparse_tables import rowSum
+from pySUT.applications.shock_analysis.leontief_models import isFactorized
+
+
+#%% Analytic sensitivity of the Leontief models
+
+"""
+This set of functions computes the derivatives and elasticities of a scalar target of the Leontief models with respect
+to every coefficient of A, B and Y at once, instead of perturbing the coefficients one at a time.
+The target is a weighted sum of the outputs ('x': f = g @ x), of the direct exogenous transactions ('R': f = sum(G * R))
+or of the embodied exogenous transactions ('E': f = sum(G * E)); unit weights give total output or total impacts, a
+one-hot weight gives a single element. Since dL = L @ dA @ L, every derivative map is an outer product (or a rank-nR product)
+of vectors obtained through one direct and one transposed solve with L:
+    x: df/dA = (g @ L)^T (x)^T                          df/dy = g @ L
+    R: df/dA = (h @ L)^T (x)^T,  h = sum_r G * B         df/dB = G diag(x)          df/dy = h @ L
+    E: df/dA = (B @ L)^T (G diag(y) @ L^T)               df/dB = G diag(y) @ L^T    df/dy = sum_r G * (B @ L)
+Final demand derivatives refer to the total final demand vector y: df/dY[j, c] = df/dy[j] for every category c.
+Elasticities are (coefficient / f) * derivative. R and E refer to the economic layer.
+"""
+
+targets = ['x','R','E']
+
+
+def rightL(L_1, v, layer=0):
+    """
+    This function returns L @ v for a 'LeontiefSolver' or an explicit Leontief inverse.
+    """
+
+    if isFactorized(L_1):
+        return(L_1.solve(v, layer))
+
+    return(np.asarray(L_1)[layer] @ v)
+
+
+def leftL(L_1, v, layer=0):
+    """
+    This function returns v @ L for a 'LeontiefSolver' or an explicit Leontief inverse.
+    """
+
+    if isFactorized(L_1):
+        return(L_1.solve_transpose(v, layer))
+
+    v = v.toarray() if sp.issparse(v) else v
+
+    return(v @ np.asarray(L_1)[layer])
+
+
+def calc_sensitivity(L_1, B, Y, target='x', weights=None, layer=0):
+    """
+    This function returns the derivatives of a scalar target with respect to the coefficients.
+    Inputs:
+        L_1     - Leontief Inverse Matrix ('LeontiefSolver' or explicit (nL, n, n) inverse)
+        B       - Exogenous technical coefficients matrix (dense or sparse)
+        Y       - Final demand matrices: dense (nL, n, nY) stack or list of sparse layers
+        target  - 'x', 'R' or 'E'
+        weights - Weights of the target: (n,) vector for 'x', (nR, n) matrix for 'R' and 'E'. If None, unit weights
+        layer   - Layer of the target 'x' (R and E refer to layer 0)
+    Output:
+        ML_sens - Dictionary of the target value 'f' and of the derivative maps 'A' (n, n), 'B' (nR, n) and 'Y' (n, nY)
+    """
+
+    if target not in targets:
+        raise ValueError("Unknown sensitivity target '"+str(target)+"': available targets are "+str(targets))
+
+    layer = layer if target == 'x' else 0
+    y = rowSum(Y[layer]).ravel()
+    x = rightL(L_1, y, layer)
+    B = B.toarray() if sp.issparse(B) else np.asarray(B, dtype=float)
+    n = len(y)
+
+    if target == 'x':
+        g = np.ones(n) if weights is None else np.asarray(weights, dtype=float).ravel()
+        gL = leftL(L_1, g, layer)
+        f = g @ x
+        dA, dB, dy = np.outer(gL, x), np.zeros(B.shape), gL
+
+    elif target == 'R':
+        G = np.ones(B.shape) if weights is None else np.asarray(weights, dtype=float)
+        h = np.sum(G*B, 0)
+        hL = leftL(L_1, h, layer)
+        f = h @ x
+        dA, dB, dy = np.outer(hL, x), G*x, hL
+
+    else:
+        G = np.ones(B.shape) if weights is None else np.asarray(weights, dtype=float)
+        BL = leftL(L_1, B, layer)
+        Gy = G*y
+        GyL = rightL(L_1, Gy.T, layer).T                # G diag(y) @ L^T, through a direct solve
+        f = np.sum(Gy*BL)
+        dA, dB, dy = BL.T @ GyL, GyL, np.sum(G*BL, 0)
+
+    nY = Y[layer].shape[1]
+    ML_sens = {
+              'f' : f,
+              'A' : dA,
+              'B' : dB,
+              'Y' : np.repeat(dy[:,None], nY, 1),
+              }
+
+    return(ML_sens)
+
+
+def calc_elasticity(ML_sens, A, B, Y, layer=0):
+    """
+    This function returns the elasticities of the target, (coefficient / f) * derivative, for every coefficient.
+    Inputs:
+        ML_sens - Dictionary of derivatives (see 'calc_sensitivity')
+        A, B, Y - Technical coefficients the derivatives refer to ('layer' of the A and Y stacks)
+    Output:
+        ML_elas - Dictionary of the elasticity maps 'A', 'B' and 'Y'
+    """
+
+    f = ML_sens['f']
+    coeff = {'A': A[layer], 'B': B, 'Y': Y[layer]}
+    ML_elas = {}
+
+    for key in ['A','B','Y']:
+        X = coeff[key]
+        X = X.toarray() if sp.issparse(X) else np.asarray(X, dtype=float)
+        ML_elas[key] = X*ML_sens[key]/f if f != 0 else np.zeros(X.shape)
+
+    return(ML_elas)
+
+
+def top_coefficients(S, k=10, rows=None, cols=None, absolute=True):
+    """
+    This function ranks the k most influential coefficients of a sensitivity or elasticity map.
+    The selection is a partial sort (np.argpartition) over the whole map, O(n^2) instead of O(n^2 log n).
+    Inputs:
+        S        - Dense (rows, cols) map
+        k        - Number of coefficients returned
+        rows     - Optional labels of the rows
+        cols     - Optional labels of the columns
+        absolute - If True, coefficients are ranked by absolute value
+    Output:
+        top      - DataFrame of the row, column and value of the k coefficients, sorted by decreasing influence
+    """
+
+    S = np.asarray(S, dtype=float)
+    score = np.abs(S).ravel() if absolute else S.ravel()
+    k = min(k, score.size)
+
+    best = np.argpartition(-score, k-1)[:k] if k < score.size else np.arange(score.size)
+    best = best[np.argsort(-score[best], kind='stable')]
+    i, j = np.unravel_index(best, S.shape)
+
+    top = pd.DataFrame({
+                       'row'    : i if rows is None else np.asarray(rows, dtype=object)[i],
+                       'column' : j if cols is None else np.asarray(cols, dtype=object)[j],
+                       'value'  : S[i,j],
+                       })
+
+    return(top)
@@ -1,24 +1,86 @@
 import numpy as np
+from pySUT.tables.sparse_tables import colSum, stackRowSum
+from pySUT.applications.rescaling import colScale
+from pySUT.applications.leontief_solver import LeontiefSolver, WoodburySolver, lowRank
+from pySUT.applications.shock_analysis.overlay_matrix import OverlayMatrix
 
 
 #%% Leontief Production Model
 """
-This set of functions apply the Leontief Production Model on the set database
+This set of functions apply the Leontief Production Model on the set database.
+The Leontief inverse is never formed: 'calc_L_1' returns a 'LeontiefSolver', holding the LU factorizations of (I - A)
+for dense and sparse coefficients alike, which the other functions use to solve the models.
+All the functions operate on the whole (nL, n, n) stack: explicit inverses through batched numpy products,
+solvers through 'solve_layers', which can dispatch the independent layers to a pool of threads.
+Explicit Leontief inverses (arrays) are still accepted by all the functions.
 """
 
 
-def calc_L_1(A_s):
+def isFactorized(L_1):
     """
-    This function returns the Leontief Inverse Matrix.
+    This function returns True if L_1 is a 'LeontiefSolver' rather than an explicit Leontief inverse.
+    """
+    
+    return(isinstance(L_1, LeontiefSolver))
+
+
+def calc_L_1(A_s, inverse=False, method='lu', tol=1e-10, maxiter=None, preconditioner='ilu', workers=1):
+    """
+    This function returns the Leontief Inverse Matrix, as a 'LeontiefSolver' factorizing (I - A_s) once per layer.
     Input:
-       A_s - Shocked endogenous technical coefficients matrix
+       A_s            - Shocked endogenous technical coefficients matrix
+       inverse        - If True, the explicit (nL, n, n) Leontief inverse is returned instead
+       method         - 'lu' (direct), 'gmres'/'bicgstab' (iterative) or 'series' (truncated power series), see 'LeontiefSolver'.
+                        With iterative methods and series neither L nor the factors of (I - A_s) are formed
+       tol            - Relative tolerance of the iterative methods and of the power series
+       maxiter        - Maximum number of iterations (terms of the series)
+       preconditioner - Preconditioner of the iterative methods: 'ilu', 'jacobi' or None
+       workers        - Number of threads solving (or inverting) the layers. If 1 the layers are solved serially
+    Per-solve statistics are collected in the 'stats' attribute of the returned solver.
+    Shocked coefficients given as baseline + sparse overlay (see 'OverlayMatrix') update the baseline factorization
+    through the low-rank structure of the overlay (see 'calc_L_1_update'), without materialising A_s.
     """
     
-    L_1 = np.zeros((A_s.shape[0],A_s.shape[1],A_s.shape[2]))
+    if isinstance(A_s, OverlayMatrix) and not inverse:
+        L_0 = LeontiefSolver(A_s.base, method=method, tol=tol, maxiter=maxiter, preconditioner=preconditioner, workers=workers)
+        return(calc_L_1_update(L_0, A_s.delta))
+    
+    L_1 = LeontiefSolver(A_s, method=method, tol=tol, maxiter=maxiter, preconditioner=preconditioner, workers=workers)
+    
+    if inverse:
+        return(L_1.inverse())
 
-    for l in range(A_s.shape[0]):
-        L_1[l] = np.linalg.inv(np.eye(A_s.shape[1]) - A_s[l])
+    return(L_1)
 
+
+def calc_L_1_update(L_0, delta_A, max_rank=None):
+    """
+    This function returns the Leontief Inverse Matrix of the shocked coefficients A_0 + delta_A, updating the baseline
+    one through the Sherman-Morrison-Woodbury identity where delta_A has low rank (e.g. a few technology columns).
+    Input:
+       L_0      - Baseline Leontief Inverse Matrix: 'LeontiefSolver' (see 'calc_L_1') or explicit (nL, n, n) inverse
+       delta_A  - Perturbations of the endogenous technical coefficients
+       max_rank - Maximum rank of delta_A updated incrementally (see 'lowRank'). Layers above it are refactorized
+    For a 'LeontiefSolver' a 'WoodburySolver' is returned; an explicit inverse is updated as
+    L_0 + (L_0 U) (I_k - Vt L_0 U)^-1 (Vt L_0), and layers above max_rank are re-inverted as (I - L_0 delta_A)^-1 L_0,
+    since I - (A_0 + delta_A) = (I - A_0)(I - L_0 delta_A).
+    """
+    
+    if isFactorized(L_0):
+        return(WoodburySolver(L_0, delta_A, max_rank))
+    
+    n = L_0.shape[1]
+    L_1 = np.array(L_0, dtype=float)
+    
+    for l in range(L_0.shape[0]):
+        factors = lowRank(delta_A[l], max_rank)
+        if factors is None:
+            L_1[l] = np.linalg.solve(np.eye(n) - L_0[l] @ delta_A[l], L_0[l])
+        elif factors[0].shape[1] > 0:
+            U, Vt = factors
+            LU = L_0[l] @ U
+            L_1[l] += LU @ np.linalg.solve(np.eye(U.shape[1]) - Vt @ LU, Vt @ L_0[l])
+    
     return(L_1)
 
 
@@ -29,12 +91,9 @@ def calc_Y_tot_1(Y_s):
        Y_s - Shocked final demand matrix
     """
     
-    Y_tot_1 = np.zeros((Y_s.shape[0],Y_s.shape[1],1))    
-
-    for l in range(Y_s.shape[0]):
-        Y_tot_1[l] = np.sum(Y_s[l],1,keepdims=True)
+    Y_tot_1 = stackRowSum(Y_s)
     
-    return(Y_tot_1)
+    return(np.asarray(Y_tot_1, dtype=float))
 
 
 def calc_x_1(L_1,Y_tot_1):
@@ -45,10 +104,10 @@ def calc_x_1(L_1,Y_tot_1):
        Y_tot - Total final demand vector
     """
     
-    x_1   = np.zeros((L_1.shape[0],L_1.shape[1],1))    
-
-    for l in range(L_1.shape[0]):
-        x_1[l] = L_1[l] @ Y_tot_1[l]
+    if isFactorized(L_1):
+        return(L_1.solve_layers(Y_tot_1))
+    
+    x_1 = np.asarray(L_1) @ Y_tot_1             # Batched product over the layers
     
     return(x_1)
     
@@ -70,7 +129,10 @@ def calc_R_1(B_s, L_1, Y_tot_1):
         Y_tot - Total final demand vector
     """
     
-    R_1 = B_s @ np.diagflat(L_1[0] @ Y_tot_1[0])
+    if isFactorized(L_1):
+        return(colScale(B_s, L_1.solve(Y_tot_1[0])))
+    
+    R_1 = colScale(B_s, L_1[0] @ Y_tot_1[0])
         
     return(R_1)
         
@@ -85,11 +147,54 @@ def calc_E_1(B_s, L_1, Y_tot):
         Y_tot - Total final demand vector
     """
     
-    E_1 = (B_s @ L_1[0]) @ np.diagflat(Y_tot[0])
+    if isFactorized(L_1):
+        return(colScale(L_1.solve_transpose(B_s), Y_tot[0]))            # B_s @ L through a transposed solve
+    
+    E_1 = colScale(B_s @ L_1[0], Y_tot[0])
         
     return(E_1)
     
 
 #%% Leontief Price Model
+"""
+This set of functions apply the Leontief (cost-push) Price Model on the set database: p = v @ L, with v the primary
+inputs (value added and imports) coefficients of the economic layer. Prices are obtained through transposed solves on
+the same factorization used by the Production and Impact Models; batches of value added vectors (rows of v) are solved at once.
+"""
+
 
-        
\ No newline at end of file
+def calc_v_1(w_s, m_s, delta_v=None):
+    """
+    This function returns the primary inputs coefficients vector, as the column sums of the value added and imports coefficients.
+    Inputs:
+       w_s     - Shocked value added technical coefficients matrix
+       m_s     - Shocked imports technical coefficients matrix
+       delta_v - Optional batch of value added shocks: (n,) vector or (nS, n) matrix, one shock per row
+    Output:
+       v_1     - (1, n) primary inputs coefficients vector, or (nS, n) matrix with a shocked vector per row
+    """
+    
+    v_1 = colSum(w_s[0]) + colSum(m_s[0])
+    
+    if delta_v is not None:
+        v_1 = v_1 + np.atleast_2d(delta_v)
+    
+    return(v_1)
+
+
+def calc_p_1(L_1, v_1):
+    """
+    This function returns the price indices following a perturbation due to a shock.
+    Inputs:
+       L_1 - Leontief Inverse Matrix
+       v_1 - Primary inputs coefficients: (1, n) vector or (nS, n) batch of vectors
+    Output:
+       p_1 - Price indices, with the shape of v_1 (one row per value added vector)
+    """
+    
+    if isFactorized(L_1):
+        return(L_1.solve_transpose(v_1))            # v_1 @ L through a transposed solve
+    
+    p_1 = v_1 @ L_1[0]
+    
+    return(p_1)
@@ -0,0 +1,177 @@
+import numpy as np
+import scipy.sparse as sp
+from pySUT.tables.sparse_tables import isSparse, rowSum, colSum, stackRowSum, stackColSum
+
+
+#%% Copy-on-write shocked matrices
+
+"""
+A shock usually touches a few coefficients, yet A_s = A_0 + delta_A allocates a whole new table for every scenario.
+The 'OverlayMatrix' class represents a shocked matrix (or multi-layer stack) as the baseline, held by reference and
+never copied, plus the sparse perturbation: each scenario costs memory proportional to the shock.
+Row/column sums and products with dense vectors and matrices are computed as baseline + overlay terms; the full
+matrix is materialised only on demand ('materialize' in the representation of the baseline, 'toarray' dense).
+The Leontief solvers accept overlays directly: 'calc_L_1' updates the baseline factorization through the low-rank
+structure of the overlay (see 'WoodburySolver'), materialising a layer only when it has to be refactorized.
+"""
+
+class OverlayMatrix:
+
+    __array_ufunc__ = None      # Products and arithmetic with numpy arrays are dispatched to the methods below
+
+    def __init__(self, base, delta):
+        """
+        Inputs:
+            base  - Baseline: dense (nL, rows, cols) stack or (rows, cols) matrix, block matrix, sparse matrix or list of sparse layers
+            delta - Perturbation with the layout of the baseline (dense or sparse), stored as sparse CSR layers
+        """
+
+        self.base = base
+        self.stacked = isinstance(base, list) or np.ndim(base) == 3
+
+        if self.stacked:
+            self.delta = [sp.csr_matrix(delta[l]) for l in range(len(base))]
+        else:
+            self.delta = sp.csr_matrix(delta)
+
+
+    @property
+    def shape(self):
+        if isinstance(self.base, list):
+            return((len(self.base),)+self.base[0].shape)
+        return(tuple(self.base.shape))
+
+    @property
+    def ndim(self):
+        return(len(self.shape))
+
+    @property
+    def dtype(self):
+        return(np.dtype(float))
+
+    @property
+    def sparse(self):
+        return(isSparse(self.base))
+
+    @property
+    def nnz(self):
+        """
+        Number of perturbed coefficients stored by the overlay.
+        """
+        return(sum(d.nnz for d in self.delta) if self.stacked else self.delta.nnz)
+
+    @property
+    def T(self):
+        if self.stacked:
+            raise ValueError('Only single-layer overlays can be transposed')
+        return(OverlayMatrix(self.base.T, self.delta.T))
+
+    def __len__(self):
+        return(self.shape[0])
+
+
+    def materialize(self):
+        """
+        This method returns the shocked matrix in the representation of the baseline (dense array or sparse CSR layers).
+        """
+
+        if isSparse(self.base):
+            if self.stacked:
+                return([(self.base[l] + self.delta[l]).tocsr() for l in range(len(self.base))])
+            return((self.base + self.delta).tocsr())
+
+        X = np.array(self.base, dtype=float)                        # The only copy of the baseline
+        for layer, d in zip(X if self.stacked else [X], self.delta if self.stacked else [self.delta]):
+            d = d.tocoo()
+            np.add.at(layer, (d.row, d.col), d.data)
+
+        return(X)
+
+    def toarray(self):
+        """
+        This method materialises the shocked matrix as a dense array.
+        """
+
+        X = self.materialize()
+        if isinstance(X, list):
+            return(np.array([X[l].toarray() for l in range(len(X))]))
+
+        return(X.toarray() if sp.issparse(X) else X)
+
+    def __array__(self, dtype=None, copy=None):
+        X = self.toarray()
+        return(X if dtype is None else X.astype(dtype))
+
+
+    def __getitem__(self, key):
+        """
+        Layer indices return the overlay of a single layer, without copying it. Any other indexing materialises the matrix.
+        """
+
+        if self.stacked and isinstance(key, (int, np.integer)):
+            return(OverlayMatrix(self.base[key], self.delta[key]))
+
+        return(self.toarray()[key])
+
+
+    def sum(self, axis=None, dtype=None, out=None, keepdims=False):
+        """
+        Row sums (sum over the columns) and column sums (sum over the rows) add up the baseline and overlay sums.
+        """
+
+        if axis is not None and axis < 0:
+            axis += self.ndim
+
+        if axis == self.ndim-1:
+            S = (stackRowSum(self.base) + stackRowSum(self.delta)) if self.stacked else (np.asarray(rowSum(self.base)) + rowSum(self.delta))
+        elif axis == self.ndim-2:
+            S = (stackColSum(self.base) + stackColSum(self.delta)) if self.stacked else (np.asarray(colSum(self.base)) + colSum(self.delta))
+        else:
+            return(np.sum(self.toarray(), axis=axis, dtype=dtype, out=out, keepdims=keepdims))
+
+        S = np.asarray(S, dtype=float)
+        if not keepdims:
+            S = S.squeeze(axis)
+
+        return(S if dtype is None else S.astype(dtype))
+
+
+    def __matmul__(self, X):
+        """
+        Product self @ X = base @ X + delta @ X, with X a dense vector, matrix or stack.
+        """
+
+        X = np.asarray(X)
+
+        if self.stacked:
+            return(np.array([self[l] @ (X[l] if X.ndim == 3 else X) for l in range(len(self))]))
+
+        return(np.asarray(self.base @ X) + self.delta @ X)
+
+
+    def __rmatmul__(self, X):
+        """
+        Product X @ self = X @ base + X @ delta, with X a dense vector, matrix or stack.
+        """
+
+        X = np.asarray(X)
+
+        if self.stacked:
+            return(np.array([(X[l] if X.ndim == 3 else X) @ self[l] for l in range(len(self))]))
+
+        return(np.asarray(X @ self.base) + (self.delta.T @ X.T).T)
+
+
+    # Element-wise arithmetic materialises the matrix
+
+    def __add__(self, X):
+        return(self.toarray() + np.asarray(X))
+
+    def __radd__(self, X):
+        return(np.asarray(X) + self.toarray())
+
+    def __sub__(self, X):
+        return(self.toarray() - np.asarray(X))
+
+    def __rsub__(self, X):
+        return(np.asarray(X) - self.toarray())
@@ -1,9 +1,12 @@
+import os
+import json
 import numpy as np
 import pandas as pd
+import scipy.sparse as sp
 
 #%% Creation of empty perturbed coefficient and final demand matrices
 
-def SA_delta_dict(nL, indices_agg):
+def SA_delta_dict(nL, indices_agg, layers=None):
     """
     This function exports empty and ready-to-modify technical coefficient and final demand matrices. 
     It will require the user to confirm the modifications made on the excel files.
@@ -11,10 +14,14 @@ def SA_delta_dict(nL, indices_agg):
     Inputs:
         nL             - Number of layers (economic + physical layers)
         indices_agg    - Dictionary containing aggregated indices
+        layers         - List of the ids of the selected layers, used to name the physical layers files. If None, the first nL layers are considered
     Outputs:
         ML_delta_coeff - Dictionary containing perturbed multi-layer coefficents
     """
         
+    if layers is None:
+        layers = list(range(nL))
+    
     nP_agg = len(indices_agg['prod'])      # Number of products items
     nI_agg = len(indices_agg['ind'])       # Number of industries items
     nW_agg = len(indices_agg['vadd'])      # Number of value added items
@@ -38,7 +45,7 @@ def SA_delta_dict(nL, indices_agg):
             pd.DataFrame(delta_B[l], index=indices_agg['exog'], columns=indices_agg['prod']+indices_agg['ind']).to_excel(delta_economic,'delta_B')
             delta_economic.save()
         else:
-            delta_physical = pd.ExcelWriter('pySUT/applications/shock_analysis/perturbed_matrices/delta_physical_layer_'+str(l)+'.xlsx', engine='xlsxwriter')
+            delta_physical = pd.ExcelWriter('pySUT/applications/shock_analysis/perturbed_matrices/delta_physical_layer_'+str(layers[l])+'.xlsx', engine='xlsxwriter')
             pd.DataFrame(delta_A[l], index=indices_agg['prod']+indices_agg['ind'], columns=indices_agg['prod']+indices_agg['ind']).to_excel(delta_physical,'delta_A')
             pd.DataFrame(delta_w[l], index=indices_agg['vadd'], columns=indices_agg['prod']+indices_agg['ind']).to_excel(delta_physical,'delta_w')
             pd.DataFrame(delta_m[l], index=indices_agg['imp'], columns=indices_agg['prod']+indices_agg['ind']).to_excel(delta_physical,'delta_m')
@@ -59,7 +66,7 @@ def SA_delta_dict(nL, indices_agg):
             delta_Y[l] = pd.read_excel(delta_economic,"delta_Y", header=0, index_col=0).values
             delta_B[l] = pd.read_excel(delta_economic,"delta_B", header=0, index_col=0).values
         else:
-            delta_physical = 'pySUT/applications/shock_analysis/perturbed_matrices/delta_physical_layer_'+str(l)+'.xlsx'                       
+            delta_physical = 'pySUT/applications/shock_analysis/perturbed_matrices/delta_physical_layer_'+str(layers[l])+'.xlsx'                       
             delta_A[l] = pd.read_excel(delta_physical,"delta_A", header=0, index_col=0).values
             delta_w[l] = pd.read_excel(delta_physical,"delta_w", header=0, index_col=0).values
             delta_m[l] = pd.read_excel(delta_physical,"delta_m", header=0, index_col=0).values
@@ -80,4 +87,163 @@ def SA_delta_dict(nL, indices_agg):
             
             
             
-            
\ No newline at end of file
+            
+
+
+#%% Declarative shock specification
+
+"""
+As an alternative to the interactive Excel round-trip above, perturbations can be listed in a CSV, JSON or YAML file
+and compiled directly into sparse variation matrices, without writing or reading any dense matrix.
+Each record is a rule acting on a block of one coefficients matrix:
+    matrix    - 'A', 'w', 'm', 'Y' or 'B'
+    layer     - Id of the layer (as in 'layers'), the economic layer if missing. 'B' has the economic layer only
+    row, col  - Aggregated index label, list of labels (';'-separated in CSV files) or '*' for the whole index
+    row_level - Level of the row index the labels refer to (position or name), 0 if missing.
+    col_level   Labels at higher levels select whole index groups (e.g. every product of a sector)
+    rule      - 'add' (delta = value), 'mul' (delta = (value - 1) * coefficient) or 'set' (delta = value - coefficient)
+    value     - Value of the rule
+Rules are independent: the variations of rules acting on the same coefficient are summed.
+A JSON/YAML file holds a list of records, or a dictionary with the list under 'shocks'. For example (YAML):
+    shocks:
+      - {matrix: A, row: c01a_cer, col: i01_agr, rule: mul, value: 0.9}
+      - {matrix: Y, row: c01_agr, row_level: 1, col: '*', rule: add, value: 100}
+"""
+
+shock_matrices = ['A','w','m','Y','B']
+shock_rules = ['add','mul','set']
+
+
+def shocksRead(path):
+    """
+    This function reads the records of a shock specification file (.csv, .json, .yaml or .yml).
+    """
+
+    ext = os.path.splitext(path)[1].lower()
+
+    if ext == '.csv':
+        records = pd.read_csv(path, dtype=str, keep_default_na=False).to_dict('records')
+        for record in records:
+            for key in ['row','col']:
+                if ';' in str(record.get(key,'')):
+                    record[key] = [label.strip() for label in record[key].split(';')]
+            for key in list(record):
+                if record[key] == '':
+                    del record[key]
+        return(records)
+
+    if ext in ['.yaml','.yml']:
+        try:
+            import yaml
+        except ImportError:
+            raise ImportError("Reading YAML shock specifications requires the 'pyyaml' package")
+        with open(path) as f:
+            shocks = yaml.safe_load(f)
+    elif ext == '.json':
+        with open(path) as f:
+            shocks = json.load(f)
+    else:
+        raise ValueError("Unknown shock specification format '"+ext+"': available formats are .csv, .json, .yaml and .yml")
+
+    return(shocks['shocks'] if isinstance(shocks, dict) else shocks)
+
+
+def shocksAxes(indices_agg):
+    """
+    This function returns the row and column indices of each coefficients matrix.
+    """
+
+    zInd = indices_agg['prod'].append(indices_agg['ind'])          # Products and industries labels
+
+    return({
+           'A' : (zInd, zInd),
+           'w' : (indices_agg['vadd'], zInd),
+           'm' : (indices_agg['imp'], zInd),
+           'Y' : (zInd, indices_agg['fd']),
+           'B' : (indices_agg['exog'], zInd),
+           })
+
+
+def labelsSelect(index, labels, level=0):
+    """
+    This function returns the positions of an index matching the labels at a level ('*' selects the whole index).
+    """
+
+    if isinstance(labels, str) and labels.strip() == '*':
+        return(np.arange(len(index)))
+
+    labels = [labels] if not isinstance(labels, (list, tuple)) else list(labels)
+    level = int(level) if str(level).lstrip('-').isdigit() else level
+    keys = index.get_level_values(level) if isinstance(index, pd.MultiIndex) else index
+
+    match = keys.isin([str(label) for label in labels])
+    missing = [label for label in labels if str(label) not in set(keys.astype(str))]
+    if len(missing) > 0:
+        raise ValueError('Labels '+str(missing)+' not found at level '+str(level)+' of the index')
+
+    return(np.flatnonzero(match))
+
+
+def SA_delta_spec(nL, indices_agg, spec, ML_iot_coeff_0=None, layers=None):
+    """
+    This function compiles a declarative shock specification into sparse variation matrices.
+    Inputs:
+        nL             - Number of layers (economic + physical layers)
+        indices_agg    - Dictionary containing aggregated indices
+        spec           - Path of the specification file (.csv, .json, .yaml, .yml) or list of records
+        ML_iot_coeff_0 - Dictionary containing technical coefficients for the IOT-like tables (required by 'mul' and 'set' rules)
+        layers         - List of the ids of the selected layers. If None, the first nL layers are considered
+    Outputs:
+        ML_delta_coeff - Dictionary containing the variations of the coefficients, as lists of nL sparse matrices
+                         ('delta_B' is a single sparse matrix)
+    """
+
+    if layers is None:
+        layers = list(range(nL))
+
+    records = shocksRead(spec) if isinstance(spec, str) else spec
+    axes = shocksAxes(indices_agg)
+
+    entries = {key: [[[], [], []] for l in range(nL)] for key in shock_matrices}      # (rows, cols, values) of every layer
+
+    for i, record in enumerate(records):
+        key = str(record.get('matrix'))
+        rule = str(record.get('rule','add'))
+        if key not in shock_matrices:
+            raise ValueError('Shock '+str(i)+": unknown matrix '"+key+"', available matrices are "+str(shock_matrices))
+        if rule not in shock_rules:
+            raise ValueError('Shock '+str(i)+": unknown rule '"+rule+"', available rules are "+str(shock_rules))
+
+        layer = int(record.get('layer', layers[0]))
+        if layer not in layers or (key == 'B' and layer != layers[0]):
+            raise ValueError('Shock '+str(i)+': layer '+str(layer)+' is not available for matrix '+key)
+        l = layers.index(layer)
+
+        rows = labelsSelect(axes[key][0], record.get('row','*'), record.get('row_level',0))
+        cols = labelsSelect(axes[key][1], record.get('col','*'), record.get('col_level',0))
+        r, c = np.repeat(rows, len(cols)), np.tile(cols, len(rows))
+        value = float(record.get('value',0))
+
+        if rule == 'add':
+            delta = np.full(len(r), value)
+        else:
+            if ML_iot_coeff_0 is None:
+                raise ValueError('Shock '+str(i)+": the '"+rule+"' rule requires the baseline coefficients")
+            X = ML_iot_coeff_0[key] if key == 'B' else ML_iot_coeff_0[key][l]
+            X = X[rows][:,cols].toarray() if sp.issparse(X) else np.asarray(X)[np.ix_(rows, cols)]
+            delta = (value - 1)*X.ravel() if rule == 'mul' else value - X.ravel()
+
+        keep = delta != 0
+        for entry, values in zip(entries[key][l], [r[keep], c[keep], delta[keep]]):
+            entry.append(values)
+
+    ML_delta_coeff = {}
+    for key in shock_matrices:
+        shape = (len(axes[key][0]), len(axes[key][1]))
+        stack = []
+        for l in range(nL):
+            r, c, v = [np.concatenate(entry) if len(entry) > 0 else np.zeros(0) for entry in entries[key][l]]
+            stack.append(sp.csr_matrix((v, (r.astype(int), c.astype(int))), shape=shape))      # Duplicates are summed
+        ML_delta_coeff['delta_'+key] = stack[0] if key == 'B' else stack
+
+    return(ML_delta_coeff)
\ No newline at end of file
@@ -0,0 +1,113 @@
+import numpy as np
+import scipy.sparse as sp
+from pySUT.tables.sparse_tables import stackRowSum
+from pySUT.applications.rescaling import colScale
+from pySUT.applications.shock_analysis.leontief_models import isFactorized
+
+
+#%% Multi-scenario final demand shocks
+
+"""
+This set of functions applies the Leontief Production and Impact Models to a batch of nS final demand scenarios
+sharing the same technical coefficients. The total final demand vectors of all the scenarios are gathered into the
+columns of a single (n, nS) right-hand side, solved once per layer against the factorization of (I - A);
+B @ L is computed once and rescaled by the final demand of every scenario.
+All the results are scenario-indexed: position s of the first axis refers to scenario s.
+"""
+
+def calc_Y_tot_S(Y_0, delta_Y):
+    """
+    This function returns the total final demand vectors of every scenario.
+    Inputs:
+        Y_0      - Baseline final demand matrices: dense (nL, n, nY) stack or list of sparse layers
+        delta_Y  - Final demand perturbations: dense (nS, nL, n, nY) array, or list of nS perturbations
+                   in any form accepted by 'calc_Y_s' (dense stacks or lists of sparse layers)
+    Output:
+        Y_tot_S  - (nS, nL, n, 1) array of total final demand vectors
+    """
+
+    if isinstance(delta_Y, np.ndarray):
+        delta_tot = np.sum(delta_Y, -1, keepdims=True)
+    else:
+        delta_tot = np.array([stackRowSum(delta_Y[s]) for s in range(len(delta_Y))])
+
+    Y_tot_S = stackRowSum(Y_0)[None] + delta_tot
+
+    return(Y_tot_S)
+
+
+def calc_x_S(L_1, Y_tot_S):
+    """
+    This function returns the production vectors of every scenario, solving one multi-right-hand-side system per layer.
+    Inputs:
+        L_1      - Leontief Inverse Matrix ('LeontiefSolver' or explicit (nL, n, n) inverse)
+        Y_tot_S  - (nS, nL, n, 1) array of total final demand vectors
+    Output:
+        x_S      - (nS, nL, n, 1) array of production vectors
+    """
+
+    rhs = Y_tot_S[...,0].transpose(1,2,0)        # (nL, n, nS): one column per scenario
+
+    if isFactorized(L_1):
+        X = L_1.solve_layers(rhs)
+    else:
+        X = np.asarray(L_1) @ rhs
+
+    x_S = X.transpose(2,0,1)[...,None]
+
+    return(x_S)
+
+
+def calc_R_S(B_s, x_S):
+    """
+    Production-based approach (PBA).
+    This function returns the direct exogenous transactions matrices of every scenario.
+    Inputs:
+        B_s      - Exogenous technical coefficients matrix (dense or sparse)
+        x_S      - (nS, nL, n, 1) array of production vectors
+    Output:
+        R_S      - (nS, nR, n) array of direct exogenous transactions matrices (list of nS sparse matrices for sparse B_s)
+    """
+
+    if sp.issparse(B_s):
+        return([colScale(B_s, x_S[s,0]) for s in range(x_S.shape[0])])
+
+    R_S = np.asarray(B_s)[None,:,:] * x_S[:,0,:,0][:,None,:]
+
+    return(R_S)
+
+
+def calc_E_S(B_s, L_1, Y_tot_S):
+    """
+    Consumption-based approach (CBA).
+    This function returns the embodied exogenous transactions matrices of every scenario.
+    Inputs:
+        B_s      - Exogenous technical coefficients matrix (dense or sparse)
+        L_1      - Leontief Inverse Matrix ('LeontiefSolver' or explicit (nL, n, n) inverse)
+        Y_tot_S  - (nS, nL, n, 1) array of total final demand vectors
+    Output:
+        E_S      - (nS, nR, n) array of embodied exogenous transactions matrices
+    """
+
+    if isFactorized(L_1):
+        BL = L_1.solve_transpose(B_s)             # B_s @ L through a single transposed solve
+    else:
+        BL = np.asarray(B_s @ L_1[0])
+
+    E_S = BL[None,:,:] * Y_tot_S[:,0,:,0][:,None,:]
+
+    return(E_S)
+
+
+#%% Creation of a single dictionary
+
+def ML_scenarios_1(Y_tot_S, x_S, R_S, E_S):
+
+    ML_scenarios_1 = {
+                     'Y_tot' : Y_tot_S,
+                     'x'     : x_S,
+                     'R'     : R_S,
+                     'E'     : E_S
+                     }
+
+    return(ML_scenarios_1)
@@ -1,75 +1,128 @@
 import numpy as np
+import scipy.sparse as sp
+from pySUT.tables.sparse_tables import isSparse
+from pySUT.applications.shock_analysis.overlay_matrix import OverlayMatrix
 
 
 #%% Shock: matrices variation
 
 """
-This set of functions aims at recalculating the technical coefficient matrices following a perturbation due to a shock
+This set of functions aims at recalculating the technical coefficient matrices following a perturbation due to a shock.
+Dense multi-layer stacks are summed with their perturbations in a single operation over all the layers;
+sparse baseline matrices (see 'sparse_tables') are summed with the sparse form of the perturbations.
+Sparse perturbations of dense matrices (e.g. compiled by 'SA_delta_spec') are scattered into a copy of the baseline.
+With 'overlay' True, the shocked matrix is returned as copy-on-write baseline + sparse overlay (see 'OverlayMatrix').
 """
 
-def calc_A_s(A_0,delta_A):   
+def deltaScatter(X_0, delta):
+    """
+    This function adds sparse perturbations to a copy of a dense matrix or multi-layer stack, touching only their non-null entries.
+    """
+
+    X_s = np.array(X_0, dtype=float)
+    deltas = delta if isinstance(delta, list) else [delta]
+
+    for X, d in zip([X_s] if X_s.ndim == 2 else X_s, deltas):
+        d = sp.coo_matrix(d)
+        np.add.at(X, (d.row, d.col), d.data)
+
+    return(X_s)
+
+
+def calc_A_s(A_0, delta_A, overlay=False):   
     """
     This function recalculates the endogenous technical coefficients matrix 'A', 
     following a perturbation 'delta_A' due to a shock
     """
     
-    A_s = np.zeros((A_0.shape[0], A_0.shape[1], A_0.shape[2]))
+    if overlay:
+        return(OverlayMatrix(A_0, delta_A))
+
+    if isSparse(delta_A) and not isSparse(A_0):
+        return(deltaScatter(A_0, delta_A))
+
+    if isSparse(A_0):
+        return([(A_0[l] + sp.csr_matrix(delta_A[l])).tocsr() for l in range(len(A_0))])
     
-    for l in range(A_0.shape[0]):
-        A_s[l] = A_0[l] + delta_A[l]
+    A_s = A_0 + delta_A
                   
     return(A_s)
 
 
-def calc_w_s(w_0, delta_w):   
+def calc_w_s(w_0, delta_w, overlay=False):   
     """
     This function recalculates the value added technical coefficients matrix 'w',
     following a perturbation 'delta_w' due to a shock
     """
-    w_s = np.zeros((w_0.shape[0], w_0.shape[1], w_0.shape[2]))
+    if overlay:
+        return(OverlayMatrix(w_0, delta_w))
 
-    for l in range(w_0.shape[0]): 
-        w_s = w_0 + delta_w
+    if isSparse(delta_w) and not isSparse(w_0):
+        return(deltaScatter(w_0, delta_w))
+
+    if isSparse(w_0):
+        return([(w_0[l] + sp.csr_matrix(delta_w[l])).tocsr() for l in range(len(w_0))])
+    
+    w_s = w_0 + delta_w
                   
     return(w_s)
 
 
-def calc_m_s(m_0, delta_m):   
+def calc_m_s(m_0, delta_m, overlay=False):   
     """
     This function recalculates the imports technical coefficients matrix 'm', 
     following a perturbation 'delta_m' due to a shock
     """
-    m_s = np.zeros((m_0.shape[0], m_0.shape[1], m_0.shape[2]))
+    if overlay:
+        return(OverlayMatrix(m_0, delta_m))
 
-    for l in range(m_0.shape[0]): 
-        m_s = m_0 + delta_m
+    if isSparse(delta_m) and not isSparse(m_0):
+        return(deltaScatter(m_0, delta_m))
+
+    if isSparse(m_0):
+        return([(m_0[l] + sp.csr_matrix(delta_m[l])).tocsr() for l in range(len(m_0))])
+    
+    m_s = m_0 + delta_m
                   
     return(m_s)
 
 
-def calc_B_s(B_0,delta_B):
+def calc_B_s(B_0, delta_B, overlay=False):
     """
     This function recalculates the exogenous technical coefficients matrix 'B', 
     following a perturbation 'delta_B' due to a shock
     """
 
-    B_s = np.zeros((B_0.shape[0], B_0.shape[1]))
+    if overlay:
+        return(OverlayMatrix(B_0, delta_B))
+
+    if isSparse(delta_B) and not isSparse(B_0):
+        return(deltaScatter(B_0, delta_B))
+
+    if isSparse(B_0):
+        return((B_0 + sp.csr_matrix(delta_B)).tocsr())
     
     B_s = B_0 + delta_B
 
     return(B_s)
 
 
-def calc_Y_s(Y_0,delta_Y):
+def calc_Y_s(Y_0, delta_Y, overlay=False):
     """
     This function recalculates the final demand matrix 'Y', 
     following a perturbation 'delta_Y' due to a shock
     """
 
-    Y_s = np.zeros((Y_0.shape[0], Y_0.shape[1], Y_0.shape[2]))
+    if overlay:
+        return(OverlayMatrix(Y_0, delta_Y))
 
-    for l in range(Y_0.shape[0]):                                 
-        Y_s = Y_0 + delta_Y
+    if isSparse(delta_Y) and not isSparse(Y_0):
+        return(deltaScatter(Y_0, delta_Y))
+
+    if isSparse(Y_0):
+        return([(Y_0[l] + sp.csr_matrix(delta_Y[l])).tocsr() for l in range(len(Y_0))])
+    
+    Y_s = Y_0 + delta_Y
 
     return(Y_s)
 
@@ -0,0 +1,159 @@
+import time
+import heapq
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from pySUT.tables.sparse_tables import rowSum
+from pySUT.applications.leontief_solver import LeontiefSolver
+
+
+#%% Structural path analysis
+
+"""
+The embodied exogenous transactions E = B @ L @ diag(y) of the economic layer are decomposed into supply-chain paths by
+expanding the Leontief power series L = I + A + A^2 + ...: the path k <- j1 <- ... <- jt, from the final demand of
+sector k upstream to sector jt, contributes y_k * a_j1,k * ... * a_jt,jt-1 * b_r,jt to E_rk.
+The paths are searched best-first (branch-and-bound): every node of the tree is keyed in a priority queue by the
+total contribution of its subtree, weight * (B @ L)_r,j, which bounds any path through it (non-negative coefficients).
+Subtrees whose bound falls below the threshold, or below the k-th best path already found, are pruned.
+Each search stops at explicit limits on time, expanded nodes and memory (open nodes), reporting whether it was truncated.
+"""
+
+node_bytes = 200        # Approximate memory of a node of the search tree (node store and priority queue entry)
+
+
+def pathSearch(A, b, m, y_k, k, top=10, threshold=0.0, max_depth=None, max_time=None, max_nodes=None, max_memory=None):
+    """
+    This function searches the top paths of the embodied exogenous transaction E_rk.
+    Inputs:
+        A          - Endogenous coefficients of the economic layer: dense (n, n) matrix or sparse CSC matrix
+        b          - (n,) exogenous coefficients of item r
+        m          - (n,) multipliers (B @ L)_r of item r
+        y_k        - Total final demand of sector k
+        k          - Position of sector k
+        top        - Number of paths returned
+        threshold  - Absolute contribution below which subtrees are pruned
+        max_depth  - Maximum path length (number of upstream steps). If None, unlimited
+        max_time   - Maximum search time, in seconds. If None, unlimited
+        max_nodes  - Maximum number of expanded nodes. If None, unlimited
+        max_memory - Maximum memory of the search tree, in MB (see 'node_bytes'). If None, unlimited
+    Outputs:
+        paths      - List of (contribution, path) pairs sorted by decreasing contribution, the path being the tuple of sector positions from k upstream
+        info       - Dictionary of expanded nodes, stored nodes, time and truncation reason (None if the search was completed)
+    """
+
+    t_start = time.perf_counter()
+    max_stored = None if max_memory is None else int(max_memory*2**20/node_bytes)
+
+    parent, sector, weight, depth = [-1], [k], [y_k], [0]       # Node store: paths are rebuilt from the parents
+    queue = [(-y_k*m[k], 0)]
+    best = []                                                   # Min-heap of the top paths found
+    expanded, truncated = 0, None
+
+    while queue:
+        if max_time is not None and time.perf_counter() - t_start > max_time:
+            truncated = 'time'
+            break
+        if max_nodes is not None and expanded >= max_nodes:
+            truncated = 'nodes'
+            break
+        if max_stored is not None and len(parent) >= max_stored:
+            truncated = 'memory'
+            break
+
+        bound, node = heapq.heappop(queue)
+        if len(best) == top and -bound <= best[0][0]:           # No path of the remaining subtrees can enter the top paths
+            break
+
+        expanded += 1
+        j, w = sector[node], weight[node]
+
+        value = w*b[j]
+        if value > threshold and value != 0:
+            if len(best) < top:
+                heapq.heappush(best, (value, node))
+            elif value > best[0][0]:
+                heapq.heapreplace(best, (value, node))
+
+        if max_depth is not None and depth[node] >= max_depth:
+            continue
+
+        if sp.issparse(A):
+            rows = A.indices[A.indptr[j]:A.indptr[j+1]]
+            col = A.data[A.indptr[j]:A.indptr[j+1]]
+        else:
+            rows = np.flatnonzero(A[:,j])
+            col = A[rows,j]
+
+        w_child = w*col
+        bounds = w_child*m[rows]
+        keep = bounds > max(threshold, best[0][0] if len(best) == top else 0.0)     # Branch-and-bound pruning
+
+        for i, wi, bi in zip(rows[keep], w_child[keep], bounds[keep]):
+            parent.append(node); sector.append(int(i)); weight.append(wi); depth.append(depth[node]+1)
+            heapq.heappush(queue, (-bi, len(parent)-1))
+
+    paths = []
+    for value, node in sorted(best, reverse=True):
+        path = []
+        while node != -1:
+            path.append(sector[node])
+            node = parent[node]
+        paths.append((value, tuple(path[::-1])))
+
+    info = {'expanded': expanded, 'stored': len(parent), 'time': time.perf_counter() - t_start, 'truncated': truncated}
+
+    return(paths, info)
+
+
+def calc_SPA(ML_iot_coeff_0, exog=None, sectors=None, top=10, threshold=1e-4, max_depth=None, max_time=None, max_nodes=10**6,
+             max_memory=None, labels=None, solver='lu', solver_tol=1e-10):
+    """
+    This function performs the structural path analysis of the embodied exogenous transactions of the economic layer.
+    Inputs:
+        ML_iot_coeff_0 - Dictionary containing technical coefficients for the IOT-like tables
+        exog           - List of the positions of the analysed satellite items. If None, all the items
+        sectors        - List of the positions of the analysed sectors (final demand). If None, all the sectors with final demand
+        top            - Number of paths returned for each satellite item and sector
+        threshold      - Contribution below which subtrees are pruned, relative to E_rk
+        max_depth      - Maximum path length. If None, unlimited
+        max_time       - Maximum time of each search, in seconds. If None, unlimited
+        max_nodes      - Maximum number of nodes expanded by each search. If None, unlimited
+        max_memory     - Maximum memory of each search tree, in MB. If None, unlimited
+        labels         - Optional dictionary of the labels of the sectors ('sectors') and satellite items ('exog')
+        solver         - Method solving the Leontief model for the multipliers B @ L (see 'LeontiefSolver')
+        solver_tol     - Relative tolerance of the iterative solvers and of the power series
+    Outputs:
+        paths_0        - DataFrame of the top paths: satellite item, sector, rank, contribution, share of E_rk, length and path
+        info_0         - DataFrame of each search: E_rk, share covered by the top paths, expanded and stored nodes, time and truncation
+    """
+
+    A = ML_iot_coeff_0['A'][0]
+    B = ML_iot_coeff_0['B']
+    y = rowSum(ML_iot_coeff_0['Y'][0]).ravel()
+
+    M = LeontiefSolver(A, method=solver, tol=solver_tol).solve_transpose(B)      # Multipliers B @ L
+    A = sp.csc_matrix(A) if sp.issparse(A) else np.asarray(A, dtype=float)
+    B = B.toarray() if sp.issparse(B) else np.asarray(B, dtype=float)
+
+    exog = range(B.shape[0]) if exog is None else exog
+    sectors = np.flatnonzero(y) if sectors is None else sectors
+    label = lambda key, i: i if labels is None else labels[key][i]
+
+    paths_0, info_0 = [], []
+    for r in exog:
+        for k in sectors:
+            E_rk = y[k]*M[r,k]
+            paths, info = pathSearch(A, B[r], M[r], y[k], k, top, abs(threshold*E_rk), max_depth, max_time, max_nodes, max_memory)
+            for rank, (value, path) in enumerate(paths):
+                paths_0.append({'exog': label('exog', r), 'sector': label('sectors', k), 'rank': rank+1, 'value': value,
+                                'share': value/E_rk if E_rk != 0 else np.nan, 'length': len(path)-1,
+                                'path': tuple(label('sectors', i) for i in path)})
+            info.update({'exog': label('exog', r), 'sector': label('sectors', k), 'E': E_rk,
+                         'coverage': sum(value for value, path in paths)/E_rk if E_rk != 0 else np.nan})
+            info_0.append(info)
+
+    paths_0 = pd.DataFrame(paths_0, columns=['exog','sector','rank','value','share','length','path'])
+    info_0 = pd.DataFrame(info_0, columns=['exog','sector','E','coverage','expanded','stored','time','truncated'])
+
+    return(paths_0, info_0)
@@ -1,4 +1,4 @@
-import numpy as np
+from pySUT.applications.rescaling import colScale
 
 
 #%% Technical coefficients for the baseline database
@@ -7,56 +7,50 @@ import numpy as np
 This set of functions aims at calculating the technical coefficient matrices for the baseline database
 """
 
-def calc_Z_1(A_s,x_1):   
+def calc_Z_1(A_s,x_1,out=None):   
     """
     This function calculates new endogenous transaction matrices.
     Inputs:
         A_s - Perturbed endogenous coefficients matrices
         x_1 - New output vectors
+        out - Optional preallocated array into which Z_1 is written
     Output:
         Z_1 - New endogenous transactions matrices
     """     
     
-    Z_1 = np.zeros((A_s.shape[0], A_s.shape[1], A_s.shape[2]))
-                  
-    for l in range(A_s.shape[0]):
-        Z_1[l] = A_s[l] @ np.diagflat(x_1[0])
+    Z_1 = colScale(A_s, x_1[0], out=out)
 
     return(Z_1)
 
         
-def calc_W_1(w_s,x_1):   
+def calc_W_1(w_s,x_1,out=None):   
     """
     This function calculates new value added matrices.
     Inputs:
         w_s - Perturbed value added coefficients matrices
         x_1 - New output vectors
+        out - Optional preallocated array into which W_1 is written
     Output:
         W_1 - New value added matrices
     """     
          
-    W_1 = np.zeros((w_s.shape[0], w_s.shape[1], w_s.shape[2]))
-                  
-    for l in range(w_s.shape[0]):
-        W_1[l] = w_s[l] @ np.diagflat(x_1[0])
+    W_1 = colScale(w_s, x_1[0], out=out)
 
     return(W_1)
 
 
-def calc_M_1(m_s,x_1):   
+def calc_M_1(m_s,x_1,out=None):   
     """
     This function calculates new endogenous transaction matrices.
     Inputs:
         m_s - Perturbed import matrices
         x_1 - New output vectors
+        out - Optional preallocated array into which M_1 is written
     Output:
         M_1 - New import matrices
     """     
          
-    M_1 = np.zeros((m_s.shape[0], m_s.shape[1], m_s.shape[2]))
-                  
-    for l in range(m_s.shape[0]):
-        M_1[l] = m_s[l] @ np.diagflat(x_1[0])
+    M_1 = colScale(m_s, x_1[0], out=out)
 
     return(M_1)
 
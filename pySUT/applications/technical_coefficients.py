@@ -1,10 +1,12 @@
-import numpy as np
+from pySUT.applications.rescaling import colScale
 
 
 #%% Technical coefficients for the baseline database
 
 """
-This set of functions aims at calculating the technical coefficient matrices for the baseline database
+This set of functions aims at calculating the technical coefficient matrices for the baseline database.
+Columns are divided by the economic production vector through 'colScale', by broadcasting over all the layers at once.
+Sparse transaction matrices (see 'sparse_tables') are scaled by a sparse diagonal matrix and returned in sparse form.
 """
 
 def calc_A_0(Z_0,x_0):   
@@ -17,10 +19,7 @@ def calc_A_0(Z_0,x_0):
     will be calculated as a function of the economic production vector 'x_0[0]'
     """
      
-    A_0 = np.zeros((Z_0.shape[0], Z_0.shape[1], Z_0.shape[2]))
-                  
-    for l in range(Z_0.shape[0]):
-        A_0[l] = Z_0[l] @ np.linalg.inv(np.diagflat(x_0[0]))
+    A_0 = colScale(Z_0, x_0[0], inverse=True)
 
     return(A_0)
 
@@ -35,10 +34,7 @@ def calc_w_0(W_0,x_0):
     will be calculated as a function of the economic production vector 'x_0[0]'
     """
      
-    w_0 = np.zeros((W_0.shape[0], W_0.shape[1], W_0.shape[2]))
-                  
-    for l in range(W_0.shape[0]):
-        w_0[l] = W_0[l] @ np.linalg.inv(np.diagflat(x_0[0]))
+    w_0 = colScale(W_0, x_0[0], inverse=True)
     
     return(w_0)
     
@@ -53,10 +49,7 @@ def calc_m_0(M_0,x_0):
     will be calculated as a function of the economic production vector 'x_0[0]'
     """
      
-    m_0 = np.zeros((M_0.shape[0], M_0.shape[1], M_0.shape[2]))
-                  
-    for l in range(M_0.shape[0]):
-        m_0[l] = M_0[l] @ np.linalg.inv(np.diagflat(x_0[0]))
+    m_0 = colScale(M_0, x_0[0], inverse=True)
 
     return(m_0)
 
@@ -69,8 +62,8 @@ def calc_B_0(R_0,x_0):
         x - Total production vector
     The exogenous coefficients will be calculated as a function of the economic production vector 'x[0]'
     """
-                
-    B_0 = R_0 @ np.linalg.inv(np.diagflat(x_0[0]))
+    
+    B_0 = colScale(R_0, x_0[0], inverse=True)
 
     return(B_0)
 
@@ -0,0 +1,261 @@
+import time
+import numpy as np
+import scipy.sparse as sp
+from pySUT.parsing.block_matrix import BlockMatrix
+
+
+#%% Balancing of IOT-like multi-layer tables
+
+"""
+This set of functions balances the IOT-like tables of each layer, so that the output (row sums of [Z, Y]) and the
+outlays (column sums of [Z; W; M]) of every product/industry match.
+The matrix T = [[Z, Y], [W, 0], [M, 0]] of each layer is rescaled as r_i * T_ij * s_j (RAS) or, to handle negative
+entries (e.g. value added net of subsidies), as r_i * P_ij * s_j - N_ij / (r_i * s_j) with T = P - N (GRAS), where
+r and s are row and column multipliers. T is never assembled: only products of its blocks by the multipliers are computed,
+for all the layers at once in the case of dense and block stacks. Sparse stacks are handled layer by layer.
+
+Reference: Lenzen M., Wood R., Gallego B., "Some comments on the GRAS method", Economic Systems Research, 2007
+"""
+
+def stackMatVec(X, v):
+    """
+    This function returns X[l] @ v[l] for every layer of a dense, block or sparse stack, with v a (nL, columns) array.
+    """
+
+    if isinstance(X, list):
+        return(np.array([np.asarray(X[l] @ v[l]).ravel() for l in range(len(X))]))
+
+    return((X @ v[:,:,None])[:,:,0])
+
+
+def stackVecMat(v, X):
+    """
+    This function returns v[l] @ X[l] for every layer of a dense, block or sparse stack, with v a (nL, rows) array.
+    """
+
+    if isinstance(X, list):
+        return(np.array([np.asarray(X[l].T @ v[l]).ravel() for l in range(len(X))]))
+
+    return((v[:,None,:] @ X)[:,0,:])
+
+
+def stackShape(X):
+    """
+    This function returns the (nL, rows, columns) shape of a dense, block or sparse stack.
+    """
+
+    if isinstance(X, list):
+        return((len(X),) + X[0].shape)
+
+    return(X.shape)
+
+
+def stackParts(X):
+    """
+    This function splits a dense, block or sparse stack into its positive and negative parts, such that X = P - N.
+    """
+
+    if isinstance(X, list):
+        return([X[l].maximum(0).tocsr() for l in range(len(X))], [(-X[l]).maximum(0).tocsr() for l in range(len(X))])
+
+    if isinstance(X, BlockMatrix):
+        P = BlockMatrix([[None if block is None else np.maximum(block, 0) for block in row] for row in X.blocks], X.rows, X.cols)
+        N = BlockMatrix([[None if block is None else np.maximum(-block, 0) for block in row] for row in X.blocks], X.rows, X.cols)
+        return(P, N)
+
+    return(np.maximum(X, 0), np.maximum(-np.asarray(X), 0))
+
+
+def stackNegative(X):
+    """
+    This function returns True if a dense, block or sparse stack has negative entries.
+    """
+
+    if isinstance(X, list):
+        return(any(X[l].nnz > 0 and X[l].data.min() < 0 for l in range(len(X))))
+
+    if isinstance(X, BlockMatrix):
+        return(any(block is not None and block.size > 0 and block.min() < 0 for row in X.blocks for block in row))
+
+    return(bool(np.size(X) > 0 and np.min(X) < 0))
+
+
+def stackScale(X, r, s):
+    """
+    This function returns the stack with entries r_i * X_ij * s_j where X_ij >= 0 and X_ij / (r_i * s_j) where X_ij < 0,
+    keeping the representation (dense, block or sparse) of X.
+    Inputs:
+        X - Dense (nL, rows, columns) stack, block matrix or list of sparse layers
+        r - (nL, rows) array of row multipliers
+        s - (nL, columns) array of column multipliers
+    """
+
+    if isinstance(X, list):
+        X_s = []
+        for l in range(len(X)):
+            X_l = X[l].tocsr()
+            f = r[l][np.repeat(np.arange(X_l.shape[0]), np.diff(X_l.indptr))] * s[l][X_l.indices]      # Multiplier of each stored entry
+            with np.errstate(divide='ignore', invalid='ignore'):
+                data = np.where(X_l.data >= 0, X_l.data*f, X_l.data/f)
+            X_s += [sp.csr_matrix((data, X_l.indices.copy(), X_l.indptr.copy()), shape=X_l.shape)]
+        return(X_s)
+
+    if isinstance(X, BlockMatrix):
+        blocks = [[None if block is None else stackScale(block, r[:,r0:r1], s[:,c0:c1]) for (c0, c1), block in zip(X.col_bounds, row)]
+                  for (r0, r1), row in zip(X.row_bounds, X.blocks)]
+        return(BlockMatrix(blocks, X.rows, X.cols))
+
+    X = np.asarray(X)
+    F = r[:,:,None] * s[:,None,:]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return(np.where(X >= 0, X*F, X/F))
+
+
+def multipliersUpdate(u, p, n):
+    """
+    This function returns the multipliers m such that m*p - n/m = u (GRAS), or m*p = u if n is None (RAS).
+    Items which cannot meet their target (e.g. null rows with non-null target) keep a unit multiplier.
+    """
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        if n is None:
+            return(np.where((p > 0) & (u >= 0), u/p, 1))
+        m = np.where(p > 0, (u + np.sqrt(u**2 + 4*p*n))/(2*p), np.where((n > 0) & (u < 0), -n/u, 1))
+
+    return(m)
+
+
+def iot_balance(ML_iot_0, method='GRAS', target='mean', tol=1e-9, max_iter=1000, start=None, active=None):
+    """
+    This function balances the 'Z', 'W', 'M' and 'Y' matrices of every layer through RAS or GRAS iterations.
+    Inputs:
+        ML_iot_0 - Dictionary containing IOT-like tables (dense stacks, block matrices or lists of sparse layers)
+        method   - 'RAS' (non-negative tables only) or 'GRAS' (tables with negative entries)
+        target   - Balanced products/industries totals: 'output' (row sums), 'outlays' (column sums), 'mean' of the two,
+                   or a (nL, products+industries) array. Value added, imports and final demand totals are kept,
+                   rescaled so that the overall totals of their rows and columns match
+        tol      - Maximum relative gap between output and outlays to be reached in every row
+        max_iter - Maximum number of iterations
+        start    - (r, s) multipliers returned by a previous call, used as a warm start
+        active   - List of positions of the layers to be balanced. If None, all the layers are balanced
+    Outputs:
+        ML_iot_bal  - Dictionary containing the balanced IOT-like tables, in the same representation as ML_iot_0 ('R' is unchanged)
+        multipliers - (r, s) row and column multipliers, r ordered as [products+industries, value added, imports] and
+                      s as [products+industries, final demand]
+        info        - Dictionary with 'method', 'iterations', 'time' (seconds), 'residual' (final maximum relative gap of each layer),
+                      'converged' and 'diverged' (per layer, the latter for layers stopped because their multipliers diverged)
+    """
+
+    if method not in ['RAS','GRAS']:
+        raise ValueError("Unknown balancing method '"+str(method)+"': available methods are 'RAS' and 'GRAS'")
+
+    t_start = time.perf_counter()
+
+    T = {key: ML_iot_0[key] for key in ['Z','W','M','Y']}
+
+    if method == 'RAS':
+        if any(stackNegative(X) for X in T.values()):
+            raise ValueError('RAS cannot balance tables with negative entries: use GRAS')
+        P, N = T, None
+    else:
+        P, N = {}, {}
+        for key, X in T.items():
+            P[key], N[key] = stackParts(X)
+
+    nL, n, _ = stackShape(T['Z'])
+    nW = stackShape(T['W'])[1]
+
+    def rowSums(X, s):      # Row sums of [[Z, Y], [W, 0], [M, 0]] with columns scaled by s
+        if X is None:
+            return(0)
+        return(np.concatenate([stackMatVec(X['Z'], s[:,:n]) + stackMatVec(X['Y'], s[:,n:]), stackMatVec(X['W'], s[:,:n]), stackMatVec(X['M'], s[:,:n])], 1))
+
+    def colSums(X, r):      # Column sums of [[Z, Y], [W, 0], [M, 0]] with rows scaled by r
+        if X is None:
+            return(0)
+        return(np.concatenate([stackVecMat(r[:,:n], X['Z']) + stackVecMat(r[:,n:n+nW], X['W']) + stackVecMat(r[:,n+nW:], X['M']), stackVecMat(r[:,:n], X['Y'])], 1))
+
+    def inverse(m):         # Null multipliers only occur on rows/columns without negative entries
+        with np.errstate(divide='ignore'):
+            return(np.where(m > 0, 1/m, 0))
+
+    # Targets, from the unbalanced tables
+    nR = n + nW + stackShape(T['M'])[1]
+    nC = n + stackShape(T['Y'])[2]
+    rows_0 = rowSums(P, np.ones((nL, nC))) - rowSums(N, np.ones((nL, nC)))
+    cols_0 = colSums(P, np.ones((nL, nR))) - colSums(N, np.ones((nL, nR)))
+
+
+    # Products/industries with entries only in their row or only in their column cannot be balanced: their totals are left free
+    ones_r, ones_c = np.ones((nL, nR)), np.ones((nL, nC))
+    free = (rowSums(P, ones_c) + rowSums(N, ones_c) > 0)[:,:n] != (colSums(P, ones_r) + colSums(N, ones_r) > 0)[:,:n]
+
+    u_exo, v_exo = rows_0[:,n:], cols_0[:,n:]
+    total = (u_exo.sum(1, keepdims=True) + v_exo.sum(1, keepdims=True))/2         # Value added + imports must equal final demand
+    with np.errstate(divide='ignore', invalid='ignore'):
+        u_exo = np.where(u_exo.sum(1, keepdims=True) != 0, u_exo*total/u_exo.sum(1, keepdims=True), u_exo)
+        v_exo = np.where(v_exo.sum(1, keepdims=True) != 0, v_exo*total/v_exo.sum(1, keepdims=True), v_exo)
+
+    # Iterations
+    if start is None:
+        r, s = np.ones((nL, nR)), np.ones((nL, nC))
+        cols = cols_0
+    else:
+        r, s = np.array(start[0], dtype=float), np.array(start[1], dtype=float)
+        cols = s*colSums(P, r) - (0 if N is None else colSums(N, inverse(r))*inverse(s))
+
+    mask = np.zeros((nL, 1), dtype=bool)
+    mask[list(range(nL)) if active is None else list(active)] = True
+    update = mask.copy()            # Layers still being updated
+
+    iterations = 0
+    while True:
+        p = rowSums(P, s)
+        n_r = None if N is None else rowSums(N, inverse(s))
+        rows = r*p - (0 if N is None else n_r*inverse(r))
+
+        if isinstance(target, str):
+            # Totals are not known in advance: 'mean' targets are moved at each iteration to the mean of the current
+            # output and outlays, which converges to a balanced table also where the fixed mean of the unbalanced one is not reachable
+            x_t = {'output': rows_0[:,:n], 'outlays': cols_0[:,:n], 'mean': (rows[:,:n] + cols[:,:n])/2}[target]
+        else:
+            x_t = np.asarray(target, dtype=float).reshape(nL, n)
+        u = np.concatenate([np.where(free, rows[:,:n], x_t), u_exo], 1)
+        v = np.concatenate([np.where(free, cols[:,:n], x_t), v_exo], 1)
+
+        gap = np.concatenate([np.where(free, 0, rows[:,:n] - cols[:,:n]), rows[:,n:] - u_exo, cols[:,n:] - v_exo], 1)
+        scale = np.abs(np.concatenate([x_t, u_exo, v_exo], 1))
+        residual = np.where(mask[:,0], np.max(np.abs(gap)/np.where(scale > 0, scale, 1), 1), 0)
+
+        if np.all((residual <= tol) | ~update[:,0]) or iterations == max_iter:
+            break
+
+        with np.errstate(over='ignore', invalid='ignore'):
+            r_new = np.where(update, multipliersUpdate(u, p, n_r), r)                   # Rows update
+            p = colSums(P, r_new)
+            n_c = None if N is None else colSums(N, inverse(r_new))
+            s_new = np.where(update, multipliersUpdate(v, p, n_c), s)                   # Columns update
+            cols_new = s_new*p - (0 if N is None else n_c*inverse(s_new))
+
+        # Layers whose multipliers diverge (structurally infeasible targets) are stopped at their last finite iterate
+        finite = np.all(np.isfinite(cols_new) & (r_new.max(1, keepdims=True) < 1e100) & (s_new.max(1, keepdims=True) < 1e100), 1, keepdims=True)
+        update &= finite
+        r, s, cols = np.where(finite, r_new, r), np.where(finite, s_new, s), np.where(finite, cols_new, cols)
+        iterations += 1
+
+    ML_iot_bal = dict(ML_iot_0)
+    ML_iot_bal['Z'] = stackScale(T['Z'], r[:,:n], s[:,:n])
+    ML_iot_bal['W'] = stackScale(T['W'], r[:,n:n+nW], s[:,:n])
+    ML_iot_bal['M'] = stackScale(T['M'], r[:,n+nW:], s[:,:n])
+    ML_iot_bal['Y'] = stackScale(T['Y'], r[:,:n], s[:,n:])
+
+    info = {
+            'method'     : method,
+            'iterations' : iterations,
+            'time'       : time.perf_counter() - t_start,
+            'residual'   : residual,
+            'converged'  : residual <= tol,
+            'diverged'   : mask[:,0] & ~update[:,0],
+            }
+
+    return(ML_iot_bal, (r, s), info)
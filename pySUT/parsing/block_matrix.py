@@ -0,0 +1,198 @@
+import numpy as np
+
+
+#%% Block-structured matrices
+
+"""
+The IOT-like matrices are made of supply-use blocks: Z = [[TRC, U], [V, 0]], W = [Wp, Wi], M = [Mp, Mi],
+Y = [[Yp], [0]] and R = [Rp, Ri]. The 'BlockMatrix' class exposes such matrices as logical (nL, rows, columns)
+stacks (or 2-d matrices) defined over the original blocks, without copying them into a new array.
+Null blocks are not stored. Row/column sums, matrix products and slicing are performed block-wise,
+while the full matrix is materialised only on demand ('toarray', np.asarray).
+"""
+
+class BlockMatrix:
+
+    __array_ufunc__ = None      # Products and arithmetic with numpy arrays are dispatched to the block-wise methods below
+
+    def __init__(self, blocks, rows, cols):
+        """
+        Inputs:
+            blocks - List of lists of blocks: dense (nL, r, c) stacks, dense (r, c) matrices or None for null blocks
+            rows   - List of the number of rows of each row of blocks
+            cols   - List of the number of columns of each column of blocks
+        """
+
+        self.blocks = [[None if block is None else np.asarray(block) for block in row] for row in blocks]
+        self.rows = list(rows)
+        self.cols = list(cols)
+
+        layers = [block.shape[0] for row in self.blocks for block in row if block is not None and block.ndim == 3]
+        self.nL = layers[0] if len(layers) > 0 else None
+
+        self.row_bounds = [(int(sum(self.rows[:i])), int(sum(self.rows[:i+1]))) for i in range(len(self.rows))]
+        self.col_bounds = [(int(sum(self.cols[:j])), int(sum(self.cols[:j+1]))) for j in range(len(self.cols))]
+
+
+    @property
+    def shape(self):
+        if self.nL is None:
+            return((sum(self.rows), sum(self.cols)))
+        return((self.nL, sum(self.rows), sum(self.cols)))
+
+    @property
+    def ndim(self):
+        return(len(self.shape))
+
+    @property
+    def dtype(self):
+        return(np.result_type(*[block.dtype for row in self.blocks for block in row if block is not None]))
+
+    def __len__(self):
+        return(self.shape[0])
+
+
+    def toarray(self):
+        """
+        This method materialises the full matrix as a dense array.
+        """
+
+        X = np.zeros(self.shape, dtype=self.dtype)
+        for (r0, r1), row in zip(self.row_bounds, self.blocks):
+            for (c0, c1), block in zip(self.col_bounds, row):
+                if block is not None:
+                    X[..., r0:r1, c0:c1] = block
+
+        return(X)
+
+    def __array__(self, dtype=None, copy=None):
+        X = self.toarray()
+        return(X if dtype is None else X.astype(dtype))
+
+
+    def __getitem__(self, key):
+        """
+        Layer indices and (step 1) row/column slices return block-wise views, without copying any block.
+        Any other indexing materialises the matrix.
+        """
+
+        key = key if isinstance(key, tuple) else (key,)
+
+        if self.nL is not None:
+            layer, key = key[0], key[1:]
+            if not isinstance(layer, (int, np.integer, slice)):
+                return(self.toarray()[(layer,)+key])
+        else:
+            layer = None
+
+        key = key + (slice(None),)*(2-len(key))
+        if len(key) != 2 or not all(isinstance(k, slice) and k.step in (None, 1) for k in key):
+            return(self.toarray()[((layer,) if layer is not None else ())+key])
+
+        r0, r1, _ = key[0].indices(self.shape[-2])
+        c0, c1, _ = key[1].indices(self.shape[-1])
+
+        if r1 <= r0 or c1 <= c0:
+            return(self.toarray()[((layer,) if layer is not None else ())+key])
+
+        blocks, rows, cols = [], [], []
+        for (b0, b1), row in zip(self.row_bounds, self.blocks):
+            i0, i1 = max(r0, b0), min(r1, b1)
+            if i1 <= i0:
+                continue
+            rows += [i1-i0]
+            blocks += [[]]
+            cols = []
+            for (d0, d1), block in zip(self.col_bounds, row):
+                j0, j1 = max(c0, d0), min(c1, d1)
+                if j1 <= j0:
+                    continue
+                cols += [j1-j0]
+                if block is None:
+                    blocks[-1] += [None]
+                elif layer is None or block.ndim == 2:
+                    blocks[-1] += [block[..., i0-b0:i1-b0, j0-d0:j1-d0]]
+                else:
+                    blocks[-1] += [block[layer, i0-b0:i1-b0, j0-d0:j1-d0]]
+
+        return(BlockMatrix(blocks, rows, cols))
+
+
+    def sum(self, axis=None, dtype=None, out=None, keepdims=False):
+        """
+        Row sums (sum over the columns) and column sums (sum over the rows) are computed block-wise.
+        """
+
+        if axis is not None and axis < 0:
+            axis += self.ndim
+
+        if axis == self.ndim-1:         # Sum over the columns: one (..., r, 1) vector per row of blocks
+            S = np.zeros(self.shape[:-1]+(1,))
+            for (r0, r1), row in zip(self.row_bounds, self.blocks):
+                for block in row:
+                    if block is not None:
+                        S[..., r0:r1, :] += np.sum(block, -1, keepdims=True)
+        elif axis == self.ndim-2:       # Sum over the rows: one (..., 1, c) vector per column of blocks
+            S = np.zeros(self.shape[:-2]+(1,self.shape[-1]))
+            for row in self.blocks:
+                for (c0, c1), block in zip(self.col_bounds, row):
+                    if block is not None:
+                        S[..., :, c0:c1] += np.sum(block, -2, keepdims=True)
+        else:
+            return(np.sum(self.toarray(), axis=axis, dtype=dtype, out=out, keepdims=keepdims))
+
+        if not keepdims:
+            S = S.squeeze(axis)
+
+        return(S if dtype is None else S.astype(dtype))
+
+
+    def __matmul__(self, X):
+        """
+        Block-wise product self @ X, with X a dense vector, matrix or stack.
+        """
+
+        X = np.asarray(X)
+        vector = X.ndim == 1
+        X = X[:,None] if vector else X
+
+        out = np.zeros(np.broadcast_shapes(self.shape[:-2], X.shape[:-2]) + (self.shape[-2], X.shape[-1]), dtype=np.result_type(self.dtype, X.dtype))
+        for (r0, r1), row in zip(self.row_bounds, self.blocks):
+            for (c0, c1), block in zip(self.col_bounds, row):
+                if block is not None:
+                    out[..., r0:r1, :] += block @ X[..., c0:c1, :]
+
+        return(out[...,0] if vector else out)
+
+
+    def __rmatmul__(self, X):
+        """
+        Block-wise product X @ self, with X a dense vector, matrix or stack.
+        """
+
+        X = np.asarray(X)
+        vector = X.ndim == 1
+        X = X[None,:] if vector else X
+
+        out = np.zeros(np.broadcast_shapes(self.shape[:-2], X.shape[:-2]) + (X.shape[-2], self.shape[-1]), dtype=np.result_type(self.dtype, X.dtype))
+        for (r0, r1), row in zip(self.row_bounds, self.blocks):
+            for (c0, c1), block in zip(self.col_bounds, row):
+                if block is not None:
+                    out[..., :, c0:c1] += X[..., :, r0:r1] @ block
+
+        return(out[...,0,:] if vector else out)
+
+
+    # Element-wise arithmetic materialises the matrix
+
+    def __add__(self, X):
+        return(self.toarray() + np.asarray(X))
+
+    def __radd__(self, X):
+        return(np.asarray(X) + self.toarray())
+
+    def __sub__(self, X):
+        return(self.toarray() - np.asarray(X))
+
+    def __rsub__(self, X):
+        return(np.asarray(X) - self.toarray())
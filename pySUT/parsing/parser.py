@@ -1,143 +1,270 @@
 import numpy as np
 import pandas as pd
+import scipy.sparse as sp
+from pySUT.parsing.block_matrix import BlockMatrix
+
+#%% Concordance matrices
+
+def concordance(mindex, levels):
+    """
+    This function builds the sparse concordance (aggregation) matrix mapping the items of a multi-index into the groups
+    obtained grouping it by the given levels, exactly as pandas 'groupby(level=levels).sum()' would do.
+    Inputs:
+        mindex - Multi-index of the items to be aggregated
+        levels - Level, or list of levels, according to which items are grouped
+    Outputs:
+        G      - Sparse (groups x items) concordance matrix, such that G @ X aggregates the rows of X
+        index  - Index of the groups, in the same order as returned by groupby
+    """
+    
+    grouped = pd.Series(np.zeros(len(mindex)), index=mindex).groupby(level=levels)
+    groups = np.asarray(grouped.ngroup().fillna(-1), dtype=int)      # Group of each item (-1 for items dropped by groupby)
+    index = grouped.sum().index
+    
+    items = np.flatnonzero(groups >= 0)
+    G = sp.csr_matrix((np.ones(len(items)), (groups[items], items)), shape=(len(index), len(mindex)))
+    
+    return(G, index)
+
+
+# Row and column sets of each supply-use matrix
+sut_blocks = {
+              'U'   : ('prod','ind'),
+              'TRC' : ('prod','prod'),
+              'V'   : ('ind','prod'),
+              'Wp'  : ('vadd','prod'),
+              'Wi'  : ('vadd','ind'),
+              'Mp'  : ('imp','prod'),
+              'Mi'  : ('imp','ind'),
+              'Yp'  : ('prod','fd'),
+              'Rp'  : ('exog','prod'),
+              'Ri'  : ('exog','ind'),
+              }
+
+
+def sut_concordances(multi_indices, agg_level, rect_level):
+    """
+    This function builds, once for all the matrices and layers, the concordance matrices used by 'sut_aggregation'.
+    Rows are grouped by (agg_level, rect_level), columns by agg_level.
+    Outputs:
+        G - Dictionary of (row concordance matrix, aggregated index) for each set of items
+        H - Dictionary of (column concordance matrix, aggregated index) for each set of items
+    """
+    
+    G = {key: concordance(multi_indices[key], [agg_level,rect_level]) for key in ['prod','ind','vadd','imp','exog']}
+    H = {key: concordance(multi_indices[key], agg_level) for key in ['prod','ind','fd']}
+    
+    return(G, H)
+
+
+def stackAggregate(X, G, H):
+    """
+    This function returns G @ X[l] @ H.T for every layer of a multi-layer stack (or for a single matrix).
+    Dense stacks are aggregated in one batched sparse product per side: layers are laid side by side, 
+    so that each concordance matrix is applied to the whole stack at once.
+    Sparse stacks (lists of sparse layers) are aggregated layer by layer and kept sparse.
+    Block matrices (see 'block_matrix') are aggregated block by block, without being materialised.
+    """
+    
+    if isinstance(X, BlockMatrix):
+        X_agg = 0
+        for (r0, r1), row in zip(X.row_bounds, X.blocks):
+            for (c0, c1), block in zip(X.col_bounds, row):
+                if block is not None:
+                    X_agg = X_agg + stackAggregate(block, G[:,r0:r1], H[:,c0:c1])
+        return(X_agg)
+    
+    if isinstance(X, list):
+        return([(G @ X[l] @ H.T).tocsr() for l in range(len(X))])
+    
+    if sp.issparse(X):
+        return((G @ X @ H.T).tocsr())
+    
+    X = np.asarray(X)
+    if X.ndim == 2:
+        return(np.asarray(G @ (H @ X.T).T))
+    
+    nL, nr, nc = X.shape
+    X = (H @ X.reshape(nL*nr, nc).T).T                                     # Columns aggregation of all the layers: (nL*nr, nc_agg)
+    X = X.reshape(nL, nr, -1).transpose(1,0,2).reshape(nr, -1)            # Layers side by side: (nr, nL*nc_agg)
+    X = G @ X                                                               # Rows aggregation of all the layers: (nr_agg, nL*nc_agg)
+    
+    return(np.ascontiguousarray(X.reshape(G.shape[0], nL, -1).transpose(1,0,2)))
+
+
+def sut_aggregate(ML_sut, G, H, headers):
+    """
+    This function applies row and column concordance matrices (as returned by 'sut_concordances') to every supply-use matrix.
+    Inputs:
+        ML_sut      - Dictionary containing multi-layer supply-use tables
+        G, H        - Dictionaries of (concordance matrix, aggregated index) for rows and columns of each set of items
+        headers     - Headers of the indices
+    Outputs:
+        ML_sut_agg  - Dictionary containing aggregated multi-layer supply-use tables
+        indices_agg - Dictionary containing aggregated indices
+    """
+    
+    ML_sut_agg = {}
+    for key, (rows, cols) in sut_blocks.items():
+        ML_sut_agg[key] = stackAggregate(ML_sut[key], G[rows][0], H[cols][0])
+    
+    if not sp.issparse(ML_sut_agg['Rp']):      # Dense satellite accounts are labelled as in the imported tables
+        ML_sut_agg['Rp'] = pd.DataFrame(ML_sut_agg['Rp'], index=G['exog'][1], columns=H['prod'][1])
+        ML_sut_agg['Ri'] = pd.DataFrame(ML_sut_agg['Ri'], index=G['exog'][1], columns=H['ind'][1])
+    
+    indices_agg = {
+               'prod'    : G['prod'][1],
+               'ind'     : G['ind'][1],
+               'vadd'    : G['vadd'][1],
+               'imp'     : G['imp'][1],
+               'fd'      : H['fd'][1],
+               'exog'    : G['exog'][1],
+               'headers' : headers
+               }
+    
+    return(ML_sut_agg, indices_agg)
+
+
+def nestedConcordance(G_coarse, G_fine):
+    """
+    This function returns the concordance matrix C mapping the groups of a finer aggregation into the groups of a coarser one,
+    such that C @ G_fine == G_coarse. If the finer groups are not nested into the coarser ones, None is returned.
+    """
+    
+    C = (G_coarse @ G_fine.T).tocsr()
+    C.data[:] = 1
+    
+    if (C @ G_fine != G_coarse).nnz > 0:
+        return(None)
+    
+    return(C)
+
 
 #%% Aggregation
 
 def sut_aggregation(nL, indices, multi_indices, ML_sut, agg_level,rect_level):
     """ 
     This function performs aggregation of sectors accordingly to how the indices are defined in the dedicated .xlsx file.
+    Each matrix X is aggregated as G @ X @ H.T, where G and H are sparse concordance matrices built once from the 
+    index levels and applied to the whole layer stack at once (see 'stackAggregate'). 
+    Sparse tables (see 'sparse_tables') are returned in sparse form.
     Inputs:
         nL            - Number of layers (economic + physical layers)
         indices       - Dictionary containing indices for the selected database
         multi_indices - Dictionary containing multi-indices for the selected database
         ML_sut        - Dictionary containing imported multi-layer supply-use tables
         agg_level     - Aggregation level, corresponding to the indices header position
+        rect_level    - Rectangulization level, kept as second level of the aggregated rows indices
     Outputs:
         ML_sut_agg    - Dictionary containing aggregated multi-layer supply-use tables
         indices_agg   - Dictionary containing aggregated indices        
     """
     
-    nI_agg = len(list(set(indices['ind'][agg_level])))
-    nP_agg = len(list(set(indices['prod'][agg_level])))
-    nW_agg = len(list(set(indices['vadd'][agg_level])))
-    nM_agg = len(list(set(indices['imp'][agg_level])))
-    nY_agg = len(list(set(indices['fd'][agg_level])))
-    nR_agg = len(list(set(indices['exog'][agg_level])))
-    
-    U_0   = np.zeros((nL,nP_agg,nI_agg))     # Initialising an empty multi-layer use matrix
-    TRC_0 = np.zeros((nL,nP_agg,nP_agg))     # Initialising an empty multi-layer transaction margins matrix
-    V_0   = np.zeros((nL,nI_agg,nP_agg))     # Initialising an empty multi-layer supply matrix
-    Wp_0  = np.zeros((nL,nW_agg,nP_agg))     # Initialising an empty multi-layer value added by products matrix
-    Wi_0  = np.zeros((nL,nW_agg,nI_agg))     # Initialising an empty multi-layer value added by industries matrix
-    Mp_0  = np.zeros((nL,nM_agg,nP_agg))     # Initialising an empty multi-layer imports by products matrix
-    Mi_0  = np.zeros((nL,nM_agg,nI_agg))     # Initialising an empty multi-layer imports by industries matrix
-    Yp_0  = np.zeros((nL,nP_agg,nY_agg))     # Initialising an empty multi-layer final demand matrix
-    Rp_0  = np.zeros((nL,nR_agg,nP_agg))     # Initialising an empty multi-layer exogenous transactions by products matrix
-    Ri_0  = np.zeros((nL,nR_agg,nI_agg))     # Initialising an empty multi-layer exogenous transactions by industries matrix
-        
-    indInd  = multi_indices['ind']
-    prodInd = multi_indices['prod']
-    vaddInd = multi_indices['vadd']
-    impInd  = multi_indices['imp']
-    fdInd   = multi_indices['fd']
-    exogInd = multi_indices['exog']
-
-    for l in range(nL):
-        V   = pd.DataFrame(ML_sut['V'][l,:,:], index=indInd, columns=prodInd).groupby(level=[agg_level,rect_level],axis=0).sum().groupby(level=agg_level,axis=1).sum()
-        U   = pd.DataFrame(ML_sut['U'][l,:,:], index=prodInd, columns=indInd).groupby(level=[agg_level,rect_level],axis=0).sum().groupby(level=agg_level,axis=1).sum()
-        TRC = pd.DataFrame(ML_sut['TRC'][l,:,:], index=prodInd, columns=prodInd).groupby(level=[agg_level,rect_level],axis=0).sum().groupby(level=agg_level,axis=1).sum()
-        Wp  = pd.DataFrame(ML_sut['Wp'][l,:,:], index=vaddInd, columns=prodInd).groupby(level=[agg_level,rect_level],axis=0).sum().groupby(level=agg_level,axis=1).sum()
-        Wi  = pd.DataFrame(ML_sut['Wi'][l,:,:], index=vaddInd, columns=indInd).groupby(level=[agg_level,rect_level],axis=0).sum().groupby(level=agg_level,axis=1).sum()
-        Mp  = pd.DataFrame(ML_sut['Mp'][l,:,:], index=impInd, columns=prodInd).groupby(level=[agg_level,rect_level],axis=0).sum().groupby(level=agg_level,axis=1).sum()
-        Mi  = pd.DataFrame(ML_sut['Mi'][l,:,:], index=impInd, columns=indInd).groupby(level=[agg_level,rect_level],axis=0).sum().groupby(level=agg_level,axis=1).sum()
-        Yp  = pd.DataFrame(ML_sut['Yp'][l,:,:], index=prodInd, columns=fdInd).groupby(level=[agg_level,rect_level],axis=0).sum().groupby(level=agg_level,axis=1).sum()
-        
-        V_0[l]   = V.values
-        U_0[l]   = U.values
-        TRC_0[l] = TRC.values
-        Wp_0[l]  = Wp.values
-        Wi_0[l]  = Wi.values
-        Mp_0[l]  = Mp.values
-        Mi_0[l]  = Mi.values
-        Yp_0[l]  = Yp.values
-        
-    Rp_0 = pd.DataFrame(ML_sut['Rp'].values, index=exogInd, columns=prodInd).groupby(level=[agg_level,rect_level],axis=0).sum().groupby(level=agg_level,axis=1).sum() 
-    Ri_0 = pd.DataFrame(ML_sut['Ri'].values, index=exogInd, columns=indInd).groupby(level=[agg_level,rect_level],axis=0).sum().groupby(level=agg_level,axis=1).sum() 
-    
-    ML_sut_agg = {
-                'U'   : U_0,
-                'TRC' : TRC_0,
-                'V'   : V_0,
-                'Wp'  : Wp_0,
-                'Wi'  : Wi_0,
-                'Mp'  : Mp_0,
-                'Mi'  : Mi_0,
-                'Yp'  : Yp_0,
-                'Rp'  : Rp_0,
-                'Ri'  : Ri_0,
-                }
-
-    indInd_agg  = V.index
-    prodInd_agg = U.index
-    vaddInd_agg = Wp.index
-    impInd_agg  = Mp.index
-    fdInd_agg   = Yp.columns
-    exogInd_agg = Rp_0.index
+    G, H = sut_concordances(multi_indices, agg_level, rect_level)
     
-    indices_agg = {
-               'prod'    : prodInd_agg,
-               'ind'     : indInd_agg,
-               'vadd'    : vaddInd_agg,
-               'imp'     : impInd_agg,
-               'fd'      : fdInd_agg,
-               'exog'    : exogInd_agg,
-               'headers' : indices['headers']
-               }
+    ML_sut_agg, indices_agg = sut_aggregate(ML_sut, G, H, indices['headers'])
         
     return(ML_sut_agg, indices_agg)
 
 
 
+def sut_pyramid(nL, indices, multi_indices, ML_sut, rect_levels=None):
+    """
+    This function precomputes the aggregation of the supply-use tables at every header level of 'indices.xlsx', 
+    so that switching 'agg_level' becomes a lookup. For each rect_level, levels are computed from the finest to the coarsest one:
+    each level is derived from the next finer one through the concordance between their groups, which is much smaller than 
+    the full-detail tables. Levels which are not nested into the next finer one are aggregated from the full-detail tables.
+    Inputs:
+        nL            - Number of layers (economic + physical layers)
+        indices       - Dictionary containing indices for the selected database
+        multi_indices - Dictionary containing multi-indices for the selected database
+        ML_sut        - Dictionary containing imported multi-layer supply-use tables
+        rect_levels   - List of rectangulization levels to be precomputed. If None, all the header levels are considered
+    Output:
+        pyramid       - Dictionary of (ML_sut_agg, indices_agg), as returned by 'sut_aggregation', keyed by (agg_level, rect_level)
+    """
+    
+    nH = len(indices['headers'][0])       # Number of header levels
+    if rect_levels is None:
+        rect_levels = range(nH)
+    
+    pyramid = {}
+    for rect_level in rect_levels:
+        finer = None
+        for agg_level in reversed(range(nH)):
+            G, H = sut_concordances(multi_indices, agg_level, rect_level)
+            
+            if finer is not None:
+                G_fine, H_fine, ML_fine = finer
+                C_G = {key: (nestedConcordance(G[key][0], G_fine[key][0]), G[key][1]) for key in G}
+                C_H = {key: (nestedConcordance(H[key][0], H_fine[key][0]), H[key][1]) for key in H}
+            
+            if finer is not None and all(C[0] is not None for C in list(C_G.values())+list(C_H.values())):
+                pyramid[(agg_level, rect_level)] = sut_aggregate(ML_fine, C_G, C_H, indices['headers'])
+            else:
+                pyramid[(agg_level, rect_level)] = sut_aggregate(ML_sut, G, H, indices['headers'])
+            
+            finer = (G, H, pyramid[(agg_level, rect_level)][0])
+    
+    return(pyramid)
+
+
+
+def rectLabels(indices, index_agg, key, level):
+    """
+    This function returns, for each item of an aggregated index, its label at a given header level.
+    Levels not kept in the aggregated index are looked up in the full-detail indices: this is possible only if 
+    each aggregated item is nested into a single label of the requested level.
+    Inputs:
+        indices   - Dictionary containing indices for the selected database
+        index_agg - Aggregated multi-index (e.g. indices_agg['prod']), or index (e.g. indices_agg['fd'])
+        key       - Set of items of the aggregated index (e.g. 'prod')
+        level     - Header level of the requested labels
+    Output:
+        labels    - Array of labels, one per item of the aggregated index
+    """
+    
+    names = indices['headers'][0]
+    
+    if not isinstance(index_agg, pd.MultiIndex):
+        index_agg = pd.MultiIndex.from_arrays([index_agg], names=index_agg.names)
+    
+    if names[level] in index_agg.names:       # By position: the aggregation and rectangulization levels may share their name
+        return(np.asarray(index_agg.get_level_values(list(index_agg.names).index(names[level]))))
+    
+    detail = pd.MultiIndex.from_arrays([indices[key][names.index(name)] for name in index_agg.names], names=index_agg.names)
+    mapping = pd.Series(np.asarray(indices[key][level]), index=detail)
+    
+    if mapping.groupby(level=list(range(detail.nlevels))).nunique().max() > 1:
+        raise ValueError("Aggregated '"+key+"' items are not nested into the labels of level "+str(level)+" ('"+str(names[level])+"')")
+    
+    return(mapping[~mapping.index.duplicated()].reindex(index_agg).values)
+
+
 def rectangulization(nL, indices, indices_agg, ML_iot_0, ML_iot_coeff_0, agg_level, rect_level):
     """ 
     This function performs rectangulization of multi-layer coefficients matrices accordingly to how the indices are defined in the dedicated .xlsx file.
+    Rows of every matrix and final demand columns are grouped by the labels of 'rect_level', columns of endogenous, value added, 
+    imports and exogenous matrices by the labels of 'agg_level'. Row and column concordances are built once and applied to all the 
+    layers and matrices (see 'stackAggregate'); sparse tables are kept sparse.
     Inputs:
         nL             - Number of layers (economic + physical layers)
         indices        - Dictionary containing indices for the selected database
-        multi_indices  - Dictionary containing multi-indices for the selected database
+        indices_agg    - Dictionary containing aggregated indices
+        ML_iot_0       - Dictionary containing aggregated IOT-like tables
         ML_iot_coeff_0 - Dictionary containing technical coefficients for the IOT-like tables
         agg_level      - Aggregation level, corresponding to the indices header position
+        rect_level     - Rectangulization level, or list of rectangulization levels to compare several RCOT configurations at once.
+                         Levels other than the one used for aggregation must be coarser than the aggregated items
     Outputs:
-        ML_RCOT_coeff  - Dictionary containing aggregated multi-layer supply-use tables
+        ML_RCOT_0       - Dictionary containing rectangular multi-layer tables
+        ML_RCOT_coeff_0 - Dictionary containing rectangular multi-layer coefficients
+        indices_RCOT    - Dictionary containing indices of the rectangular tables
+    If rect_level is a list, a dictionary of (ML_RCOT_0, ML_RCOT_coeff_0, indices_RCOT) keyed by rect_level is returned.
     """
     
-    nI_agg = len(list(set(indices['ind'][agg_level])))
-    nP_agg = len(list(set(indices['prod'][agg_level])))
-    nW_agg = len(list(set(indices['vadd'][agg_level])))
-    nM_agg = len(list(set(indices['imp'][agg_level])))
-    nY_agg = len(list(set(indices['fd'][agg_level])))
-    nR_agg = len(list(set(indices['exog'][agg_level])))
-
-    nI_rcot = len(list(set(indices['ind'][rect_level])))
-    nP_rcot = len(list(set(indices['prod'][rect_level])))
-    nW_rcot = len(list(set(indices['vadd'][rect_level])))
-    nM_rcot = len(list(set(indices['imp'][rect_level])))
-    nY_rcot = len(list(set(indices['fd'][rect_level])))
-    nR_rcot = len(list(set(indices['exog'][rect_level])))
-
-        
-    ZR_0   = np.zeros((nL,nP_rcot+nI_agg,nP_agg+nI_agg))     # Initialising an empty multi-layer endogenous transactions matrices
-    WR_0   = np.zeros((nL,nW_rcot,nP_agg+nI_agg))            # Initialising an empty multi-layer value added matrices
-    MR_0   = np.zeros((nL,nM_rcot,nP_agg+nI_agg))            # Initialising an empty multi-layer imports matrices
-    YR_0   = np.zeros((nL,nP_rcot+nI_agg,nY_agg))            # Initialising an empty multi-layer final demand matrices
-    RR_0   = np.zeros((nL,nR_rcot,nP_agg+nI_agg))            # Initialising an empty multi-layer exogenous transactions matrices
-
-    AR_0   = np.zeros((nL,nP_rcot+nI_agg,nP_agg+nI_agg))     # Initialising an empty multi-layer endogenous transactions matrices
-    wR_0   = np.zeros((nL,nW_rcot,nP_agg+nI_agg))            # Initialising an empty multi-layer value added matrices
-    mR_0   = np.zeros((nL,nM_rcot,nP_agg+nI_agg))            # Initialising an empty multi-layer imports matrices
-    BR_0   = np.zeros((nL,nR_rcot,nP_agg+nI_agg))            # Initialising an empty multi-layer exogenous transactions matrices
-
-       
+    from pySUT.tables.sparse_tables import denseStack
+    
     indInd  = indices_agg['ind']
     prodInd = indices_agg['prod']
     vaddInd = indices_agg['vadd']
@@ -148,61 +275,50 @@ def rectangulization(nL, indices, indices_agg, ML_iot_0, ML_iot_coeff_0, agg_lev
     zInd = prodInd.append(indInd)
     zInd = zInd.swaplevel(0,1)
     
-
-    for l in range(nL):
-        Z   = pd.DataFrame(ML_iot_0['Z'][l,:,:], index=zInd, columns=zInd).groupby(level=rect_level,axis=0).sum().groupby(level=agg_level,axis=1).sum()
-        W   = pd.DataFrame(ML_iot_0['W'][l,:,:], index=vaddInd, columns=zInd).groupby(level=agg_level,axis=0).sum().groupby(level=agg_level,axis=1).sum()
-        M   = pd.DataFrame(ML_iot_0['M'][l,:,:], index=impInd, columns=zInd).groupby(level=agg_level,axis=0).sum().groupby(level=agg_level,axis=1).sum()
-        Y   = pd.DataFrame(ML_iot_0['Y'][l,:,:], index=zInd, columns=fdInd).groupby(level=rect_level,axis=0).sum().groupby(level=rect_level,axis=1).sum()
-
-        A   = pd.DataFrame(ML_iot_coeff_0['A'][l,:,:], index=zInd, columns=zInd).groupby(level=rect_level,axis=0).sum().groupby(level=agg_level,axis=1).sum()
-        w   = pd.DataFrame(ML_iot_coeff_0['w'][l,:,:], index=vaddInd, columns=zInd).groupby(level=agg_level,axis=0).sum().groupby(level=agg_level,axis=1).sum()
-        m   = pd.DataFrame(ML_iot_coeff_0['m'][l,:,:], index=impInd, columns=zInd).groupby(level=agg_level,axis=0).sum().groupby(level=agg_level,axis=1).sum()
-        
-        ZR_0[l] = Z.values
-        WR_0[l] = W.values
-        MR_0[l] = M.values
-        YR_0[l] = Y.values
-        
-        AR_0[l] = A.values
-        wR_0[l] = w.values
-        mR_0[l] = m.values
-
-        
-    RR_0   = pd.DataFrame(ML_iot_0['R'], index=exogInd, columns=zInd).groupby(level=rect_level,axis=0).sum().groupby(level=agg_level,axis=1).sum()
-    BR_0   = pd.DataFrame(ML_iot_coeff_0['B'], index=exogInd, columns=zInd).groupby(level=rect_level,axis=0).sum().groupby(level=agg_level,axis=1).sum()
+    # Sector column concordances do not depend on the rectangulization level: they are shared among all the variants
+    # The aggregated items are (agg_level, rect_level) pairs, swapped above: agg_level labels are selected by position
+    H_z, zInd_agg = concordance(pd.MultiIndex.from_arrays([zInd.get_level_values(1)]), 0)
     
-
-    ML_RCOT_0 = {
-                'Z' : ZR_0,
-                'W' : WR_0,
-                'M' : MR_0,
-                'Y' : YR_0,
-                'R' : RR_0,
-                }
-
-    ML_RCOT_coeff_0 = {
-                      'A' : AR_0,
-                      'w' : wR_0,
-                      'm' : mR_0,
-                      'Y' : YR_0,
-                      'B' : BR_0,
-                      }
-
-    
-    indices_RCOT = {
-                   'prod/ind' : zInd,
-                   'vadd'     : vaddInd,
-                   'imp'      : impInd,
-                   'fd'       : fdInd,
-                   'exog'    : exogInd,
-                   'headers' : indices['headers']
-                   }
+    variants = {}
+    for level in (rect_level if isinstance(rect_level, list) else [rect_level]):
+        rect_name = indices['headers'][0][level]
+        labels = {
+                  'z'    : np.concatenate([rectLabels(indices, prodInd, 'prod', level), rectLabels(indices, indInd, 'ind', level)]),
+                  'vadd' : rectLabels(indices, vaddInd, 'vadd', level),
+                  'imp'  : rectLabels(indices, impInd, 'imp', level),
+                  'exog' : rectLabels(indices, exogInd, 'exog', level),
+                  }
+        G = {key: concordance(pd.MultiIndex.from_arrays([labels[key]], names=[rect_name]), 0) for key in labels}
+        H_y, fdInd_agg = concordance(pd.MultiIndex.from_arrays([rectLabels(indices, fdInd, 'fd', level)], names=[rect_name]), 0)
     
+        ML_RCOT_0 = {
+                    'Z' : stackAggregate(ML_iot_0['Z'], G['z'][0], H_z),
+                    'W' : stackAggregate(ML_iot_0['W'], G['vadd'][0], H_z),
+                    'M' : stackAggregate(ML_iot_0['M'], G['imp'][0], H_z),
+                    'Y' : stackAggregate(ML_iot_0['Y'], G['z'][0], H_y),
+                    'R' : pd.DataFrame(denseStack(stackAggregate(ML_iot_0['R'], G['exog'][0], H_z)), index=G['exog'][1], columns=zInd_agg.get_level_values(0)),
+                    }
     
-    return(ML_RCOT_0, ML_RCOT_coeff_0, indices_RCOT)
-    
+        ML_RCOT_coeff_0 = {
+                          'A' : stackAggregate(ML_iot_coeff_0['A'], G['z'][0], H_z),
+                          'w' : stackAggregate(ML_iot_coeff_0['w'], G['vadd'][0], H_z),
+                          'm' : stackAggregate(ML_iot_coeff_0['m'], G['imp'][0], H_z),
+                          'Y' : ML_RCOT_0['Y'],
+                          'B' : pd.DataFrame(denseStack(stackAggregate(ML_iot_coeff_0['B'], G['exog'][0], H_z)), index=G['exog'][1], columns=zInd_agg.get_level_values(0)),
+                          }
     
+        indices_RCOT = {
+                       'prod/ind' : zInd,
+                       'vadd'     : vaddInd,
+                       'imp'      : impInd,
+                       'fd'       : fdInd,
+                       'exog'     : exogInd,
+                       'headers'  : indices['headers']
+                       }
+        
+        variants[level] = (ML_RCOT_0, ML_RCOT_coeff_0, indices_RCOT)
     
+    if isinstance(rect_level, list):
+        return(variants)
     
-    
\ No newline at end of file
+    return(variants[rect_level])
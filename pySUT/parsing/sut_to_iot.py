@@ -1,4 +1,8 @@
 import numpy as np
+import scipy.sparse as sp
+import pandas as pd
+from pySUT.tables.sparse_tables import isSparse, stackRowSum, stackColSum
+from pySUT.parsing.block_matrix import BlockMatrix
 
 
 #%% Aggregation of supply-use tables into IOT-like framework
@@ -9,20 +13,31 @@ supply-use Input-Output framework into a conventional symmetric one.
 
 Reference: Lenzen M., Rueda-Cantuche J.M., "A note on the use of supply-use tables in impact analyses", 
            Statistics and Operations Research Transactions, 2012
+
+Sparse supply-use tables (see 'sparse_tables') are assembled block-wise into sparse IOT-like matrices.
+If 'blocks' is True, dense IOT-like matrices are returned as 'BlockMatrix' objects (see 'block_matrix') defined
+over the supply-use blocks, so that no IOT-sized array is allocated and the blocks are not copied.
 """
 
-def Z_reshape(nL,ML_sut_agg):   
+def Z_reshape(nL,ML_sut_agg,blocks=False):   
     """
     This function aggregates the Use, Supply and Transaction margins matrices into the IOT-like 'Z' endogenous transaction matrix
     Inputs:
         nL - Number of layers (economic + physical layers)
         ML_sut - Dictionary containing imported multi-layer supply-use tables
+        blocks - If True, 'Z' is returned as a block matrix over the TRC, U and V blocks
     """
     
     V_0 = ML_sut_agg['V']         # Extracting supply matrices
     U_0 = ML_sut_agg['U']         # Extracting use matrices
     TRC_0 = ML_sut_agg['TRC']     # Extracting transaction margin matrices
     
+    if isSparse(U_0):
+        return([sp.bmat([[TRC_0[l], U_0[l]], [V_0[l], None]], format='csr') for l in range(nL)])
+    
+    if blocks:
+        return(BlockMatrix([[TRC_0, U_0], [V_0, None]], [U_0.shape[1], V_0.shape[1]], [V_0.shape[2], U_0.shape[2]]))
+    
     Z_0 = np.zeros((nL, U_0.shape[1]+V_0.shape[1], V_0.shape[2]+U_0.shape[2]))                         # Defining dimensions of Z
                   
     for l in range(nL):
@@ -33,16 +48,23 @@ def Z_reshape(nL,ML_sut_agg):
     return(Z_0)
 
         
-def W_reshape(nL,ML_sut_agg):   
+def W_reshape(nL,ML_sut_agg,blocks=False):   
     """
     This function aggregates the value added given by products and by industries into the IOT-like 'W' value added matrix
     Inputs:
         nL - Number of layers (economic + physical layers)
         ML_sut - Dictionary containing imported multi-layer supply-use tables
+        blocks - If True, 'W' is returned as a block matrix over the Wp and Wi blocks
     """
     
     Wp_0 = ML_sut_agg['Wp']         # Extracting value added by products matrices
     Wi_0 = ML_sut_agg['Wi']         # Extracting value added by industries matrices
+    
+    if isSparse(Wp_0):
+        return([sp.hstack([Wp_0[l], Wi_0[l]], format='csr') for l in range(nL)])
+
+    if blocks:
+        return(BlockMatrix([[Wp_0, Wi_0]], [Wp_0.shape[1]], [Wp_0.shape[2], Wi_0.shape[2]]))
  
     W_0 = np.zeros((nL, Wp_0.shape[1], Wp_0.shape[2]+Wi_0.shape[2]))                                   # Defining dimensions of W
                   
@@ -53,16 +75,23 @@ def W_reshape(nL,ML_sut_agg):
     return(W_0)
 
 
-def M_reshape(nL,ML_sut_agg):   
+def M_reshape(nL,ML_sut_agg,blocks=False):   
     """
     This function aggregates the imports given by products and by industries into the IOT-like 'M' imports matrix
     Inputs:
         nL - Number of layers (economic + physical layers)
         ML_sut - Dictionary containing imported multi-layer supply-use tables
+        blocks - If True, 'M' is returned as a block matrix over the Mp and Mi blocks
     """
 
     Mp_0 = ML_sut_agg['Mp']         # Extracting imports by products matrices
     Mi_0 = ML_sut_agg['Mi']         # Extracting imports by industries matrices
+    
+    if isSparse(Mp_0):
+        return([sp.hstack([Mp_0[l], Mi_0[l]], format='csr') for l in range(nL)])
+
+    if blocks:
+        return(BlockMatrix([[Mp_0, Mi_0]], [Mp_0.shape[1]], [Mp_0.shape[2], Mi_0.shape[2]]))
      
     M_0 = np.zeros((nL, Mp_0.shape[1], Mp_0.shape[2]+Mi_0.shape[2]))                                   # Defining dimensions of M
                   
@@ -73,17 +102,24 @@ def M_reshape(nL,ML_sut_agg):
     return(M_0)
 
 
-def R_reshape(nL,ML_sut_agg):   
+def R_reshape(nL,ML_sut_agg,blocks=False):   
     """
     This function aggregates the exogenous transactions given by products and by industries into the IOT-like 'R' exogenous transactions matrix
     Inputs:
         L - Number of layers (economic + physical layers)
         Rp_0 - Exogenous transactions by products
         Ri_0 - Exogenous transactions by industries
+        blocks - If True, 'R' is returned as a block matrix over the Rp and Ri blocks
     """
 
     Rp_0 = ML_sut_agg['Rp']         # Extracting exogenous transactions matrix by products matrices
     Ri_0 = ML_sut_agg['Ri']         # Extracting exogenous transactions matrix by industries matrices
+    
+    if isSparse(Rp_0):
+        return(sp.hstack([Rp_0, Ri_0], format='csr'))
+    
+    if blocks:
+        return(BlockMatrix([[np.asarray(Rp_0), np.asarray(Ri_0)]], [Rp_0.shape[0]], [Rp_0.shape[1], Ri_0.shape[1]]))
      
     R_0 = np.zeros((Rp_0.shape[0], Rp_0.shape[1]+Ri_0.shape[1]))                                   # Defining dimensions of R
                   
@@ -95,7 +131,7 @@ def R_reshape(nL,ML_sut_agg):
 
 
 
-def Y_reshape(nL,ML_sut_agg,indices_agg):   
+def Y_reshape(nL,ML_sut_agg,indices_agg,blocks=False):   
     """
     This function extends the "products-sized" final demand matrix 'Yp' into a "products+industries-sized" final demand matrix 'Y'. 
     The additional industry-related rows of final demand are null. This is done for the sake of matrices management simplicity.
@@ -103,6 +139,7 @@ def Y_reshape(nL,ML_sut_agg,indices_agg):
         L - Number of layers (economic + physical layers)
         ML_sut - Dictionary containing imported multi-layer supply-use tables
         indices - Dictionary containing indices for the selected database
+        blocks - If True, 'Y' is returned as a block matrix over the Yp block, whose null industry rows are not stored
     """
 
     Yp_0 = ML_sut_agg['Yp']             # Extracting final demand by products matrices     
@@ -110,6 +147,12 @@ def Y_reshape(nL,ML_sut_agg,indices_agg):
     nI = len(indices_agg['ind'])        # Number of industries items
     nY = len(indices_agg['fd'])         # Number of industries items
     
+    if isSparse(Yp_0):
+        return([sp.vstack([Yp_0[l], sp.csr_matrix((nI, nY))], format='csr') for l in range(nL)])     # Null industry rows are not stored
+    
+    if blocks:
+        return(BlockMatrix([[Yp_0], [None]], [nP, nI], [nY]))
+    
     Y_0  = np.zeros((nL, nP+nI, nY))                                                                  # Defining dimensions of Y
                   
     for l in range(nL):
@@ -164,18 +207,13 @@ def calc_x_0(nL,ML_iot,indices,database):
     Z_0 = ML_iot['Z']                      # Extracting endogenous transaction matrices         
     Y_0 = ML_iot['Y']                      # Extracting final demand matrices
          
-    x_0 = np.zeros((nL,Z_0.shape[1],1))
+    x_0 = stackRowSum(Z_0) + stackRowSum(Y_0)          # Row sums of all the layers at once
     
-    for l in range(nL):
-        if l==0 or database=='Eurostat':
-            x_0[l] = np.sum(Z_0[l],1,keepdims=True) + np.sum(Y_0[l],1,keepdims=True)
-        elif l!=0 and database!='Eurostat':
-            x_0[l,0:nP,:] = np.sum(Z_0[l,0:nP,:],1,keepdims=True) + np.sum(Y_0[l,0:nP,:],1,keepdims=True)
+    if database!='Eurostat':
+        x_0[1:,nP:,:] = 0                  # Only the first nP rows of the physical layers are considered
 
-    for l in range(nL):
-        for i in range(x_0.shape[1]):
-            if x_0[l,i,:] == 0:
-                x_0[l,i,:] = 1            
+    x_0[x_0 == 0] = 1
+    
     return(x_0)
 
 
@@ -194,18 +232,12 @@ def calc_xT_0(nL,ML_iot,indices,database):
     W_0 = ML_iot['W']                      # Extracting endogenous transaction matrices         
     M_0 = ML_iot['M']                      # Extracting endogenous transaction matrices 
              
-    xT_0 = np.zeros((nL,1,Z_0.shape[2]))
+    xT_0 = stackColSum(Z_0) + stackColSum(W_0) + stackColSum(M_0)        # Column sums of all the layers at once
     
-    for l in range(nL):
-        if l==0 or database=='Eurostat':
-            xT_0[l] = np.sum(Z_0[l],0,keepdims=True) + np.sum(W_0[l],0,keepdims=True) + np.sum(M_0[l],0,keepdims=True)
-        elif l!=0 and database!='Eurostat':
-            xT_0[l,:,0:nP] = np.sum(Z_0[l,:,0:nP],0,keepdims=True) + np.sum(W_0[l,:,0:nP],0,keepdims=True) + np.sum(M_0[l,:,0:nP],0,keepdims=True)
+    if database!='Eurostat':
+        xT_0[1:,:,nP:] = 0                 # Only the first nP columns of the physical layers are considered
         
-    for l in range(nL):
-        for i in range(xT_0.shape[2]):
-            if xT_0[l,:,i] == 0:
-                xT_0[l,:,i] = 1
+    xT_0[xT_0 == 0] = 1
     
     return(xT_0)
 
@@ -216,17 +248,49 @@ def balance_check_0(nL,x_0,xT_0,tol):
     according to a given tollerance value (expressed as a percentage)
     """
 
-    check_0 = np.zeros((nL,x_0.shape[1],1))
-    unbalances_0 = []     # Initialising an empty list which will be populated with information about unbalanced products/industries for each layer
+    check_0 = np.abs(x_0 - xT_0.transpose(0,2,1))          # Absolute unbalances of all the layers at once
     
-    for l in range(nL):
-        for i in range(x_0.shape[1]):
-            check_0[l,i,:] = abs(x_0[l,i,:] - xT_0[l,:,i])
-            
-            if check_0[l,i,0]/x_0[l,i,0] > tol:
-                unbalances_0 += [(l,i)]   # Information about layers and products/sectors are registered as a list of tuples
+    # Information about layers and products/sectors are registered as a list of (layer, row) tuples
+    unbalances_0 = [(int(l), int(i)) for l, i in np.argwhere(check_0[:,:,0]/x_0[:,:,0] > tol)]
     
     return(check_0, unbalances_0)
 
 
+def balance_report(x_0,xT_0,indices_agg,tol,layers=None):
+    """
+    This function reports the balance of every row of every layer as a labelled table, sorted by severity 
+    (decreasing relative gap, then decreasing absolute gap).
+    Inputs:
+        x_0         - Multi-layer output vectors
+        xT_0        - Multi-layer outlays vectors
+        indices_agg - Dictionary containing aggregated indices
+        tol         - Percentage tollerance to be respected to consider a row/column as balanced
+        layers      - List of layer ids (see 'layersSelect'). If None, the first nL layers are considered
+    Output:
+        report_0    - DataFrame indexed by layer and products/industries labels, with columns 'output', 'outlays',
+                      'abs_gap', 'rel_gap' and 'unbalanced' (True where the relative gap exceeds tol)
+    """
+    
+    nL, n = x_0.shape[0], x_0.shape[1]
+    layers = list(range(nL)) if layers is None else list(layers)
+    
+    zInd = indices_agg['prod'].append(indices_agg['ind'])          # Products and industries labels
+    
+    # Layer-major multi-index built from integer codes, without hashing nL*n labels
+    index = pd.MultiIndex(levels=[layers]+list(zInd.levels), codes=[np.repeat(np.arange(nL), n)]+[np.tile(c, nL) for c in zInd.codes],
+                          names=['layer']+list(zInd.names), verify_integrity=False)
+    
+    output = x_0.reshape(-1)
+    outlays = xT_0.reshape(-1)
+    abs_gap = np.abs(output - outlays)
+    rel_gap = abs_gap/output
+    
+    order = np.lexsort((-abs_gap, -rel_gap))
+    
+    report_0 = pd.DataFrame({'output': output[order], 'outlays': outlays[order], 'abs_gap': abs_gap[order], 
+                             'rel_gap': rel_gap[order], 'unbalanced': rel_gap[order] > tol}, index=index[order])
+    
+    return(report_0)
+
+
     
\ No newline at end of file
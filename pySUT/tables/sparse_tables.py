@@ -0,0 +1,106 @@
+import numpy as np
+import scipy.sparse as sp
+
+#%% Sparse multi-layer tables
+
+"""
+In sparse mode each multi-layer stack is a list of scipy.sparse CSR matrices (one per layer) instead of a dense
+(nL, rows, columns) array, while single-layer matrices (e.g. 'Rp', 'Ri', 'R', 'B') are single CSR matrices.
+Production vectors are kept as dense (nL, n, 1) arrays in both modes.
+This set of functions converts and inspects tables in either representation.
+"""
+
+def isSparse(X):
+    """
+    This function returns True if X is a sparse matrix or a sparse multi-layer stack.
+    """
+
+    if isinstance(X, list):
+        return(len(X) > 0 and sp.issparse(X[0]))
+
+    return(sp.issparse(X))
+
+
+def sparseStack(X):
+    """
+    This function converts a dense (nL, rows, columns) stack or a 2-d matrix into its sparse representation.
+    Layers are converted one at a time, so that memory-mapped stacks are never loaded at once.
+    """
+
+    if isSparse(X):
+        return(X)
+
+    X = np.asarray(X) if not isinstance(X, np.ndarray) else X
+
+    if X.ndim == 2:
+        return(sp.csr_matrix(X))
+
+    return([sp.csr_matrix(X[l]) for l in range(X.shape[0])])
+
+
+def denseStack(X):
+    """
+    This function converts a sparse multi-layer stack, a sparse matrix or a block matrix (see 'block_matrix') into a dense array. 
+    Dense inputs are returned unchanged.
+    """
+
+    if isinstance(X, list) and isSparse(X):
+        return(np.array([X[l].toarray() for l in range(len(X))]))
+
+    if hasattr(X, 'toarray'):                  # Sparse and block matrices
+        return(X.toarray())
+
+    return(X)
+
+
+def ML_sparse(ML):
+    """
+    This function converts every matrix of a multi-layer dictionary (e.g. 'ML_sut') into its sparse representation.
+    """
+
+    return({key: sparseStack(matrix) for key, matrix in ML.items()})
+
+
+def rowSum(X):
+    """
+    This function returns the sum of each row of a dense or sparse matrix as a (rows, 1) array.
+    """
+
+    if sp.issparse(X):
+        return(np.asarray(X.sum(1)).reshape(-1,1))
+
+    return(np.sum(X,1,keepdims=True))
+
+
+def colSum(X):
+    """
+    This function returns the sum of each column of a dense or sparse matrix as a (1, columns) array.
+    """
+
+    if sp.issparse(X):
+        return(np.asarray(X.sum(0)).reshape(1,-1))
+
+    return(np.sum(X,0,keepdims=True))
+
+
+def stackRowSum(X):
+    """
+    This function returns the row sums of every layer of a dense, block or sparse multi-layer stack as a (nL, rows, 1) array.
+    Dense and block stacks are summed in a single call for all the layers.
+    """
+
+    if isinstance(X, list):
+        return(np.array([rowSum(X[l]) for l in range(len(X))]))
+
+    return(np.sum(X,-1,keepdims=True))
+
+
+def stackColSum(X):
+    """
+    This function returns the column sums of every layer of a dense, block or sparse multi-layer stack as a (nL, 1, columns) array.
+    """
+
+    if isinstance(X, list):
+        return(np.array([colSum(X[l]) for l in range(len(X))]))
+
+    return(np.sum(X,-2,keepdims=True))
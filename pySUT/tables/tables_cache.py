@@ -0,0 +1,205 @@
+import os
+import hashlib
+import pickle
+import numpy as np
+import pandas as pd
+
+cache_version = 2       # To be increased whenever the layout of the cached objects changes
+
+#%% Binary cache of imported tables
+
+"""
+This set of functions stores the imported indices and multi-layer supply-use tables into a binary cache,
+so that the Excel workbooks have to be parsed only when one of them has been modified.
+Each cache entry is keyed by database, country, year and selected layers, and it is validated against
+the modification time, size and hash of all the source workbooks.
+"""
+
+def cacheDir(database, year, country):
+    """
+    This function returns the folder in which the cache for a given database, country and year is stored.
+    """
+
+    return('pySUT/tables/'+str(database)+'/'+str(country)+'/'+str(year)+'/.cache')
+
+
+def sourceFiles(nL, database, year, country, layers=None):
+    """
+    This function lists all the workbooks read by 'indicesImport' and 'sutImport' for a given selection of layers.
+    Inputs:
+        nL       - Number of layers (economic + physical layers)
+        database - Database selected for the analysis
+        year     - Year selected for the analysis
+        country  - Country selected for the analysis
+        layers   - List of selected layer ids (see 'layersSelect')
+    Output:
+        files    - List of paths of the source workbooks
+    """
+
+    from pySUT.tables.tables_import import sut_tables, layerPath, layersSelect
+
+    path = 'pySUT/tables/'+str(database)+'/'+str(country)+'/'+str(year)
+    files = [path+'/indices.xlsx', path+'/satellite_accounts.xlsx']
+
+    for l in layersSelect(nL, layers):
+        files += [layerPath(database, year, country, l)+'/'+table+'.xlsx' for table in sut_tables.values()]
+
+    return(files)
+
+
+def fileSignature(path, hashing=True):
+    """
+    This function returns the signature of a file as a dictionary of modification time, size and (optionally) SHA-1 hash.
+    """
+
+    stat = os.stat(path)
+    signature = {
+                 'mtime' : stat.st_mtime_ns,
+                 'size'  : stat.st_size,
+                 }
+
+    if hashing:
+        sha1 = hashlib.sha1()
+        with open(path,'rb') as f:
+            for block in iter(lambda: f.read(1<<20), b''):
+                sha1.update(block)
+        signature['sha1'] = sha1.hexdigest()
+
+    return(signature)
+
+
+def cacheKey(nL, database, year, country, layers=None, sparse=False):
+    """
+    This function returns the name identifying a cache entry.
+    """
+
+    from pySUT.tables.tables_import import layersSelect
+
+    key = 'sut_v'+str(cache_version)+'_'+str(database)+'_'+str(country)+'_'+str(year)+'_L'+'-'.join(str(l) for l in layersSelect(nL, layers))
+    if sparse:
+        key += '_sparse'
+
+    return(key)
+
+
+def cacheValid(manifest, files):
+    """
+    This function checks whether a cache manifest is still consistent with the source workbooks.
+    Files whose modification time and size did not change are trusted without hashing;
+    the others are hashed and compared, so that a touched-but-unchanged workbook does not invalidate the cache.
+    Inputs:
+        manifest - Dictionary of signatures stored when the cache was written
+        files    - List of paths of the source workbooks
+    Output:
+        valid    - True if the cache can be used
+    """
+
+    if sorted(manifest.keys()) != sorted(files):
+        return(False)
+
+    for f in files:
+        if not os.path.isfile(f):
+            return(False)
+        new = fileSignature(f, hashing=False)
+        if new['mtime'] == manifest[f]['mtime'] and new['size'] == manifest[f]['size']:
+            continue
+        if new['size'] != manifest[f]['size'] or fileSignature(f)['sha1'] != manifest[f]['sha1']:
+            return(False)
+
+    return(True)
+
+
+def cacheSave(nL, database, year, country, indices, multi_indices, ML_sut, layers=None):
+    """
+    This function writes indices, multi-indices and multi-layer supply-use tables into the cache.
+    Dense matrices are stored into an uncompressed .npz archive, while labels and sparse matrices are pickled.
+    """
+
+    from pySUT.tables.sparse_tables import isSparse
+
+    sparse = isSparse(ML_sut['U'])
+    folder = cacheDir(database, year, country)
+    key = cacheKey(nL, database, year, country, layers, sparse)
+    os.makedirs(folder, exist_ok=True)
+
+    manifest = {f: fileSignature(f) for f in sourceFiles(nL, database, year, country, layers)}
+
+    np.savez(folder+'/'+key+'.npz', **{k: np.asarray(v, dtype=float) for k, v in ML_sut.items() if not isSparse(v)})
+    with open(folder+'/'+key+'.pkl','wb') as f:
+        pickle.dump({'indices': indices, 'multi_indices': multi_indices, 'manifest': manifest, 
+                     'sparse': {k: v for k, v in ML_sut.items() if isSparse(v)}}, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def cacheLoad(nL, database, year, country, layers=None, sparse=False):
+    """
+    This function loads indices, multi-indices and multi-layer supply-use tables from the cache.
+    Inputs:
+        nL       - Number of layers (economic + physical layers)
+        database - Database selected for the analysis
+        year     - Year selected for the analysis
+        country  - Country selected for the analysis
+        layers   - List of selected layer ids (see 'layersSelect')
+        sparse   - If True, the cache entry of the sparse tables is loaded
+    Outputs:
+        indices, multi_indices, ML_sut as returned by 'indicesImport' and 'sutImport', or None if the cache is missing or outdated
+    """
+
+    folder = cacheDir(database, year, country)
+    key = cacheKey(nL, database, year, country, layers, sparse)
+
+    if not (os.path.isfile(folder+'/'+key+'.npz') and os.path.isfile(folder+'/'+key+'.pkl')):
+        return(None)
+
+    with open(folder+'/'+key+'.pkl','rb') as f:
+        labels = pickle.load(f)
+
+    if not cacheValid(labels['manifest'], sourceFiles(nL, database, year, country, layers)):
+        return(None)
+
+    with np.load(folder+'/'+key+'.npz') as archive:
+        ML_sut = {k: archive[k] for k in archive.files}
+    ML_sut.update(labels.get('sparse', {}))
+
+    if not sparse:
+        ML_sut['Rp'] = pd.DataFrame(ML_sut['Rp'])      # Satellite accounts are handled as DataFrames, as returned by 'sutImport'
+        ML_sut['Ri'] = pd.DataFrame(ML_sut['Ri'])
+
+    ML_sut = {k: ML_sut[k] for k in ['U','TRC','V','Wp','Wi','Mp','Mi','Yp','Rp','Ri']}
+
+    return(labels['indices'], labels['multi_indices'], ML_sut)
+
+
+def pyramidSave(nL, database, year, country, pyramid, layers=None, sparse=False):
+    """
+    This function writes the aggregation pyramid (see 'sut_pyramid') into the cache, next to the imported tables entry.
+    """
+
+    folder = cacheDir(database, year, country)
+    key = cacheKey(nL, database, year, country, layers, sparse)
+    os.makedirs(folder, exist_ok=True)
+
+    manifest = {f: fileSignature(f) for f in sourceFiles(nL, database, year, country, layers)}
+
+    with open(folder+'/'+key+'_pyramid.pkl','wb') as f:
+        pickle.dump({'pyramid': pyramid, 'manifest': manifest}, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def pyramidLoad(nL, database, year, country, layers=None, sparse=False):
+    """
+    This function loads the aggregation pyramid from the cache.
+    It returns None if the pyramid is missing or any of its source workbooks was modified.
+    """
+
+    folder = cacheDir(database, year, country)
+    key = cacheKey(nL, database, year, country, layers, sparse)
+
+    if not os.path.isfile(folder+'/'+key+'_pyramid.pkl'):
+        return(None)
+
+    with open(folder+'/'+key+'_pyramid.pkl','rb') as f:
+        cached = pickle.load(f)
+
+    if not cacheValid(cached['manifest'], sourceFiles(nL, database, year, country, layers)):
+        return(None)
+
+    return(cached['pyramid'])
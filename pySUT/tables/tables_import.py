@@ -4,60 +4,104 @@ import numpy as np
 #%% Tables import
 
 
+# Sheets of 'indices.xlsx' containing the labels of each set of items
+index_sheets = ['prod','ind','vadd','imp','fd','exog']
+
+
 def indicesImport(database,  year, country):
     """
     This function will import the indices for standard matrices from a ready-to-use database for a given country and year.
+    All the sheets of 'indices.xlsx' are parsed in a single opening of the workbook. The labels of each header level 
+    are stored as integer-coded categorical arrays, from which the multi-indices are built without re-hashing the labels.
     Inputs:
         database - Database selected for the analysis
         year     - Year selected for the analysis
         country  - Country selected for the analysis
     Outputs:
-        indices       - Dictionary containing indices for the selected database
+        indices       - Dictionary containing indices for the selected database (one pd.Categorical per header level)
         multi_indices - Dictionary containing multi-indices for the selected database
     """
-            
-    headers = pd.read_excel('pySUT/tables/'+str(database)+'/'+str(country)+'/'+str(year)+'/indices.xlsx',"headers", header=None, index_col=None).values.tolist()     # Importing headers for each indices column
-
-    indProd = pd.read_excel('pySUT/tables/'+str(database)+'/'+str(country)+'/'+str(year)+'/indices.xlsx',"prod", header=None, index_col=None).values.T.tolist()      # Products indices
-    indInd  = pd.read_excel('pySUT/tables/'+str(database)+'/'+str(country)+'/'+str(year)+'/indices.xlsx',"ind", header=None, index_col=None).values.T.tolist()       # Industries indices
-    indVadd = pd.read_excel('pySUT/tables/'+str(database)+'/'+str(country)+'/'+str(year)+'/indices.xlsx',"vadd", header=None, index_col=None).values.T.tolist()      # Value added indices
-    indImp  = pd.read_excel('pySUT/tables/'+str(database)+'/'+str(country)+'/'+str(year)+'/indices.xlsx',"imp", header=None, index_col=None).values.T.tolist()       # Imports indices
-    indFd   = pd.read_excel('pySUT/tables/'+str(database)+'/'+str(country)+'/'+str(year)+'/indices.xlsx',"fd", header=None, index_col=None).values.T.tolist()        # Final demand indices
-    indExog = pd.read_excel('pySUT/tables/'+str(database)+'/'+str(country)+'/'+str(year)+'/indices.xlsx',"exog", header=None, index_col=None).values.T.tolist()      # Exogenous resources indices                 
-
-    indices = {
-               'prod'    : indProd,
-               'ind'     : indInd,
-               'vadd'    : indVadd,
-               'imp'     : indImp,
-               'fd'      : indFd,
-               'exog'    : indExog,
-               'headers' : headers
-               }
+    
+    sheets = pd.read_excel('pySUT/tables/'+str(database)+'/'+str(country)+'/'+str(year)+'/indices.xlsx',['headers']+index_sheets, header=None, index_col=None)
+    
+    headers = sheets['headers'].values.tolist()     # Importing headers for each indices column
+    
+    indices = {}
+    multi_indices = {}
+    
+    for key in index_sheets:      # Products, industries, value added, imports, final demand and exogenous resources indices
+        levels = [pd.Categorical(sheets[key][c].values) for c in sheets[key].columns]
+        indices[key] = levels
+        multi_indices[key] = pd.MultiIndex(levels=[level.categories for level in levels], codes=[level.codes for level in levels], names=headers[0], verify_integrity=False)
 
-    # Multi-indices generation
-    mindProd = pd.MultiIndex.from_arrays(indProd, names=headers[0])   # Products multi-index
-    mindInd  = pd.MultiIndex.from_arrays(indInd, names=headers[0])    # Industries multi-index
-    mindVadd = pd.MultiIndex.from_arrays(indVadd, names=headers[0])   # Value added multi-index
-    mindImp  = pd.MultiIndex.from_arrays(indImp, names=headers[0])    # Imports multi-index
-    mindFd   = pd.MultiIndex.from_arrays(indFd, names=headers[0])     # Final demand multi-index
-    mindExog = pd.MultiIndex.from_arrays(indExog, names=headers[0])   # Exogenous resources multi-index
-
-    multi_indices = {
-               'prod'    : mindProd,
-               'ind'     : mindInd,
-               'vadd'    : mindVadd,
-               'imp'     : mindImp,
-               'fd'      : mindFd,
-               'exog'    : mindExog,
-               'headers' : headers
-               }
+    indices['headers'] = headers
+    multi_indices['headers'] = headers
         
     return(indices, multi_indices)
 
 
 
-def sutImport(nL, database, year, country, indices):
+# Workbooks composing each layer, associated to the corresponding key of the multi-layer supply-use tables dictionary
+sut_tables = {
+              'U'   : 'use',          # Use matrix
+              'TRC' : 'trc',          # Transaction margins matrix
+              'V'   : 'supply',       # Supply matrix
+              'Wi'  : 'va_ind',       # Value added by industries matrix
+              'Wp'  : 'va_prod',      # Value added by products matrix
+              'Mi'  : 'imp_ind',      # Imports by industries matrix
+              'Mp'  : 'imp_prod',     # Imports by products matrix
+              'Yp'  : 'fd',           # Final demand matrix
+              }
+
+
+def layerPath(database, year, country, l):
+    """
+    This function returns the folder containing the workbooks of layer 'l' (0 == economic layer).
+    """
+    
+    if l==0:
+        return('pySUT/tables/'+str(database)+'/'+str(country)+'/'+str(year)+'/Economic_layer')
+    else:
+        return('pySUT/tables/'+str(database)+'/'+str(country)+'/'+str(year)+'/Physical_layer_'+str(l))
+
+
+def layersSelect(nL, layers=None):
+    """
+    This function returns the list of ids of the layers to be considered in the analysis.
+    Inputs:
+        nL     - Number of layers (economic + physical layers), used when no selection is given
+        layers - List of layers to be considered, given as ids (0 == economic layer, l == 'Physical_layer_l') 
+                 or as folder names (e.g. 'Economic_layer', 'Physical_layer_2'). If None, the first nL layers are considered
+    Output:
+        layers - Sorted list of layer ids. The economic layer is always the first one, since the coefficients 
+                 of every layer are calculated as a function of the economic production vector
+    """
+    
+    if layers is None:
+        return(list(range(nL)))
+    
+    ids = []
+    for layer in layers:
+        if isinstance(layer, str):
+            layer = 0 if layer == 'Economic_layer' else int(layer.replace('Physical_layer_',''))
+        ids += [int(layer)]
+    
+    if 0 not in ids:
+        raise ValueError('The economic layer (0) must be included in the selected layers')
+    
+    return(sorted(set(ids)))
+
+
+def tableRead(path, sheet=0):
+    """
+    This function reads a single header-less sheet and returns its values.
+    It is defined at module level so that it can be dispatched to worker processes.
+    """
+    
+    return(pd.read_excel(path,sheet,header=None,index_col=None).values)
+
+
+def sutImport(nL, database, year, country, indices, workers=1, layers=None, sparse=False):
     """
     This function will import the standard matrices from a ready-to-use database for a given country and year.
     Eurostat supply-use database is currently the only available database pySUT is currently able to import and download into the desired format.
@@ -69,47 +113,37 @@ def sutImport(nL, database, year, country, indices):
         year     - Year selected for the analysis
         country  - Country selected for the analysis
         indices  - Dictionary containing indices for the selected database
+        workers  - Number of worker processes reading the workbooks. If 1 the workbooks are read serially.
+                   N.B.: where processes are spawned (Windows, macOS) the calling script must be guarded by "if __name__ == '__main__':"
+        layers   - List of layer ids to be imported (see 'layersSelect'). Layer layers[i] is stored in position i of the stacks,
+                   while unselected layers are neither read nor allocated. If None, the first nL layers are imported
+        sparse   - If True, each matrix is converted into a scipy.sparse CSR matrix as soon as it is read and the multi-layer 
+                   stacks are returned as lists of sparse layers (see 'sparse_tables'), so that no dense stack is allocated
     Output:
         ML_sut   - Dictionary containing imported multi-layer supply-use tables
     """
 
+    layers = layersSelect(nL, layers)
+    nL = len(layers)
+    
     nP = len(indices['prod'][0])     # Number of products items
     nI = len(indices['ind'][0])      # Number of industries items
     nW = len(indices['vadd'][0])     # Number of value added items
     nM = len(indices['imp'][0])      # Number of imports items
     nY = len(indices['fd'][0])       # Number of final demand items
     
-    U_0   = np.zeros((nL,nP,nI))     # Initialising an empty multi-layer use matrix
-    TRC_0 = np.zeros((nL,nP,nP))     # Initialising an empty multi-layer transaction margins matrix
-    V_0   = np.zeros((nL,nI,nP))     # Initialising an empty multi-layer supply matrix
-    Wp_0  = np.zeros((nL,nW,nP))     # Initialising an empty multi-layer value added by products matrix
-    Wi_0  = np.zeros((nL,nW,nI))     # Initialising an empty multi-layer value added by industries matrix
-    Mp_0  = np.zeros((nL,nM,nP))     # Initialising an empty multi-layer imports by products matrix
-    Mi_0  = np.zeros((nL,nM,nI))     # Initialising an empty multi-layer imports by industries matrix
-    Yp_0  = np.zeros((nL,nP,nY))     # Initialising an empty multi-layer final demand matrix
-          
-    for l in range(nL):    
-        if l==0:   # Layer 0 == economic layer            
-            U_0[l]   = pd.read_excel('pySUT/tables/'+str(database)+'/'+str(country)+'/'+str(year)+'/Economic_layer/use.xlsx',header=None,index_col=None)                # Economic use matrix import 
-            TRC_0[l] = pd.read_excel('pySUT/tables/'+str(database)+'/'+str(country)+'/'+str(year)+'/Economic_layer/trc.xlsx',header=None,index_col=None)                # Economic transaction margins matrix import
-            V_0[l]   = pd.read_excel('pySUT/tables/'+str(database)+'/'+str(country)+'/'+str(year)+'/Economic_layer/supply.xlsx',header=None,index_col=None)             # Economic supply matrix import
-            Wi_0[l]  = pd.read_excel('pySUT/tables/'+str(database)+'/'+str(country)+'/'+str(year)+'/Economic_layer/va_ind.xlsx',header=None,index_col=None)             # Economic value added by industries matrix import
-            Wp_0[l]  = pd.read_excel('pySUT/tables/'+str(database)+'/'+str(country)+'/'+str(year)+'/Economic_layer/va_prod.xlsx',header=None,index_col=None)            # Economic value added by products matrix import
-            Mi_0[l]  = pd.read_excel('pySUT/tables/'+str(database)+'/'+str(country)+'/'+str(year)+'/Economic_layer/imp_ind.xlsx',header=None,index_col=None)            # Economic import by industries matrix import
-            Mp_0[l]  = pd.read_excel('pySUT/tables/'+str(database)+'/'+str(country)+'/'+str(year)+'/Economic_layer/imp_prod.xlsx',header=None,index_col=None)           # Economic import by products matrix import
-            Yp_0[l]  = pd.read_excel('pySUT/tables/'+str(database)+'/'+str(country)+'/'+str(year)+'/Economic_layer/fd.xlsx',header=None,index_col=None)                 # Economic final demand matrix import           
-        else:            
-            U_0[l]   = pd.read_excel('pySUT/tables/'+str(database)+'/'+str(country)+'/'+str(year)+'/Physical_layer_'+str(l)+'/use.xlsx',header=None,index_col=None)                # Physical use matrices import 
-            TRC_0[l] = pd.read_excel('pySUT/tables/'+str(database)+'/'+str(country)+'/'+str(year)+'/Physical_layer_'+str(l)+'/trc.xlsx',header=None,index_col=None)                # Physical transaction margins matrices import
-            V_0[l]   = pd.read_excel('pySUT/tables/'+str(database)+'/'+str(country)+'/'+str(year)+'/Physical_layer_'+str(l)+'/supply.xlsx',header=None,index_col=None)             # Physical supply matrices import
-            Wi_0[l]  = pd.read_excel('pySUT/tables/'+str(database)+'/'+str(country)+'/'+str(year)+'/Physical_layer_'+str(l)+'/va_ind.xlsx',header=None,index_col=None)             # Physical value added by industries matrices import
-            Wp_0[l]  = pd.read_excel('pySUT/tables/'+str(database)+'/'+str(country)+'/'+str(year)+'/Physical_layer_'+str(l)+'/va_prod.xlsx',header=None,index_col=None)            # Physical value added by products matrices import
-            Mi_0[l]  = pd.read_excel('pySUT/tables/'+str(database)+'/'+str(country)+'/'+str(year)+'/Physical_layer_'+str(l)+'/imp_ind.xlsx',header=None,index_col=None)            # Physical import by industries matrices import
-            Mp_0[l]  = pd.read_excel('pySUT/tables/'+str(database)+'/'+str(country)+'/'+str(year)+'/Physical_layer_'+str(l)+'/imp_prod.xlsx',header=None,index_col=None)           # Physical import by products matrices import
-            Yp_0[l]  = pd.read_excel('pySUT/tables/'+str(database)+'/'+str(country)+'/'+str(year)+'/Physical_layer_'+str(l)+'/fd.xlsx',header=None,index_col=None)                 # Physical final demand matrices import             
-
-    Rp_0 = pd.read_excel('pySUT/tables/'+str(database)+'/'+str(country)+'/'+str(year)+'/satellite_accounts.xlsx','exog_prod',header=None,index_col=None)     # Exogenous transactions by products matrix import
-    Ri_0 = pd.read_excel('pySUT/tables/'+str(database)+'/'+str(country)+'/'+str(year)+'/satellite_accounts.xlsx','exog_ind',header=None,index_col=None)      # Exogenous transactions by industries matrix import
+    if sparse:
+        import scipy.sparse as sp
+        U_0, TRC_0, V_0, Wp_0, Wi_0, Mp_0, Mi_0, Yp_0 = [[None]*nL for i in range(8)]     # Lists of sparse layers
+    else:
+        U_0   = np.zeros((nL,nP,nI))     # Initialising an empty multi-layer use matrix
+        TRC_0 = np.zeros((nL,nP,nP))     # Initialising an empty multi-layer transaction margins matrix
+        V_0   = np.zeros((nL,nI,nP))     # Initialising an empty multi-layer supply matrix
+        Wp_0  = np.zeros((nL,nW,nP))     # Initialising an empty multi-layer value added by products matrix
+        Wi_0  = np.zeros((nL,nW,nI))     # Initialising an empty multi-layer value added by industries matrix
+        Mp_0  = np.zeros((nL,nM,nP))     # Initialising an empty multi-layer imports by products matrix
+        Mi_0  = np.zeros((nL,nM,nI))     # Initialising an empty multi-layer imports by industries matrix
+        Yp_0  = np.zeros((nL,nP,nY))     # Initialising an empty multi-layer final demand matrix
     
     ML_sut = {
                'U'   : U_0,
@@ -120,11 +154,27 @@ def sutImport(nL, database, year, country, indices):
                'Mp'  : Mp_0,
                'Mi'  : Mi_0,
                'Yp'  : Yp_0,
-               'Rp'  : Rp_0,
-               'Ri'  : Ri_0,
                }
-
+    
+    satellite = 'pySUT/tables/'+str(database)+'/'+str(country)+'/'+str(year)+'/satellite_accounts.xlsx'
+    
+    # List of (key, layer, path, sheet) reading jobs: 8 workbooks per layer + 2 satellite sheets
+    jobs = [(key, l, layerPath(database, year, country, layer)+'/'+table+'.xlsx', 0) for l, layer in enumerate(layers) for key, table in sut_tables.items()]
+    jobs += [('Rp', None, satellite, 'exog_prod'), ('Ri', None, satellite, 'exog_ind')]
+    
+    if workers > 1:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            tables = list(pool.map(tableRead, [job[2] for job in jobs], [job[3] for job in jobs]))
+    else:
+        tables = map(tableRead, [job[2] for job in jobs], [job[3] for job in jobs])      # Lazily read, one workbook at a time
+    
+    for (key, l, path, sheet), table in zip(jobs, tables):
+        if sparse:
+            table = sp.csr_matrix(table.astype(float))
+        if l is None:
+            ML_sut[key] = table if sparse else pd.DataFrame(table)      # Exogenous transactions by products/industries matrices import
+        else:
+            ML_sut[key][l] = table                                      # Economic (l == 0) and physical matrices import
 
     return(ML_sut)
-
-
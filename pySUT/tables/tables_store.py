@@ -0,0 +1,155 @@
+import os
+import pickle
+import numpy as np
+from pySUT.tables.sparse_tables import isSparse
+
+#%% Memory-mapped layered table store
+
+"""
+This set of functions converts the Excel folder layout under 'tables/database/country/year' into a store of
+binary .npy files, one (nL, rows, columns) stack per matrix, which are then opened as read-only memory maps.
+Functions receiving the store matrices work on numpy views of the files: only the pages touched by a computation
+are loaded in memory, so that large multi-layer databases can be handled without holding every stack in RAM.
+"""
+
+def storeDir(database, year, country):
+    """
+    This function returns the folder in which the memory-mapped store for a given database, country and year is saved.
+    """
+
+    return('pySUT/tables/'+str(database)+'/'+str(country)+'/'+str(year)+'/store')
+
+
+def storeConvert(nL, database, year, country, layers=None):
+    """
+    This function converts the Excel workbooks of a database into the memory-mapped store.
+    Each workbook is read and written into the corresponding layer of the stack file before reading the next one,
+    so that at most one sheet is held in memory at a time.
+    Inputs:
+        nL       - Number of layers (economic + physical layers) to be converted
+        database - Database selected for the analysis
+        year     - Year selected for the analysis
+        country  - Country selected for the analysis
+        layers   - List of layer ids to be converted (see 'layersSelect'). If None, the first nL layers are converted
+    """
+
+    from pySUT.tables.tables_import import indicesImport, sut_tables, layerPath, tableRead, layersSelect
+    from pySUT.tables.tables_cache import sourceFiles, fileSignature
+
+    folder = storeDir(database, year, country)
+    os.makedirs(folder, exist_ok=True)
+
+    layers = layersSelect(nL, layers)
+    nL = len(layers)
+
+    indices, multi_indices = indicesImport(database,  year, country)
+
+    nP = len(indices['prod'][0])     # Number of products items
+    nI = len(indices['ind'][0])      # Number of industries items
+    nW = len(indices['vadd'][0])     # Number of value added items
+    nM = len(indices['imp'][0])      # Number of imports items
+    nY = len(indices['fd'][0])       # Number of final demand items
+
+    shapes = {
+              'U'   : (nL,nP,nI),
+              'TRC' : (nL,nP,nP),
+              'V'   : (nL,nI,nP),
+              'Wi'  : (nL,nW,nI),
+              'Wp'  : (nL,nW,nP),
+              'Mi'  : (nL,nM,nI),
+              'Mp'  : (nL,nM,nP),
+              'Yp'  : (nL,nP,nY),
+              }
+
+    for key, table in sut_tables.items():
+        stack = np.lib.format.open_memmap(folder+'/'+key+'.npy', mode='w+', dtype=float, shape=shapes[key])
+        for l, layer in enumerate(layers):
+            stack[l] = tableRead(layerPath(database, year, country, layer)+'/'+table+'.xlsx')
+        stack.flush()
+        del stack
+
+    satellite = 'pySUT/tables/'+str(database)+'/'+str(country)+'/'+str(year)+'/satellite_accounts.xlsx'
+    np.save(folder+'/Rp.npy', tableRead(satellite,'exog_prod').astype(float))      # Exogenous transactions by products matrix
+    np.save(folder+'/Ri.npy', tableRead(satellite,'exog_ind').astype(float))       # Exogenous transactions by industries matrix
+
+    manifest = {f: fileSignature(f) for f in sourceFiles(nL, database, year, country, layers)}
+
+    with open(folder+'/labels.pkl','wb') as f:
+        pickle.dump({'layers': layers, 'indices': indices, 'multi_indices': multi_indices, 'manifest': manifest}, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def storeImport(nL, database, year, country, layers=None):
+    """
+    This function opens the memory-mapped store of a database, converting the Excel workbooks first
+    if the store is missing, does not contain all the selected layers or any of its source workbooks was modified.
+    Inputs:
+        nL       - Number of layers (economic + physical layers)
+        database - Database selected for the analysis
+        year     - Year selected for the analysis
+        country  - Country selected for the analysis
+        layers   - List of layer ids to be opened (see 'layersSelect'). If None, the first nL layers are opened
+    Outputs:
+        indices       - Dictionary containing indices for the selected database
+        multi_indices - Dictionary containing multi-indices for the selected database
+        ML_sut        - Dictionary containing read-only memory-mapped multi-layer supply-use tables
+    """
+
+    from pySUT.tables.tables_import import layersSelect
+    from pySUT.tables.tables_cache import sourceFiles, cacheValid
+
+    layers = layersSelect(nL, layers)
+    folder = storeDir(database, year, country)
+
+    labels = {}
+    if os.path.isfile(folder+'/labels.pkl'):
+        with open(folder+'/labels.pkl','rb') as f:
+            labels = pickle.load(f)
+    stored = labels.get('layers', [])       # Layers already converted into the store
+
+    if not set(layers) <= set(stored) or not cacheValid(labels['manifest'], sourceFiles(nL, database, year, country, stored)):
+        storeConvert(nL, database, year, country, sorted(set(layers) | set(stored)))      # Previously stored layers are kept in the store
+        with open(folder+'/labels.pkl','rb') as f:
+            labels = pickle.load(f)
+
+    positions = [labels['layers'].index(l) for l in layers]     # Positions of the selected layers in the store stacks
+    if positions == list(range(positions[0], positions[-1]+1)):
+        selection = slice(positions[0], positions[-1]+1)        # Contiguous layers are sliced as a view, no data is read
+    else:
+        selection = positions                                   # Only the pages of the selected layers are read
+
+    ML_sut = {}
+    for key in ['U','TRC','V','Wp','Wi','Mp','Mi','Yp']:
+        ML_sut[key] = np.load(folder+'/'+key+'.npy', mmap_mode='r')[selection]
+    ML_sut['Rp'] = np.load(folder+'/Rp.npy', mmap_mode='r')
+    ML_sut['Ri'] = np.load(folder+'/Ri.npy', mmap_mode='r')
+
+    return(labels['indices'], labels['multi_indices'], ML_sut)
+
+
+def storeDump(ML, database, year, country, name):
+    """
+    This function writes a dictionary of matrices (e.g. 'ML_sut_agg', 'ML_iot_0') into the store and
+    returns the same dictionary with the matrices replaced by read-only memory maps, so that the in-memory copies can be released.
+    Sparse matrices and stacks of sparse layers (see 'sparse_tables') cannot be memory-mapped: being already compact, they are kept in memory.
+    Inputs:
+        ML       - Dictionary of matrices
+        database - Database selected for the analysis
+        year     - Year selected for the analysis
+        country  - Country selected for the analysis
+        name     - Name of the sub-folder of the store in which the matrices are saved
+    Output:
+        ML_mmap  - Dictionary containing the memory-mapped matrices
+    """
+
+    folder = storeDir(database, year, country)+'/'+str(name)
+    os.makedirs(folder, exist_ok=True)
+
+    ML_mmap = {}
+    for key, matrix in ML.items():
+        if isSparse(matrix):
+            ML_mmap[key] = matrix
+            continue
+        np.save(folder+'/'+key+'.npy', np.asarray(matrix, dtype=float))
+        ML_mmap[key] = np.load(folder+'/'+key+'.npy', mmap_mode='r')
+
+    return(ML_mmap)
@@ -13,35 +13,97 @@ country = 'Mozambique'
 year = 2015
 
 nL = 3                     # Number of layers to be considered. If 1 the model will perform an economic single-layer analysis
+layers = None              # Optional selection of layers, as ids (0 - economic layer, l - 'Physical_layer_l') or folder names, e.g. [0,2].
+                           # The economic layer must always be included. If None, the first nL layers are considered
 
 tol = 0.05
+balancing = None           # Options: None - No balancing
+                           #          RAS/GRAS - Layers with unbalances beyond tol are rebalanced after the IOT-like conversion (GRAS handles negative entries)
+
+cache = True               # If True, imported tables are stored into a binary cache and reloaded as long as the source workbooks are unchanged
+workers = 1                # Number of processes reading the workbooks (and of threads solving the layers of the Leontief models) in parallel. If 1 both run serially
+storage = 'ram'            # Options: ram  - Tables are held in memory as dense arrays
+                           #          mmap - Tables are converted once into memory-mapped files under 'tables/database/country/year/store'
+sparse = False             # If True, tables are handled as scipy.sparse matrices from import to the Leontief models
+iot_blocks = False         # If True, the dense IOT-like matrices are views over the supply-use blocks rather than new arrays
+
+solver = 'lu'              # Options: lu             - Leontief models solved through the LU factorization of (I - A)
+                           #          gmres/bicgstab - Preconditioned iterative solvers, for large sparse coefficients
+                           #          series         - Truncated Leontief power series, with error bound (estimate if ||A|| >= 1)
+solver_tol = 1e-10         # Relative tolerance of the iterative solvers and of the power series
 
 analysis = 'RCOT'            # Options: No - No analysis will be performed
                            #          SA - Shock analysis
+shock_spec = None          # Path of the shock specification (.csv, .json, .yaml) of the shock analysis. If None, the shocks are input through Excel files
+hem_level = None           # Level of the products/industries indices grouping the sectors extracted together (see 'hem_application'). If None, every sector is extracted alone
 
 agg_level = 1              # Starts from 0. This parameter indicates the aggregation level according to which the aggregation process shall be performed. 
                            # Levels of aggregation are to be intended as the columns of the 'headers' sheet in 'tables/database/country/year/indices.xlsx' file.
-rect_level = 0
+rect_level = 0             # Rectangulization level, or list of levels to compare several RCOT configurations at once
+                           # (the tables are then aggregated at the first level of the list)
+pyramid = False            # If True, the tables are aggregated once at every header level (and cached, if cache is True), 
+                           # so that changing agg_level/rect_level is a lookup rather than a new aggregation
 
 # from downloader import*   COMING SOON (HOPEFULLY)
 
-from data_handle import tables_import, sut_to_iot, technical_coefficients, calc_E_0
-indices, multi_indices, ML_sut = tables_import(nL, database, year, country)
+from pySUT.tables.tables_import import layersSelect
+layers = layersSelect(nL, layers)
+nL = len(layers)           # From now on, position l of each multi-layer stack refers to layer layers[l]
+
+from data_handle import tables_import, sut_to_iot, technical_coefficients, calc_E_0, calc_p_0
+indices, multi_indices, ML_sut = tables_import(nL, database, year, country, cache, workers, storage, layers, sparse)
+
+sut_rect_level = rect_level[0] if isinstance(rect_level, list) else rect_level     # Aggregation requires a single level
+
+if pyramid:
+    from data_handle import aggregation_pyramid
+    ML_sut_agg, indices_agg = aggregation_pyramid(nL, database, year, country, indices, multi_indices, ML_sut, layers, cache)[(agg_level, sut_rect_level)]
+else:
+    from pySUT.parsing.parser import sut_aggregation
+    ML_sut_agg, indices_agg = sut_aggregation(nL, indices, multi_indices, ML_sut, agg_level,sut_rect_level)
+
+if storage == 'mmap':
+    from pySUT.tables.tables_store import storeDump
+    ML_sut_agg = storeDump(ML_sut_agg, database, year, country, 'sut_agg')
 
-from pySUT.parsing.parser import sut_aggregation
-ML_sut_agg, indices_agg = sut_aggregation(nL, indices, multi_indices, ML_sut, agg_level,rect_level)
+ML_iot_0, x_0, xT_0, check_0, unbalances_0, report_0 = sut_to_iot(nL, database, year, country, tol, indices_agg, ML_sut_agg, iot_blocks, layers)
 
-ML_iot_0, x_0, xT_0, check_0, unbalances_0 = sut_to_iot(nL, database, year, country, tol, indices_agg, ML_sut_agg)
+if balancing is not None and len(unbalances_0) > 0:
+    from data_handle import iot_balancing
+    ML_iot_0, x_0, xT_0, check_0, unbalances_0, report_0, multipliers_0, info_0 = iot_balancing(nL, database, tol, indices_agg, ML_iot_0, unbalances_0, balancing, layers=layers)
+
+if storage == 'mmap':
+    ML_iot_0 = storeDump(ML_iot_0, database, year, country, 'iot_0')
 ML_iot_coeff_0 = technical_coefficients(ML_iot_0, x_0)
-E_0 = calc_E_0(ML_iot_coeff_0,x_0)
+E_0 = calc_E_0(ML_iot_coeff_0,x_0,solver,solver_tol)
+p_0 = calc_p_0(ML_iot_coeff_0,None,solver,solver_tol)
 
 if analysis == 'RCOT':
     from pySUT.parsing.parser import rectangulization
-    ML_RCOT_0, ML_RCOT_coeff_0, indices_RCOT = rectangulization(nL, indices, indices_agg, ML_iot_0, ML_iot_coeff_0, agg_level, rect_level)
+    if isinstance(rect_level, list):
+        RCOT_variants = rectangulization(nL, indices, indices_agg, ML_iot_0, ML_iot_coeff_0, agg_level, rect_level)      # (ML_RCOT_0, ML_RCOT_coeff_0, indices_RCOT) of each level
+    else:
+        ML_RCOT_0, ML_RCOT_coeff_0, indices_RCOT = rectangulization(nL, indices, indices_agg, ML_iot_0, ML_iot_coeff_0, agg_level, rect_level)
+
+# from core import analysis_application, price_application
+# ML_iot_1, x_1 = analysis_application(nL, analysis, ML_iot_coeff_0, indices_agg, multi_indices, layers, solver, solver_tol, workers, shock_spec)
+# p_1 = price_application(nL, technical_coefficients(ML_iot_1, x_1), None, solver, solver_tol, workers)
+
+# from core import scenario_application
+# ML_scenarios_1 = scenario_application(nL, ML_iot_coeff_0, delta_Y_scenarios, solver, solver_tol, workers)
+
+# from core import uncertainty_application
+# ML_mc = uncertainty_application(nL, ML_iot_coeff_0, {'A': {'dist': 'lognormal', 'scale': 0.1}, 'Y': {'dist': 'normal', 'scale': 0.05}}, 10000, workers=workers)
+
+# from core import hem_application
+# x_loss, E_loss = hem_application(nL, ML_iot_coeff_0, indices_agg, hem_level, solver, solver_tol, workers)
+
+# from core import sensitivity_application
+# ML_sens, ML_elas, top = sensitivity_application(nL, ML_iot_coeff_0, indices_agg, 'E', None, 10, 0, solver, solver_tol)
 
-# from core import analysis_application
-# ML_iot_1, x_1 = analysis_application(nL, analysis, ML_iot_coeff_0, indices_agg, multi_indices)
+# from core import spa_application
+# paths_0, info_0 = spa_application(nL, ML_iot_coeff_0, indices_agg, top=10, max_time=10, solver=solver, solver_tol=solver_tol)
 
 # from post_process import xlsx_export, dict_delta_1_0
 
-# delta_1_0 = xlsx_export(nL, ML_iot_0, ML_iot_1, x_0, x_1, E_0, indices_agg, database, country, year)
\ No newline at end of file
+# delta_1_0 = xlsx_export(nL, ML_iot_0, ML_iot_1, x_0, x_1, E_0, indices_agg, database, country, year, layers)
\ No newline at end of file
@@ -0,0 +1,27 @@
+import os
+import sys
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def random_system(n=6, nL=2, nR=3, nY=2, density=0.6, colsum=0.8, seed=0):
+    """
+    This function builds a small random Leontief system, productive in every layer (column sums of A capped at 'colsum' < 1).
+    Outputs:
+        A - (nL, n, n) endogenous coefficients, with a share 'density' of non-null entries
+        B - (nR, n) exogenous coefficients
+        Y - (nL, n, nY) final demand
+    """
+
+    rng = np.random.default_rng(seed)
+    A = rng.random((nL,n,n))*(rng.random((nL,n,n)) < density)
+    A *= colsum/np.maximum(A.sum(1, keepdims=True), colsum)
+
+    return(A, rng.random((nR,n)), rng.random((nL,n,nY)))
+
+
+@pytest.fixture
+def system():
+    return(random_system())
@@ -0,0 +1,44 @@
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+import pytest
+from pySUT.applications.extraction import extraction_groups, calc_x_hem, calc_hem_losses
+from pySUT.applications.shock_analysis.leontief_models import calc_L_1
+
+
+#%% Hypothetical extraction against direct solves of the reduced systems
+
+index = pd.MultiIndex.from_arrays([['s'+str(i) for i in range(6)], ['g0','g0','g1','g2','g2','g2']])
+
+
+def reduced_output(A, Y, g):
+    n = A.shape[1]
+    N = np.setdiff1d(np.arange(n), g)
+    x = np.zeros(n)
+    x[N] = np.linalg.solve(np.eye(len(N)) - A[0][np.ix_(N,N)], Y[0].sum(1)[N])
+    return(x)
+
+
+@pytest.mark.parametrize('level', [None, 1])
+@pytest.mark.parametrize('inverse', [False, True])
+def test_reduced_solves(system, level, inverse):
+    A, B, Y = system
+    groups = extraction_groups(index, level)
+    x_0, x_hem = calc_x_hem(calc_L_1(A, inverse=inverse), Y, groups)
+
+    assert np.allclose(x_0, np.linalg.solve(np.eye(A.shape[1]) - A[0], Y[0].sum(1)))
+    for j, (label, g) in enumerate(groups):
+        assert np.allclose(x_hem[:,j], reduced_output(A, Y, g))
+
+
+def test_sparse_and_losses(system):
+    A, B, Y = system
+    groups = extraction_groups(index, 1)
+    x_0, x_hem = calc_x_hem(calc_L_1([sp.csr_matrix(a) for a in A]), [sp.csr_matrix(y) for y in Y], groups)
+    x_loss, E_loss = calc_hem_losses(x_0, x_hem, sp.csr_matrix(B), groups)
+
+    for label, g in groups:
+        delta = x_0 - reduced_output(A, Y, g)
+        assert np.isclose(x_loss.loc[label, 'output_loss'], delta.sum())
+        assert np.allclose(E_loss.loc[label], B @ delta)
+    assert list(x_loss['sectors']) == [2, 1, 3]
@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+from pySUT.applications.sensitivity import calc_sensitivity, calc_elasticity, top_coefficients
+from pySUT.applications.shock_analysis.leontief_models import calc_L_1
+
+
+#%% Analytic derivatives against central finite differences
+
+def target(A, B, Y, kind, weights, layer):
+    L = np.linalg.inv(np.eye(A.shape[1]) - A[layer])
+    y = Y[layer].sum(1)
+    if kind == 'x':
+        return(weights @ L @ y)
+    if kind == 'R':
+        return(np.sum(weights*B*(L @ y)))
+    return(np.sum(weights*(B @ L)*y))
+
+
+@pytest.mark.parametrize('inverse', [False, True])
+@pytest.mark.parametrize('kind, layer', [('x',0), ('x',1), ('R',0), ('E',0)])
+def test_finite_differences(system, kind, layer, inverse):
+    A, B, Y = system
+    weights = np.linspace(0.5, 1.5, A.shape[1]) if kind == 'x' else np.linspace(0.5, 1.5, B.size).reshape(B.shape)
+    ML_sens = calc_sensitivity(calc_L_1(A, inverse=inverse), B, Y, kind, weights, layer)
+
+    assert np.isclose(ML_sens['f'], target(A, B, Y, kind, weights, layer))
+
+    h = 1e-6
+    for key in 'ABY':
+        for i in np.ndindex(ML_sens[key].shape):
+            item = i if key == 'B' else (layer,)+i
+            f = []
+            for step in [h, -h]:
+                coeff = [C.copy() for C in system]
+                coeff['ABY'.index(key)][item] += step
+                f += [target(*coeff, kind, weights, layer)]
+            assert np.isclose(ML_sens[key][i], (f[0] - f[1])/(2*h), rtol=1e-5, atol=1e-7), (key, i)
+
+
+def test_elasticity_and_top(system):
+    A, B, Y = system
+    ML_sens = calc_sensitivity(calc_L_1(A), B, Y, 'E')
+    ML_elas = calc_elasticity(ML_sens, A, B, Y)
+    assert np.allclose(ML_elas['A'], A[0]*ML_sens['A']/ML_sens['f'])
+
+    top = top_coefficients(ML_elas['A'], 5)
+    assert list(top['value']) == sorted(ML_elas['A'].ravel(), key=abs, reverse=True)[:5]
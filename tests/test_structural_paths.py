@@ -0,0 +1,55 @@
+import numpy as np
+import scipy.sparse as sp
+import pytest
+from pySUT.applications.structural_paths import pathSearch, calc_SPA
+
+
+#%% Best-first path search against brute-force enumeration
+
+def enumerate_paths(A, b, y_k, k, depth):
+    paths = []
+    def extend(path, weight):
+        paths.append((weight*b[path[-1]], tuple(path)))
+        if len(path) - 1 < depth:
+            for i in np.flatnonzero(A[:,path[-1]]):
+                extend(path+[int(i)], weight*A[i,path[-1]])
+    extend([k], y_k)
+    return(sorted(paths, reverse=True))
+
+
+@pytest.fixture
+def economy(system):
+    A, B, Y = system
+    A, b, y = A[0], B[0], Y[0].sum(1)
+    return(A, b, y, b @ np.linalg.inv(np.eye(len(y)) - A))
+
+
+@pytest.mark.parametrize('dense', [True, False])
+@pytest.mark.parametrize('k', [0, 2])
+def test_brute_force(economy, dense, k):
+    A, b, y, m = economy
+    reference = enumerate_paths(A, b, y[k], k, 4)[:15]
+    paths, info = pathSearch(A if dense else sp.csc_matrix(A), b, m, y[k], k, top=15, max_depth=4)
+
+    assert [path for value, path in paths] == [path for value, path in reference]
+    assert np.allclose([value for value, path in paths], [value for value, path in reference])
+    assert info['truncated'] is None
+
+
+def test_limits(economy):
+    A, b, y, m = economy
+    paths, info = pathSearch(A, b, m, y[2], 2, top=1000, max_nodes=20)
+    assert info['truncated'] == 'nodes' and info['expanded'] == 20
+
+    paths, info = pathSearch(A, b, m, y[2], 2, top=5, max_memory=0.0001)
+    assert info['truncated'] == 'memory'
+
+
+def test_calc_SPA(economy):
+    A, b, y, m = economy
+    paths_0, info_0 = calc_SPA({'A': A[None], 'B': b[None], 'Y': y[None,:,None]}, top=3, threshold=0)
+
+    assert np.allclose(info_0['E'], y*m)
+    assert (paths_0.groupby('sector')['rank'].max() == 3).all()
+    direct = paths_0[paths_0['length'] == 0]
+    assert np.allclose(direct['value'], (y*b)[direct['sector']])